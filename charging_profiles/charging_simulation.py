@@ -0,0 +1,208 @@
+"""
+Simulates aggregate light-duty EV charging profiles from the RAMP-mobility database (trip windows, distances, durations and start times,
+user and vehicle shares) as batched NumPy Monte-Carlo draws over every vehicle and day of the year. Writes the results in the format of the
+RAMP-mobility results (minute-level 'Charging Profile' in UTC) read by compile_transport.py
+@author: Rashid Zetter
+"""
+
+import pandas as pd
+import numpy as np
+import os
+
+survey = 'TTS2016'          # RAMP-mobility database: 'TTS2016' or 'NHTS2022'
+country = 'CA'              # Country column of the RAMP-mobility database
+province = 'ON'
+weather_year = 2018
+time_zone = 'America/Toronto'
+
+n_vehicles = 2500
+max_trips = 8               # Maximum number of trips per vehicle and day
+distance_variability = 0.3  # Daily distances vary uniformly within +/- this share of the survey's daily distance
+duration_variability = 0.5  # Trip durations vary uniformly within +/- this share of the survey's trip duration
+seed = 0
+
+# Vehicle classes of the vehicle shares: consumption (kWh/km) and battery capacity (kWh) under each battery assumption
+consumption = {'small': 0.15, 'medium': 0.18, 'large': 0.22}
+battery_scenarios = {
+    '2023-batteries': {'small': 50, 'medium': 70, 'large': 90},
+    '2030-batteries': {'small': 65, 'medium': 85, 'large': 110}
+}
+battery = battery_scenarios['2023-batteries']
+
+charging_power = 7.2        # Home charging power (kW)
+charging_efficiency = 0.9
+
+# Hourly temperatures (.csv with a UTC 'time' column and a 'temperature' column in C, e.g., from renewables.ninja; <y> is replaced by the
+# weather year). Consumption increases linearly by cold_factor (hot_factor) per degree below (above) the reference temperature.
+# None ignores temperature effects
+temperature_file = None
+reference_temperature = 20
+cold_factor = 0.012
+hot_factor = 0.006
+
+dir_path = os.path.dirname(os.path.abspath(__file__)) + '/'
+results = dir_path + 'ramp_mobility/results/'
+profile_name = f'{province}-{survey}_{weather_year}_native'
+
+users = ['Working', 'Student', 'Inactive']  # Users of the pop_share.csv columns (in lower case) and windows.csv rows
+day_types = ['weekday', 'saturday', 'sunday']
+bins = 96                                   # Quarter-hour bins of the trip start times
+
+"""
+##################################################
+    RAMP-mobility database
+##################################################
+"""
+
+def read_database(survey, country):
+    """
+    Reads the RAMP-mobility database of a survey for a country
+    """
+    path = dir_path + f'ramp_mobility/{survey}_database/database/'
+    read = lambda f, **kwargs: pd.read_csv(path + f, encoding='utf-8-sig', **kwargs).rename(columns=lambda c: str(c).strip())
+
+    db = {
+        'pop_share': read('pop_share.csv', index_col=0).loc[country].rename(lambda u: u.capitalize()),
+        'vehicle_share': read('vehicle_share.csv', index_col=0).loc[country],
+        'd_tot': read('d_tot.csv', index_col=0).loc[country],                     # Daily distance (km)
+        'd_min': read('d_min.csv', index_col=[0, 1])[country],                    # Trip distance (km) by trip type and day type
+        't_func': read('t_func.csv', index_col=[0, 1])[country],                  # Trip duration (min) by trip type and day type
+        'trips_by_time': pd.DataFrame({day_type: read(f'trips_by_time_{day_type}.csv')[country].values
+                                       for day_type in day_types})                # Share of trips starting in each hour
+    }
+
+    # Functioning windows (hours) of each user; windows with h = 1 are spent away from home
+    windows = pd.read_csv(path + 'windows.csv', header=None, encoding='utf-8-sig')
+    col = [i for i, name in enumerate(windows.iloc[0]) if str(name).strip() == country][0]
+    windows = windows.iloc[2:, [0, 1, 3, col, col + 1]]
+    windows.columns = ['user', 'activity', 'away', 'start', 'end']
+    db['windows'] = windows.astype({'away': int, 'start': float, 'end': float}).reset_index(drop=True)
+    return db
+
+def window_bins(db):
+    """
+    For each user and quarter-hour bin: whether it is in a main activity window, whether it is in any window, and the first
+    quarter-hour from then on spent at home (when charging can start)
+    """
+    middle = (np.arange(bins) + 0.5) * 24 / bins
+    main, available, home = np.zeros((len(users), bins), bool), np.zeros((len(users), bins), bool), np.zeros((len(users), bins), bool)
+
+    for u, user in enumerate(users):
+        for w in db['windows'][db['windows']['user'] == user].itertuples():
+            inside = (middle >= w.start) & (middle < w.end)
+            available[u] |= inside
+            main[u] |= inside & (w.activity == 'Main')
+            home[u] |= inside & (w.away == 0)
+
+    # Next bin at home, looking up to a full day ahead
+    ahead = np.where(np.concatenate([home, home], axis=1), np.arange(2 * bins), 2 * bins)
+    next_home = np.minimum.accumulate(ahead[:, ::-1], axis=1)[:, ::-1][:, :bins]
+    return main, available, next_home
+
+"""
+##################################################
+    Simulation
+##################################################
+"""
+
+def temperature_factor(starts_utc, weather_year):
+    """
+    Consumption factor of the temperature at the start of each trip
+    """
+    if temperature_file is None:
+        return np.ones(len(starts_utc))
+
+    temperature = pd.read_csv(temperature_file.replace('<y>', str(weather_year)), comment='#', index_col='time', parse_dates=True)['temperature']
+    temperature.index = pd.to_datetime(temperature.index, utc=True)
+    temperature = temperature.reindex(starts_utc.floor('h'), method='nearest').values
+    return 1 + cold_factor * np.maximum(reference_temperature - temperature, 0) + hot_factor * np.maximum(temperature - reference_temperature, 0)
+
+def to_utc(days, minutes):
+    """
+    Converts local times (day and minute of the day) into UTC timestamps
+    """
+    local = pd.DatetimeIndex(days) + pd.to_timedelta(minutes, unit='min')
+    return local.tz_localize(time_zone, ambiguous=np.ones(len(local), bool), nonexistent='shift_forward').tz_convert('UTC')
+
+def simulate_charging(survey=survey, weather_year=weather_year, battery=battery, n_vehicles=n_vehicles, seed=seed):
+    """
+    Simulates the aggregate home charging load (kW) of n_vehicles for every minute (UTC) of the weather year in local time
+    """
+    rng = np.random.default_rng(seed)
+    db = read_database(survey, country)
+    main, available, next_home = window_bins(db)
+
+    # Vehicle users and classes
+    classes = list(db['vehicle_share'].index)
+    user = rng.choice(len(users), n_vehicles, p=db['pop_share'][users].values / db['pop_share'][users].sum())
+    vehicle = rng.choice(len(classes), n_vehicles, p=db['vehicle_share'].values / db['vehicle_share'].sum())
+
+    # Simulated days include the last day of the previous year, whose charging continues into the weather year
+    days = pd.date_range(f"{weather_year - 1}-12-31", f"{weather_year}-12-31", freq='D')
+    day_type = np.select([days.dayofweek < 5, days.dayofweek == 5], [0, 1], 2)
+    n_days = len(days)
+
+    # Daily distances and number of trips of every vehicle and day
+    weekend = day_type[:, None] > 0
+    distance = np.where(weekend, db['d_tot']['weekend'], db['d_tot']['weekday'])
+    distance = distance * rng.uniform(1 - distance_variability, 1 + distance_variability, (n_days, n_vehicles))
+
+    business = (day_type[:, None] == 0) & (user[None, :] < 2)   # Working and student users commute on weekdays
+    d_min = db['d_min'].unstack().loc[:, day_types].values      # Trip types (business, personal) x day types
+    trip_distance = np.where(business, d_min[0][day_type][:, None], d_min[1][day_type][:, None])
+    n_trips = np.clip(np.rint(distance / trip_distance), 1, max_trips).astype(int)
+    active = np.arange(max_trips)[None, None, :] < n_trips[:, :, None]
+
+    # Trip start times, sampled from the survey's start time shares within each user's windows
+    start_bin = np.zeros((n_days, n_vehicles, max_trips), int)
+    for t, day_type_name in enumerate(day_types):
+        shares = np.repeat(db['trips_by_time'][day_type_name].values / 4, 4)
+        for u in range(len(users)):
+            cdf = np.cumsum(shares * available[u])
+            cdf /= cdf[-1]
+            mask = (day_type[:, None] == t) & (user[None, :] == u)
+            start_bin[mask] = np.searchsorted(cdf, rng.random((mask.sum(), max_trips)))
+    start = (start_bin + rng.random(start_bin.shape)) * 24 * 60 / bins
+
+    # Trip durations by trip type (business trips are those within main windows of commuting users) and distances proportional to them
+    is_business = main[user[None, :, None], start_bin] & business[:, :, None]
+    t_func = db['t_func'].unstack().loc[:, day_types].values
+    duration = np.where(is_business, t_func[0][day_type][:, None, None], t_func[1][day_type][:, None, None])
+    duration = duration * rng.uniform(1 - duration_variability, 1 + duration_variability, duration.shape) * active
+    trip_km = distance[:, :, None] * duration / duration.sum(axis=2, keepdims=True)
+
+    # Charging energy, replenishing the day's consumption once the vehicle is back home after its last trip
+    arrival = np.where(active, start + duration, 0).max(axis=2)
+    home_bin = next_home[user[None, :], np.minimum((arrival * bins / (24 * 60)).astype(int), bins - 1)]
+    charge_start = np.maximum(arrival, home_bin * 24 * 60 / bins)
+
+    starts_utc = to_utc(np.repeat(days.values, n_vehicles), charge_start.ravel())
+    factor = temperature_factor(starts_utc, weather_year).reshape(n_days, n_vehicles)
+    capacity = np.array([battery[c] for c in classes])[vehicle]
+    energy = np.minimum((trip_km.sum(axis=2) * np.array([consumption[c] for c in classes])[vehicle] * factor), capacity) / charging_efficiency
+
+    # Aggregates the charging events into a minute-level load with a difference array
+    begin = to_utc([f"{weather_year}-01-01"], [0])[0]
+    end = to_utc([f"{weather_year + 1}-01-01"], [0])[0]
+    n_minutes = int((end - begin) / pd.Timedelta(minutes=1))
+
+    first = np.rint((starts_utc - begin) / pd.Timedelta(minutes=1)).astype(int).values
+    last = first + np.rint(energy.ravel() / charging_power * 60).astype(int)
+    first, last = np.clip(first, 0, n_minutes), np.clip(last, 0, n_minutes)
+    load = np.cumsum(np.bincount(first, minlength=n_minutes + 1) - np.bincount(last, minlength=n_minutes + 1))[:n_minutes] * charging_power
+
+    index = pd.date_range(begin, periods=n_minutes, freq='min')
+    return pd.DataFrame({'Charging Profile': load}, index=index)
+
+def write_profile(cp, path):
+    """
+    Writes a simulated charging profile in the format of the RAMP-mobility results
+    """
+    # Written into a temporary file first since other processes may look for the same profile concurrently
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cp.to_csv(f"{path}.{os.getpid()}.tmp")
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+if __name__ == "__main__":
+    write_profile(simulate_charging(), results + profile_name + '.csv')
+    print(f"Charging profile of {n_vehicles} vehicles written into {profile_name}.csv")
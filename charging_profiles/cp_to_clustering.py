@@ -1,16 +1,23 @@
 import pandas as pd
 import os
+from hourly_profile import hourly_profile
+from day_clustering import cluster_days
 
 cp_name = 'ON-2016TTS_no-we_2018_v4_2023-batteries'
+weather_year = 2018
+n_days = 12             # Number of representative days
+method = 'kmedoids'     # 'kmedoids' (representative days are actual days) or 'kmeans' (representative days are mean days)
 
 dir_path = os.path.dirname(os.path.abspath(__file__)) + '/'
 cp_file = dir_path + 'ramp_mobility/results/' + cp_name + '.csv'
 
-cp = pd.read_csv(cp_file, index_col=0)
-cp.index = pd.to_datetime(cp.index, utc=True)
-cp = cp.set_index(cp.index.tz_convert('America/Toronto'))
-cp = cp[cp.index.year == 2018]
-cp = cp.resample('H').mean()
-cp = cp.loc['2018-01-02':'2018-12-30']
+cp = hourly_profile(cp_file, weather_year, 'America/Toronto')
+cp = cp.loc[f'{weather_year}-01-02':f'{weather_year}-12-30']
 
-cp.to_csv('ldv_charging (to clustering).csv')
\ No newline at end of file
+# Clusters the days of the charging profile into representative days
+representatives, mapping, recreated = cluster_days(cp, n_days, method)
+print(representatives)
+
+# Time slice mapping to compile with (time_slices in compile_transport.py) and the charging profile recreated from the representative days
+mapping.to_csv(f'ldv_charging_{n_days}p (time slices).csv', index=False)
+recreated.reset_index(drop=True).to_csv(f'recreated_ldv_charging_{n_days}p (from clustering).csv')
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Clusters the days of hourly profiles into representative days with NumPy-vectorized k-means or k-medoids
+@author: Rashid Zetter
+"""
+
+import pandas as pd
+import numpy as np
+
+def day_matrix(profiles):
+    """
+    Arranges hourly profiles (one column per series) into a days x (24 * series) matrix, averaging the hours repeated by daylight
+    saving time and interpolating the skipped ones
+    """
+    hours = pd.DataFrame({'date': profiles.index.date, 'hour': profiles.index.hour}, index=profiles.index)
+    matrix = pd.concat([profiles[col] for col in profiles.columns], axis=1, keys=profiles.columns)
+    matrix = matrix.groupby([hours['date'], hours['hour']]).mean().unstack('hour')
+    matrix = matrix.reindex(columns=pd.MultiIndex.from_product([profiles.columns, range(24)]))
+    return matrix.T.interpolate(limit_direction='both').T
+
+def sq_distances(X, centers):
+    """
+    Squared euclidean distances between every row of X and every center
+    """
+    d = (X ** 2).sum(axis=1)[:, None] - 2 * X @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+    return np.maximum(d, 0)
+
+def plus_plus(D, k, rng):
+    """
+    Picks k initial centers (row positions) spread out with the k-means++ rule from a matrix of squared distances between rows
+    """
+    centers = [rng.integers(len(D))]
+    for _ in range(1, k):
+        closest = D[:, centers].min(axis=1)
+        centers.append(rng.choice(len(D), p=closest / closest.sum()) if closest.sum() > 0 else rng.integers(len(D)))
+    return np.array(centers)
+
+def kmeans(X, k, n_init=10, max_iter=300, seed=0):
+    """
+    Lloyd's k-means with k-means++ initialization, keeping the best of n_init runs. Returns the labels and the cluster means
+    """
+    rng = np.random.default_rng(seed)
+    D = sq_distances(X, X)
+    best = (np.inf, None, None)
+
+    for _ in range(n_init):
+        centers = X[plus_plus(D, k, rng)]
+        for _ in range(max_iter):
+            labels = sq_distances(X, centers).argmin(axis=1)
+
+            # Cluster means; empty clusters keep their previous center
+            counts = np.bincount(labels, minlength=k)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, labels, X)
+            updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+
+            if np.allclose(updated, centers): break
+            centers = updated
+
+        labels = sq_distances(X, centers).argmin(axis=1)
+        inertia = sq_distances(X, centers)[np.arange(len(X)), labels].sum()
+        if inertia < best[0]: best = (inertia, labels, centers)
+
+    return best[1], best[2]
+
+def kmedoids(X, k, n_init=10, max_iter=300, seed=0):
+    """
+    Alternating k-medoids with k-means++ initialization, keeping the best of n_init runs. Returns the labels and the medoids (row positions)
+    """
+    rng = np.random.default_rng(seed)
+    D = np.sqrt(sq_distances(X, X))
+    best = (np.inf, None, None)
+
+    for _ in range(n_init):
+        medoids = plus_plus(D ** 2, k, rng)
+        for _ in range(max_iter):
+            labels = D[:, medoids].argmin(axis=1)
+
+            # Each cluster's new medoid is the member with the smallest total distance to the rest of its members
+            members = np.eye(k, dtype=bool)[labels]
+            costs = np.where(members, D @ members, np.inf)
+            updated = np.where(members.any(axis=0), costs.argmin(axis=0), medoids)
+
+            if np.array_equal(updated, medoids): break
+            medoids = updated
+
+        labels = D[:, medoids].argmin(axis=1)
+        cost = D[np.arange(len(X)), medoids[labels]].sum()
+        if cost < best[0]: best = (cost, labels, medoids)
+
+    return best[1], best[2]
+
+def cluster_days(profiles, n_days=12, method='kmedoids', n_init=10, seed=0):
+    """
+    Clusters the days of hourly profiles (one column per series, each scaled by its largest value) into n_days representative days.
+    Returns the representative days (indexed by season, with the number of days they represent), the time slice mapping of every day
+    of the year (day, season and weight of the day in the season's profile, as read by compile_transport.py) and the recreated profiles
+    """
+    matrix = day_matrix(profiles)
+    scale = np.repeat(profiles.abs().max().replace(0, 1).values, 24)
+    X = matrix.values / scale
+
+    if method == 'kmedoids':
+        labels, medoids = kmedoids(X, n_days, n_init, seed=seed)
+        representative = medoids
+        centers = matrix.values[medoids]
+    elif method == 'kmeans':
+        labels, centers = kmeans(X, n_days, n_init, seed=seed)
+        members = np.eye(n_days, dtype=bool)[labels]
+        representative = np.where(members, sq_distances(X, centers), np.inf).argmin(axis=0)    # Member day closest to each cluster mean
+        centers = centers * scale
+    else:
+        raise ValueError(f"Unknown clustering method: {method}")
+
+    # Seasons are labelled after their representative day
+    dates = pd.DatetimeIndex(matrix.index)
+    seasons = dates[representative].strftime('D%j').rename('season')
+
+    representatives = pd.DataFrame({'date': dates[representative], 'weight': np.bincount(labels, minlength=n_days)}, index=seasons)
+    representatives = representatives[representatives['weight'] > 0].sort_values('date')
+
+    # k-medoids slices take the profile of their representative day; k-means slices, the mean of their days
+    mapping = pd.DataFrame({'day': dates.dayofyear, 'season': seasons[labels].values, 'weight': 1.0})
+    if method == 'kmedoids':
+        mapping['weight'] = (np.arange(len(labels)) == representative[labels]).astype(float)
+
+    # Recreates the hourly profiles from the profiles of the representative days
+    recreated = pd.DataFrame(centers[labels], index=matrix.index, columns=matrix.columns)
+    hours = pd.MultiIndex.from_arrays([profiles.index.date, profiles.index.hour])
+    recreated = pd.DataFrame({col: recreated[col].stack().reindex(hours).values for col in profiles.columns}, index=profiles.index)
+
+    return representatives, mapping, recreated
@@ -0,0 +1,85 @@
+"""
+Loads RAMP-mobility charging profiles as hourly local-time series, cached on disk as memory-mapped .npy files
+@author: Rashid Zetter
+"""
+
+import pandas as pd
+import numpy as np
+import os
+import hashlib
+
+dir_path = os.path.dirname(os.path.abspath(__file__)) + '/'
+
+# Hourly profiles are cached on disk, keyed by the content of the RAMP-mobility results, the weather year and the time zone
+cache_dir = dir_path + 'profile_cache/'
+cache_entries = 32  # Least recently used profiles beyond this number are evicted
+
+profiles = {}   # Profiles already loaded by this process, keyed by file, modification time, weather year and time zone
+
+def profile_key(path, year, tz):
+    """
+    Hashes the content of the RAMP-mobility results along with the weather year and time zone
+    """
+    key = hashlib.sha256(f"pandas {pd.__version__} {year} {tz}".encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            key.update(chunk)
+    return key.hexdigest()
+
+def parse_profile(path, year, tz):
+    """
+    Parses the minute-level RAMP-mobility results, converts them into local time and resamples them into hourly resolution
+    """
+    cp = pd.read_csv(path, index_col=0)
+    cp.index = pd.to_datetime(cp.index, utc=True)
+
+    cp = cp.set_index(cp.index.tz_convert(tz))
+    cp = cp[cp.index.year == year]
+    return cp.resample('h').mean()
+
+def evict_cache():
+    """
+    Removes the least recently used profiles from the disk cache beyond cache_entries
+    """
+    entries = []
+    for f in os.listdir(cache_dir):
+        if not f.endswith('.npy'): continue
+        try: entries.append((os.path.getmtime(cache_dir + f), cache_dir + f))
+        except FileNotFoundError: pass     # Evicted by a concurrent process
+
+    entries.sort(reverse=True)
+    for _mtime, entry in entries[cache_entries:]:
+        try: os.remove(entry)
+        except FileNotFoundError: pass
+
+def hourly_profile(path, year, tz='America/Toronto'):
+    """
+    Returns the hourly mean of the RAMP-mobility results of a weather year in local time, parsing the .csv file only if it is not cached
+    """
+    memo = (os.path.abspath(path), os.path.getmtime(path), year, tz)
+    if memo in profiles:
+        return profiles[memo].copy()
+
+    cache_file = cache_dir + profile_key(path, year, tz) + '.npy'
+    try:
+        # Profiles are stored as one record per hour: the UTC timestamp followed by the profile columns
+        records = np.load(cache_file, mmap_mode='r')
+        os.utime(cache_file)    # Marks the entry as recently used
+        cp = pd.DataFrame({col: np.array(records[col]) for col in records.dtype.names[1:]},
+                          index=pd.to_datetime(np.array(records['timestamp']), utc=True).tz_convert(tz))
+    except FileNotFoundError:
+        cp = parse_profile(path, year, tz)
+
+        records = np.empty(len(cp), dtype=[('timestamp', 'i8')] + [(col, 'f8') for col in cp.columns])
+        records['timestamp'] = cp.index.asi8    # Nanoseconds since the epoch (UTC)
+        for col in cp.columns:
+            records[col] = cp[col].values
+
+        # Written into a temporary file first since other processes may store the same profile concurrently
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(f"{cache_file}.{os.getpid()}.tmp", 'wb') as f: np.save(f, records)
+        os.replace(f"{cache_file}.{os.getpid()}.tmp", cache_file)
+        evict_cache()
+
+    profiles[memo] = cp
+    return cp.copy()
@@ -0,0 +1,151 @@
+"""
+Derives the trip characteristics of the NHTS 2022 survey into the RAMP-mobility database (NHTS2022_database/database/) as in
+Travel_patterns_NHTS2022.ipynb, streaming the public trip file in chunks so it runs on small machines
+@author: Rashid Zetter
+"""
+
+import pandas as pd
+import numpy as np
+import os
+
+country = 'CA'                  # Column of the RAMP-mobility database written with the NHTS results
+vehicle_fuels = None            # VEHFUEL codes of the vehicles whose trips are kept, e.g., [4, 5] for plug-in vehicles (None keeps all)
+chunksize = 250000              # Trip records read at a time
+
+dir_path = os.path.dirname(os.path.abspath(__file__)) + '/'
+data_path = dir_path + 'travel_data/nhts2022/'
+database_path = dir_path + 'ramp_mobility/NHTS2022_database/database/'
+
+km_per_mile = 1.60934
+
+# Attributes read from trippub.csv and vehpub.csv; the rest of the survey columns are never parsed
+trip_columns = {
+    'HOUSEID': 'int64', 'PERSONID': 'int16', 'TRIPID': 'int16', 'TRAVDAY': 'int8', 'WHYFROM': 'int16', 'WHYTO': 'int16', 'WHYTRP1S': 'int16',
+    'TRVLCMIN': 'float64', 'STRTTIME': 'int16', 'TRPHHVEH': 'int8', 'VEHID': 'int16', 'TRPTRANS': 'int16', 'TRPMILES': 'float64',
+    'VMT_MILE': 'float64', 'DRIVER': 'int8', 'VEHTYPE': 'int16'
+}
+vehicle_columns = {'HOUSEID': 'int64', 'VEHID': 'int16', 'VEHFUEL': 'int16'}
+trip_key = ['HOUSEID', 'PERSONID', 'TRIPID']     # Identifies a trip; duplicated records share it
+
+days = {1: 'sunday', 2: 'weekday', 3: 'weekday', 4: 'weekday', 5: 'weekday', 6: 'weekday', 7: 'saturday'}
+purposes = {1: 'personal', 10: 'occupation', 20: 'occupation', 30: 'personal', 40: 'personal', 50: 'personal', 70: 'personal',
+            80: 'personal', 97: 'personal'}
+
+"""
+##################################################
+    Trip records
+##################################################
+"""
+
+def curate_trips(trips):
+    """
+    Keeps the household vehicle trips carried out as a driver with clear responses
+    """
+    speed = trips['TRPMILES'] / (trips['TRVLCMIN'] / 60)
+    keep = (
+        (trips['TRPTRANS'] <= 4) &                                              # Cars, vans, SUVs/crossovers and pickup trucks
+        (trips['VEHTYPE'] > 0) & (trips['VEHTYPE'] <= 4) &
+        (trips['DRIVER'] == 1) &                                                # Only trips carried out as a driver, not as a passenger
+        (trips['TRPHHVEH'] == 1) & (trips['VEHID'] != -1) &                     # Only household vehicles
+        (trips['TRPMILES'] > 0) & (trips['TRPMILES'] < 1280) &                  # Distances of up to 1280 miles
+        (trips['VMT_MILE'] > 0) & (trips['VMT_MILE'] < 1280) &
+        (trips['TRVLCMIN'] > 0) & (trips['TRVLCMIN'] < 960) &                   # Durations of up to 16 hours
+        (trips['WHYFROM'] >= 1) & (trips['WHYFROM'] < 97) &
+        (trips['WHYTO'] >= 1) & (trips['WHYTO'] < 97) &
+        (trips['STRTTIME'] >= 0) &
+        (speed >= 0.5) & (speed < 120)                                          # Average speeds between 0.5 and 120 mph
+    )
+    trips = trips[keep].drop_duplicates(trip_key)     # Duplicates in earlier chunks are dropped by aggregate_trips()
+
+    trips = trips.assign(
+        WEEKDAY=trips['TRAVDAY'].map(days),
+        PURPOSE=trips['WHYTRP1S'].map(purposes),
+        INTTIME=((trips['STRTTIME'] // 100 * 60 + trips['STRTTIME'] % 100 + trips['TRVLCMIN'] / 2) // 60 % 24).astype(int)  # Hour of the trip's midpoint
+    )
+    return trips
+
+def vehicle_fuel():
+    """
+    Fuel of every household vehicle (HOUSEID, VEHID) in vehpub.csv
+    """
+    vehicles = pd.concat(chunk for chunk in pd.read_csv(data_path + 'vehpub.csv', usecols=list(vehicle_columns), dtype=vehicle_columns,
+                                                         chunksize=chunksize))
+    return vehicles.drop_duplicates(['HOUSEID', 'VEHID']).set_index(['HOUSEID', 'VEHID'])['VEHFUEL']
+
+def aggregate_trips():
+    """
+    Streams trippub.csv and accumulates the sums and counts behind the RAMP-mobility parameters
+    """
+    fuel = vehicle_fuel() if vehicle_fuels is not None else None
+
+    starts, daily, trip_sums, records = [], [], [], 0
+    seen = set()    # Keys of the trips kept so far, since duplicated records may fall in different chunks
+    for chunk in pd.read_csv(data_path + 'trippub.csv', usecols=list(trip_columns), dtype=trip_columns, chunksize=chunksize):
+        trips = curate_trips(chunk)
+        keys = pd.MultiIndex.from_frame(trips[trip_key])
+        new = ~keys.isin(seen)
+        trips = trips[new]
+        seen.update(keys[new])
+        if fuel is not None:
+            fuels = fuel.reindex(pd.MultiIndex.from_frame(trips[['HOUSEID', 'VEHID']])).values
+            trips = trips[np.isin(fuels, vehicle_fuels)]
+
+        # Trips by start time, daily distance by person and trip distance and duration by purpose
+        starts.append(trips.groupby(['WEEKDAY', 'INTTIME']).size())
+        daily.append(trips.groupby(['HOUSEID', 'PERSONID', trips['WEEKDAY'].isin(['saturday', 'sunday']).rename('weekend')])['TRPMILES'].sum())
+        trip_sums.append(trips.groupby(['PURPOSE', 'WEEKDAY'])[['TRPMILES', 'TRVLCMIN']].agg(['sum', 'count']))
+
+        records += len(chunk)
+        print(f"Read {records} trip records")
+
+    # Partial sums of the chunks (persons may be split across two chunks)
+    starts = pd.concat(starts).groupby(level=[0, 1]).sum()
+    daily = pd.concat(daily).groupby(level=[0, 1, 2]).sum()
+    trip_sums = pd.concat(trip_sums).groupby(level=[0, 1]).sum()
+    return starts, daily, trip_sums
+
+"""
+##################################################
+    RAMP-mobility database
+##################################################
+"""
+
+def write_country(file, values, decimals, by_row=False, **kwargs):
+    """
+    Replaces the values of the country (a column, or a row if by_row) in a RAMP-mobility database file, keeping the other countries
+    """
+    # Read as text so the values of the other countries are written back untouched
+    df = pd.read_csv(database_path + file, encoding='utf-8-sig', dtype=str, **kwargs)
+    text = lambda v: [str(x) for x in np.round(np.asarray(v, dtype=float), decimals)]
+    if by_row:
+        df.loc[country] = text(values.reindex(df.columns))
+    elif isinstance(values, pd.Series):
+        df[country] = text(values.reindex(df.index))
+    else:
+        df[country] = text(values)
+    df.to_csv(database_path + file, encoding='utf-8-sig', index='index_col' in kwargs)
+    print(f"{country} values of {file} written")
+
+def write_database():
+    """
+    Writes the NHTS trip characteristics into the RAMP-mobility database
+    """
+    starts, daily, trip_sums = aggregate_trips()
+
+    # Share of trips starting in each hour (%) by day type
+    for day_type in ['weekday', 'saturday', 'sunday']:
+        shares = starts.get(day_type, pd.Series(dtype=float)).reindex(range(24), fill_value=0)
+        write_country(f'trips_by_time_{day_type}.csv', (shares / shares.sum() * 100).values, 6)
+
+    # Average daily distance (km)
+    d_tot = daily.groupby(level='weekend').mean() * km_per_mile
+    write_country('d_tot.csv', pd.Series({'weekday': d_tot.get(False, np.nan), 'weekend': d_tot.get(True, np.nan)}), 2, by_row=True, index_col=0)
+
+    # Average trip distance (km) and duration (min) by trip type and day type
+    means = trip_sums.xs('sum', axis=1, level=1) / trip_sums.xs('count', axis=1, level=1)
+    means = means.rename(index={'occupation': 'business'})
+    write_country('d_min.csv', means['TRPMILES'] * km_per_mile, 8, index_col=[0, 1])
+    write_country('t_func.csv', means['TRVLCMIN'], 8, index_col=[0, 1])
+
+if __name__ == "__main__":
+    write_database()
@@ -0,0 +1,102 @@
+"""
+Selects techs of the Technology table with glob or regular expression rules, compiled once against a database into a cached index of the
+matching techs, and expands rule rows (tech selector x period/vintage wildcards) into concrete rows
+@author: Rashid Zetter
+"""
+
+import re
+import fnmatch
+import pandas as pd
+
+wildcard = 'All'    # Value of the wildcard columns replaced by every one of their values
+
+"""
+##################################################
+    Selectors
+##################################################
+"""
+
+# A selector is a tech term or a list of terms. Globs (*, ?, [...]) match whole tech names, terms starting with 're:' are regular expressions
+# searched within them and terms starting with '!' exclude the techs they match. Techs matching any including term and no excluding one are
+# selected, e.g., ['T_LDV*BEV*', '!T_LDV_M*'] for the light-duty BEVs other than motorcycles
+
+def is_selector(value):
+    # Whether a tech cell holds a selector rather than a tech name
+    return isinstance(value, (list, tuple)) or (isinstance(value, str) and (value.startswith(('re:', '!')) or any(c in value for c in '*?[')))
+
+def compile_terms(terms):
+    """
+    Regular expression matching the start of the tech names selected by any of the terms
+    """
+    return re.compile('|'.join('.*?(?:' + t[3:] + ')' if t.startswith('re:') else fnmatch.translate(t) for t in terms))
+
+class TechIndex:
+    """
+    Techs of the Technology table of a database (in their order), with the techs selected by every selector cached
+    """
+    def __init__(self, techs):
+        self.techs = pd.Index([t for t in techs if isinstance(t, str) and t.strip()]).drop_duplicates()
+        self._selected = {}
+
+    @classmethod
+    def from_database(cls, conn):
+        return cls(r[0] for r in conn.execute('SELECT tech FROM Technology'))
+
+    def mask(self, selector):
+        """
+        Whether each tech of the index is selected
+        """
+        terms = [selector] if isinstance(selector, str) else list(selector)
+        key = tuple(terms)
+        if key not in self._selected:
+            names = pd.Series(self.techs, dtype=object)
+            include = [t for t in terms if not t.startswith('!')]
+            exclude = [t[1:] for t in terms if t.startswith('!')]
+            selected = names.str.match(compile_terms(include)).values if include else pd.Series(False, index=names.index).values
+            if exclude:
+                selected = selected & ~names.str.match(compile_terms(exclude)).values
+            self._selected[key] = selected
+        return self._selected[key]
+
+    def select(self, selector):
+        """
+        Techs selected, in the order of the Technology table
+        """
+        return self.techs[self.mask(selector)]
+
+    def temp_table(self, conn, name, selector):
+        """
+        Temporary table of the techs selected (an indexed tech column), so SQL statements select them with 'tech IN temp.<name>'
+        """
+        conn.execute(f'DROP TABLE IF EXISTS temp."{name}"')
+        conn.execute(f'CREATE TEMP TABLE "{name}" (tech TEXT PRIMARY KEY)')
+        conn.executemany(f'INSERT INTO temp."{name}" VALUES (?)', [(t,) for t in self.select(selector)])
+
+"""
+##################################################
+    Rule rows
+##################################################
+"""
+
+def expand_rules(rules, index=None, wildcards=None, tech_column='tech'):
+    """
+    Expands rule rows into concrete rows: tech selectors are replaced by every tech of the index they select and the wildcard in the wildcard
+    columns (column: values) by every value. Each rule row is replaced in place by its concrete rows, and rows with plain values are kept
+    """
+    rules = rules.reset_index(drop=True)
+
+    if index is not None and tech_column in rules.columns:
+        selectors = rules[tech_column].map(is_selector)
+        if selectors.any():
+            techs = [list(index.select(value)) if selector else value for value, selector in zip(rules[tech_column], selectors)]
+            rules = rules.assign(**{tech_column: techs}).explode(tech_column).dropna(subset=[tech_column])
+
+    for column, values in (wildcards or {}).items():
+        if column not in rules.columns:
+            continue
+        wild = rules[column].astype(str) == wildcard
+        if wild.any():
+            expanded = rules[wild].drop(columns=column).reset_index().merge(pd.DataFrame({column: values}, dtype=object), how='cross')
+            rules = pd.concat([rules[~wild], expanded.set_index('index')[rules.columns]]).sort_index(kind='stable')
+
+    return rules.reset_index(drop=True)
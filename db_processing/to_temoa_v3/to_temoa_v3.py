@@ -1,6 +1,9 @@
 import sqlite3
 import shutil
+import sys
 import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + '/..')
+from tech_rules import TechIndex
 
 db_name = 'canoe_trn_on_vanilla4'
 charging_dsd = False    # choose whether to represent LD EV charging demand distribution in the DSD (True) or CFT (False) Temoa tables
@@ -10,6 +13,11 @@ sql_file = dir_path + 'temoa_v2_to_v3.txt'
 target = dir_path + 'v3_database/' + db_name + '_v3.sqlite'
 source = dir_path + '../../transportation/compiled_database/' + db_name + '.sqlite'
 
+# Techs with unlimited capacity and techs without annual activity, see tech_rules.py for the selectors
+unlim_cap_techs = ['T_IMP*', 'T_BLND*', 'T_EA*', 'T_OFF*', 'T_dummy*', 'H2_distribution']
+non_annual_techs = ['T_LDV_C_BEV*', 'T_LDV_LTP_BEV*', 'T_LDV_LTF_BEV*', 'T_LDV_M_BEV*', 'I_H2*', 'T_LDV_BEV_CHRG', 'T_IMP_ELC', 'H2_COMP_10_100',
+                    'H2_distribution', 'H2_storage', 'ELC_AC_DC']
+
 shutil.copyfile(source, target)
 
 with open(sql_file, 'r') as file:
@@ -19,38 +27,12 @@ conn = sqlite3.connect(target)
 cursor = conn.cursor()
 cursor.executescript(sql_script)
 
-# Update 'unlim_cap' column
-cursor.execute("""
-    UPDATE Technology
-    SET unlim_cap = CASE
-        WHEN tech LIKE 'T_IMP%' OR
-            tech LIKE 'T_BLND%' OR 
-            tech LIKE 'T_EA%' OR 
-            tech LIKE 'T_OFF%' OR
-            tech LIKE 'T_dummy%' OR    
-            tech LIKE 'H2_distribution' THEN 1
-        ELSE 0
-    END
-""")
-
-# Update 'annual' column
-cursor.execute("""
-    UPDATE Technology
-    SET annual = CASE
-        WHEN tech LIKE 'T_LDV_C_BEV%' OR
-            tech LIKE 'T_LDV_LTP_BEV%' OR
-            tech LIKE 'T_LDV_LTF_BEV%' OR
-            tech LIKE 'T_LDV_M_BEV%' OR
-            tech LIKE 'I_H2%' OR
-            tech = 'T_LDV_BEV_CHRG' OR                  
-            tech = 'T_IMP_ELC' OR
-            tech = 'H2_COMP_10_100' OR
-            tech = 'H2_distribution' OR
-            tech = 'H2_storage' OR
-            tech = 'ELC_AC_DC' THEN 0
-        ELSE 1
-    END
-""")
+# Update 'unlim_cap' and 'annual' columns
+techs = TechIndex.from_database(conn)
+techs.temp_table(conn, 'unlim_cap_techs', unlim_cap_techs)
+techs.temp_table(conn, 'non_annual_techs', non_annual_techs)
+cursor.execute("UPDATE Technology SET unlim_cap = CASE WHEN tech IN temp.unlim_cap_techs THEN 1 ELSE 0 END")
+cursor.execute("UPDATE Technology SET annual = CASE WHEN tech IN temp.non_annual_techs THEN 0 ELSE 1 END")
 
 # Update 'cf_fixed' column
 if not charging_dsd:
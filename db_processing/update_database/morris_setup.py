@@ -1,5 +1,8 @@
 import sqlite3
+import sys
 import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + '/..')
+from tech_rules import TechIndex
 
 target_name = 'canoe_on_12d_vanilla_morris'
 dir_path = os.path.dirname(os.path.abspath(__file__)) + '/'
@@ -37,36 +40,38 @@ tables = ["CostInvest", "CostVariable", "Efficiency"]
 for table in tables:
     add_mm_analysis_column(table)
 
-# Add group entries into MMAnalysis
-queries = [
-    # CostInvest: Insert "H2_supply_cap_cost" for rows with tech like "%H2%"
-    ("UPDATE CostInvest SET MMAnalysis = 'H2_supply_cap_cost' WHERE tech LIKE '%H2%';", "CostInvest H2"),
-    
+# Add group entries into MMAnalysis: (table, group, tech selector, description), see tech_rules.py for the selectors
+groups = [
+    # CostInvest: Insert "H2_supply_cap_cost" for techs containing "H2"
+    ("CostInvest", "H2_supply_cap_cost", "*H2*", "CostInvest H2"),
+
     # CostVariable: Insert "RT_fuel_cost" for specific tech values
-    ("UPDATE CostVariable SET MMAnalysis = 'RT_fuel_cost' WHERE tech IN ('T_IMP_GSL', 'T_IMP_DSL', 'T_IMP_CNG', 'T_IMP_NG');", "CostVariable RT_fuel_cost"),
-    
-    # CostInvest: Insert "LDV_BEV_cap_cost" for tech like "T_LDV%" and "%BEV%", except "T_LDV_M%"
-    ("UPDATE CostInvest SET MMAnalysis = 'LDV_BEV_cap_cost' WHERE tech LIKE 'T_LDV%' AND tech LIKE '%BEV%' AND tech NOT LIKE 'T_LDV_M%';", "CostInvest LDV_BEV"),
-    
-    # CostInvest: Insert "MHDV_H2_cap_cost" for tech like "T_MDV%" or "T_HDV_T%" and "%FC%"
-    ("UPDATE CostInvest SET MMAnalysis = 'MHDV_H2_cap_cost' WHERE (tech LIKE 'T_MDV%' OR tech LIKE 'T_HDV_T%') AND tech LIKE '%FC%';", "CostInvest MHDV_H2"),
-    
-    # Efficiency: Insert "LDV_BEV_eff" for tech like "T_LDV%" and "%BEV%", except "T_LDV_M%"
-    ("UPDATE Efficiency SET MMAnalysis = 'LDV_BEV_eff' WHERE tech LIKE 'T_LDV%' AND tech LIKE '%BEV%' AND tech NOT LIKE 'T_LDV_M%';", "Efficiency LDV_BEV_eff"),
-    
-    # Efficiency: Insert "MHDV_H2_eff" for tech like "T_MDV%" or "T_HDV_T%" and "%FC%"
-    ("UPDATE Efficiency SET MMAnalysis = 'MHDV_H2_eff' WHERE (tech LIKE 'T_MDV%' OR tech LIKE 'T_HDV_T%') AND tech LIKE '%FC%';", "Efficiency MHDV_H2_eff")
-
-    # ("UPDATE Efficiency SET MMAnalysis = 'RT_eff' WHERE tech LIKE 'T_LDV%' AND tech LIKE '%BEV%' AND tech NOT LIKE 'T_LDV_M%';", "Efficiency LDV_BEV_eff")
+    ("CostVariable", "RT_fuel_cost", ['T_IMP_GSL', 'T_IMP_DSL', 'T_IMP_CNG', 'T_IMP_NG'], "CostVariable RT_fuel_cost"),
+
+    # CostInvest: Insert "LDV_BEV_cap_cost" for techs starting with "T_LDV" and containing "BEV", except "T_LDV_M"
+    ("CostInvest", "LDV_BEV_cap_cost", ['T_LDV*BEV*', '!T_LDV_M*'], "CostInvest LDV_BEV"),
+
+    # CostInvest: Insert "MHDV_H2_cap_cost" for techs starting with "T_MDV" or "T_HDV_T" and containing "FC"
+    ("CostInvest", "MHDV_H2_cap_cost", ['T_MDV*FC*', 'T_HDV_T*FC*'], "CostInvest MHDV_H2"),
+
+    # Efficiency: Insert "LDV_BEV_eff" for techs starting with "T_LDV" and containing "BEV", except "T_LDV_M"
+    ("Efficiency", "LDV_BEV_eff", ['T_LDV*BEV*', '!T_LDV_M*'], "Efficiency LDV_BEV_eff"),
+
+    # Efficiency: Insert "MHDV_H2_eff" for techs starting with "T_MDV" or "T_HDV_T" and containing "FC"
+    ("Efficiency", "MHDV_H2_eff", ['T_MDV*FC*', 'T_HDV_T*FC*'], "Efficiency MHDV_H2_eff")
+
+    # ("Efficiency", "RT_eff", ['T_LDV*BEV*', '!T_LDV_M*'], "Efficiency LDV_BEV_eff")
 ]
 
-# Execute each query and print status
-for query, description in queries:
+# Execute each update over the techs selected from the Technology table and print status
+techs = TechIndex.from_database(conn)
+for table, group, selector, description in groups:
     try:
-        cursor.execute(query)
+        techs.temp_table(conn, 'selected_techs', selector)
+        cursor.execute(f"UPDATE {table} SET MMAnalysis = ? WHERE tech IN temp.selected_techs;", (group,))
         print(f"Update applied: {description}")
     except Exception as e:
-        print(f"Error updating {description}: {e}") 
+        print(f"Error updating {description}: {e}")
 
 # Commit changes and close the connection
 conn.commit()
@@ -1,17 +1,17 @@
-import shutil
 import sqlite3
 import pandas as pd
+import numpy as np
+import sys
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + '/../db_processing')
+from tech_rules import TechIndex
 
 db_input  = 'canoe_on_12d_vanilla4'
 db_output = 'canoe_on_12d_life_7'
 base_dir = os.path.dirname(os.path.abspath(__file__)) + '/'
 input_db_path  = base_dir + '../db_processing/update_database/target_database/' + db_input  + '.sqlite'
-output_db_path = base_dir + '../' + db_output + '.sqlite'
-
-shutil.copyfile(input_db_path, output_db_path)
-conn = sqlite3.connect(output_db_path)
-cursor = conn.cursor()
+output_dir = base_dir + '../'
 
 # Patterns and new suffixes
 patterns_to_duplicate = ['T_LDV_C_', 'T_LDV_LT', 'T_MDV_T', 'T_HDV_T']
@@ -41,258 +41,286 @@ lifetime_map = {
 #     'parents': 0.50,        # scaling factor for parent technologies
 #     'residuals': 0.75,      # scaling factor for existing techs without older vintages
 # }
-scaling_factors = {                                                               # Corresponding to seven lifetime classes   
+scaling_factors = {                                                               # Corresponding to seven lifetime classes
     'percentiles': 0.12,
     'parents': 0.28,
     'residuals': 0.40,
 }
 
-# Duplicate tech entries in every table that has a 'tech' column
-def duplicate_tech_entries(table_name):
-    df = pd.read_sql_query(f'SELECT * FROM "{table_name}"', conn)
-    tech_entries = df[df['tech'].str.startswith(tuple(patterns_to_duplicate))]
-    if tech_entries.empty:
-        return
-
-    copies = []
-    for suf in new_suffixes:
-        tmp = tech_entries.copy()
-        tmp['tech'] = tmp['tech'] + suf
-        copies.append(tmp)
-
-    df_out = pd.concat([df] + copies, ignore_index=True)
-    df_out.to_sql(table_name, conn, if_exists='replace', index=False)
-
-for (table_name,) in cursor.execute(
-        "SELECT name FROM sqlite_master WHERE type='table'").fetchall():
-    cols = [c[1] for c in cursor.execute(f'PRAGMA table_info("{table_name}")')]
-    if 'tech' in cols:
-        duplicate_tech_entries(table_name)
-
-
-# Modify LifetimeTech
-lt_df = pd.read_sql_query('SELECT * FROM "LifetimeTech"', conn)
-for idx, row in lt_df.iterrows():
-    tech = row['tech']
-    for suf in new_suffixes:
-        if tech.endswith(suf):
-            for pat in patterns_to_duplicate:
-                if tech.startswith(pat):
-                    lt_df.at[idx, 'lifetime'] = lifetime_map[suf][pat]      # Based on the expected value of the instantaneous scrappage distribution up to the Nth percentile
-
-lt_df['lifetime'] = pd.to_numeric(lt_df['lifetime'], errors='coerce').fillna(0.).astype(float)
-lt_df.to_sql('LifetimeTech', conn, if_exists='replace', index=False)
-
-# Build lifetime lookup
-lifetime_dict = dict(zip(lt_df['tech'], lt_df['lifetime']))
-
-
-# Modify ExistingCapacity
-ec_df = pd.read_sql_query('SELECT * FROM "ExistingCapacity"', conn)
-to_remove = []
-to_fix = []
-
-for _, r in ec_df.iterrows():                                               # Identify removals where vintage + lifetime < first period
-    tech, vintage = r['tech'], int(r['vintage'])
-    for suf in new_suffixes:
-        if tech.endswith(suf):
-            lifetime = lifetime_dict.get(tech, 0)
-            if vintage + lifetime <= periods_set[0]:
-                to_remove.append((tech, vintage))
-                # parent_tech = tech.replace(suf, '')
-                # to_fix.append((parent_tech, vintage))
-
-to_rem_df = pd.DataFrame(to_remove, columns=['tech','vintage'])
-ec_df = ec_df.merge(to_rem_df, on=['tech','vintage'], how='left', indicator=True)
-ec_df = ec_df[ec_df['_merge']=='left_only'].drop(columns=['_merge'])
-
-# # Apply capacity scaling
-# mask_suffixes = ec_df['tech'].str.endswith(tuple(new_suffixes))                            # target techs with suffix
-# mask_residuals = ec_df.apply(lambda r: (r['tech'], r['vintage']) in set(to_fix), axis=1)   # target techs without older vintages
-# mask_parents = ec_df['tech'].str.startswith(tuple(patterns_to_duplicate)) & \
-#                 ~ec_df['tech'].str.endswith(tuple(new_suffixes))                           # target parent techs
-
-# ec_df.loc[mask_suffixes, 'capacity'] *= scaling_factors['percentiles']
-# ec_df.loc[mask_residuals, 'capacity'] *= scaling_factors['residuals']
-# ec_df.loc[mask_parents & ~mask_residuals, 'capacity'] *= scaling_factors['parents']
-
-# Compute per‐(parent,vintage) residual scaling
-to_remove_suff = {}
-for tech_suf, vintage in list(set(to_remove)):
-    for suf in new_suffixes:
-        if tech_suf.endswith(suf):
-            parent = tech_suf[:-len(suf)]
-            key = (parent, vintage)
-            if key not in to_remove_suff:
-                to_remove_suff[key] = set()
-            to_remove_suff[key].add(suf)
-
-# Now compute residual_scaling only from those
-residual_scaling = {}
-for (parent, vintage), sufs in to_remove_suff.items():
-    n_removed = len(sufs)
-    residual_scaling[(parent, vintage)] = (
-        scaling_factors['parents']
-        + n_removed * scaling_factors['percentiles'])
-
-# Apply all scalings in one vectorized pass
-def scale_capacity(row):
-    tech, vintage, cap = row['tech'], row['vintage'], row['capacity']
-    # a) any suffixed child tech
-    if any(tech.endswith(suf) for suf in new_suffixes):
-        return cap * scaling_factors['percentiles']
-
-    # b) parent rows that lost children
-    key = (tech, vintage)
-    if key in residual_scaling:
-        return cap * residual_scaling[key]
-
-    # c) all other parent‑tech rows (start pattern, not ending suffix, not a residual)
-    if (any(tech.startswith(p) for p in patterns_to_duplicate)
-        and not any(tech.endswith(suf) for suf in new_suffixes)
-        and key not in residual_scaling):
-        return cap * scaling_factors['parents']
-
-    # d) anything else (leave unchanged)
-    return cap
-
-ec_df['capacity'] = ec_df.apply(scale_capacity, axis=1)
-ec_df.to_sql('ExistingCapacity', conn, if_exists='replace', index=False)
-
-# Clean Efficiency table
-eff_df = pd.read_sql_query('SELECT * FROM "Efficiency"', conn)
-eff_df = eff_df.merge(to_rem_df, on=['tech','vintage'], how='left', indicator=True)
-eff_df = eff_df[eff_df['_merge']=='left_only'].drop(columns=['_merge'])
-eff_df.to_sql('Efficiency', conn, if_exists='replace', index=False)
-
-
-# Modify Min/MaxAnnualCapacityFactor
-def adjust_capacity_factor(table_name):
-    df = pd.read_sql_query(f'SELECT * FROM "{table_name}"', conn)
-    to_add, to_remove = [], []
-    
-    for _, r in df.iterrows():
-        tech, period = r['tech'], r['period']
-        
-        for suf in new_suffixes:
-            pct = int(suf[-2:])     # e.g., 12 from _S12
-
-            if tech.endswith('_EX' + suf) and pct > 50:
-                lifetime = float(lifetime_dict.get(tech, 0))
-                valid_periods = [p for p in periods_set if p < last_ex_period + lifetime]
-
-                for _period in valid_periods:       # subsequent periods will inherit the last available period's data
-                    if not ((df['tech'] == tech) & (df['period'] == _period)).any():
-                        new_row = df[df['tech'] == tech].sort_values(by='period').iloc[-1].copy()
-                        new_row['period'] = _period
-                        to_add.append(new_row)
-
-            elif tech.endswith('_EX' + suf) and pct < 50:
-                lifetime = float(lifetime_dict.get(tech, 0))
-                valid_periods = [p for p in periods_set if p < last_ex_period + lifetime]
-
-                if period not in valid_periods:     # remove invalid periods
-                    to_remove.append((tech, period))
-    
-    to_remove_df = pd.DataFrame(to_remove, columns=['tech', 'period'])
-    df = df.merge(to_remove_df, on=['tech', 'period'], how='left', indicator=True)
-    df = df[df['_merge'] == 'left_only'].drop(columns=['_merge'])
-    df = pd.concat([df, pd.DataFrame(to_add)], ignore_index=True).drop_duplicates()
-
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
-
-adjust_capacity_factor('MaxAnnualCapacityFactor')
-adjust_capacity_factor('MinAnnualCapacityFactor')
-  
-
-# Modify CostVariable
-cv_df = pd.read_sql_query('SELECT * FROM "CostVariable"', conn)
-to_add, to_remove = [], []
-
-for _, r in cv_df.iterrows():
-    tech, period, vintage = r['tech'], r['period'], int(r['vintage'])
-    
-    for suf in new_suffixes:
-        pct = int(suf[-2:])     # e.g., 12 from _S12
-
-        if tech.endswith(suf) and pct > 50:
-            lifetime = float(lifetime_dict.get(tech, 0))
-            valid_periods = [p for p in periods_set if vintage <= p < vintage + lifetime]
-
-            for _period in valid_periods:       # subsequent periods will inherit the last available period's data
-                if not ((cv_df['tech'] == tech) & (cv_df['vintage'] == vintage) & (cv_df['period'] == _period)).any():
-                    new_row = cv_df[
-                        (cv_df['tech'] == tech) & (cv_df['vintage'] == vintage)
-                    ].sort_values(by='period').iloc[-1].copy()
-                    new_row['period'] = _period
-                    to_add.append(new_row)
-
-        elif tech.endswith(suf) and pct < 50:
-            lifetime = float(lifetime_dict.get(tech, 0))
-            valid_periods = [p for p in periods_set if vintage <= p < vintage + lifetime]
-
-            if period not in valid_periods:     # remove invalid periods
-                to_remove.append((tech, vintage, period))
-
-            if vintage + lifetime < periods_set[0]:
-                to_remove.append((tech, vintage, period))
-                        
-rem_cv = pd.DataFrame(to_remove, columns=['tech','vintage','period'])
-cv_df = cv_df.merge(rem_cv, on=['tech','vintage','period'], how='left', indicator=True)
-cv_df = cv_df[cv_df['_merge']=='left_only'].drop(columns=['_merge'])
-cv_df = pd.concat([cv_df, pd.DataFrame(to_add)], ignore_index=True).drop_duplicates()
-
-cv_df.to_sql('CostVariable', conn, if_exists='replace', index=False)
-
-
-# Insert new constraints in MinNewCapacityShare
-mnc_df = pd.read_sql_query('SELECT * FROM "MinNewCapacityShare"', conn)
-new_entries = []
-tech_percentiles = [tech for tech in lifetime_dict.keys()
-                    if any(tech.startswith(pat) for pat in patterns_to_duplicate)
-                    and not (tech.endswith('_EX') or '_EX_S' in tech)]
-
-for tech in tech_percentiles:
-    group = tech.split('_N')[0]
-    if any(tech.endswith(suf) for suf in new_suffixes):
-        max_prop = scaling_factors['percentiles']
-    else: 
-        max_prop = scaling_factors['parents']
-    for period in periods_set:
-        new_entries.append({
-            'tech': tech,
-            'group_name': group,
-            'region': 'ON',
-            'period': int(period),
-            'min_proportion': float(max_prop)
-        })
-
-mnc_df = pd.concat([mnc_df, pd.DataFrame(new_entries)], ignore_index=True).drop_duplicates()
-mnc_df.to_sql('MinNewCapacityShare', conn, if_exists='replace', index=False)
-
-
-# Declare TechGroupMember & TechGroup
-tgm_df = pd.read_sql_query('SELECT * FROM "TechGroupMember"', conn)
-tge_df = pd.read_sql_query('SELECT * FROM "TechGroup"', conn)
-new_tgm, new_tg = [], set()
-
-for tech in tech_percentiles:
-    group = tech.split('_N')[0]
-    new_tgm.append({'tech': tech, 'group_name': group})
-    new_tg.add(group)
-tgm_df = pd.concat([tgm_df, pd.DataFrame(new_tgm)], ignore_index=True).drop_duplicates()
-tge_df = pd.concat([tge_df, pd.DataFrame([{'group_name': g} for g in new_tg])],
-                   ignore_index=True).drop_duplicates()
-
-tgm_df.to_sql('TechGroupMember', conn, if_exists='replace', index=False)
-tge_df.to_sql('TechGroup',       conn, if_exists='replace', index=False)
-
-
-# Final cleanup of blank tech rows
-for tbl in ['LifetimeTech','ExistingCapacity','CostVariable',
-            'MinNewCapacityShare','TechGroupMember']:
-    cursor.execute(f"DELETE FROM {tbl} WHERE tech IS NULL OR trim(tech) = '';")
+# Batch mode: lifetime class variants written in parallel from a single read of the input database (None writes db_output with the settings
+# above). Each variant is the name of its output database with the keyword arguments of discretize_lifetime, where 'percentiles' (e.g.,
+# [25, 75] for three classes) replaces suffixes, lifetimes and scaling by those derived from the scrappage distribution
+variants = None
+# variants = {
+#     'canoe_on_12d_life_3': {'percentiles': [25, 75]},
+#     'canoe_on_12d_life_5': {'percentiles': [20, 40, 60, 80]},
+#     'canoe_on_12d_life_7': {'suffixes': new_suffixes, 'lifetimes': lifetime_map, 'scaling': scaling_factors},
+# }
+max_workers = os.cpu_count()
+
+# Scrappage probability by vehicle age (rows) and vehicle class (columns) of the patterns
+scrappage_spreadsheet = base_dir + '../transportation/spreadsheet_database/CANOE_TRN_ON_v4.xlsx'
+scrappage_sheet = 'Lifetime'
+scrappage_cells = {'usecols': 'AE:AI', 'skiprows': 44, 'nrows': 40}     # AE45:AI85
+scrappage_classes = {'Cars': 'T_LDV_C_', 'Light trucks': 'T_LDV_LT', 'Medium trucks': 'T_MDV_T', 'Heavy trucks': 'T_HDV_T'}
+
+# Lifetime classes are applied with set-based SQL within the database (INSERT ... SELECT, UPDATE and DELETE over temporary class
+# tables), so the tables keep their primary keys, column types and indexes and are never read into Python
+
+def columns(conn, table_name):
+    return [c[1] for c in conn.execute(f'PRAGMA table_info("{table_name}")')]
+
+def select_list(cols, **replace):
+    # Columns of the rows t of a table, replacing some of them by expressions
+    return ', '.join(replace.get(c, f't."{c}"') for c in cols)
+
+def class_tables(conn, patterns, suffixes, lifetimes, periods):
+    """
+    Temporary tables of the lifetime classes: patterns and suffixes (by precedence, the last matching one applies), class lifetimes and
+    periods
+    """
+    for name, definition in [('class_pattern', 'pattern TEXT, position INTEGER'),
+                             ('class_suffix', 'suffix TEXT PRIMARY KEY, position INTEGER, percentile INTEGER'),
+                             ('class_lifetime', 'suffix TEXT, pattern TEXT, lifetime REAL, PRIMARY KEY (suffix, pattern)'),
+                             ('class_period', 'period INTEGER PRIMARY KEY')]:
+        conn.execute(f'DROP TABLE IF EXISTS temp.{name}')
+        conn.execute(f'CREATE TEMP TABLE {name} ({definition})')
+
+    conn.executemany('INSERT INTO class_pattern VALUES (?, ?)', [(pat, pos) for pos, pat in enumerate(patterns)])
+    conn.executemany('INSERT INTO class_suffix VALUES (?, ?, ?)', [(suf, pos, int(suf[-2:])) for pos, suf in enumerate(suffixes)])
+    conn.executemany('INSERT OR REPLACE INTO class_lifetime VALUES (?, ?, ?)',
+                     [(suf, pat, float(life)) for suf, by_pattern in lifetimes.items() for pat, life in by_pattern.items()])
+    conn.executemany('INSERT OR IGNORE INTO class_period VALUES (?)', [(int(p),) for p in periods])
+
+def tech_classes(conn, tables):
+    """
+    Temporary table of the pattern, lifetime class suffix, percentile, parent tech and class lifetime of every tech in the tables (NULL
+    where none applies)
+    """
+    techs = ' UNION '.join(f'SELECT tech FROM "{t}"' for t in tables)
+    conn.execute('DROP TABLE IF EXISTS temp.tech_class')
+    conn.execute(f"""
+        CREATE TEMP TABLE tech_class AS
+        SELECT c.tech, c.pattern, c.suffix, s.percentile, substr(c.tech, 1, length(c.tech) - length(c.suffix)) AS parent,
+               l.lifetime AS class_lifetime
+        FROM (
+            SELECT tech,
+                   (SELECT pattern FROM class_pattern WHERE substr(tech, 1, length(pattern)) = pattern ORDER BY position DESC LIMIT 1) AS pattern,
+                   (SELECT suffix FROM class_suffix WHERE substr(tech, -length(suffix)) = suffix ORDER BY position DESC LIMIT 1) AS suffix
+            FROM ({techs}) WHERE tech IS NOT NULL
+        ) c
+        LEFT JOIN class_suffix s ON s.suffix = c.suffix
+        LEFT JOIN class_lifetime l ON l.suffix = c.suffix AND l.pattern = c.pattern""")
+    conn.execute('CREATE UNIQUE INDEX temp.tech_class_tech ON tech_class (tech)')
+
+def fill_periods(conn, table_name, groups, valid, fill, drop):
+    """
+    Gap filling of the periods of each group of rows (e.g., tech and vintage) of a table: the rows of the last period of the fill groups are
+    copied into the valid periods (p) they lack, while rows of the drop groups outside the valid periods are removed. The groups are
+    conditions on the rows t and their tech classes c
+    """
+    group_cols = ', '.join(f'"{g}"' for g in groups)
+    cols = columns(conn, table_name)
+    classes = f'"{table_name}" t JOIN tech_class c ON c.tech = t.tech'
+
+    # The fill and drop groups do not overlap, so the rows added are not affected by the rows removed
+    conn.execute(f"""
+        INSERT INTO "{table_name}" ({', '.join(f'"{c}"' for c in cols)})
+        SELECT {select_list(cols, period='p.period')}
+        FROM {classes} JOIN class_period p ON {valid}
+        JOIN (SELECT {group_cols}, MAX(period) AS period FROM "{table_name}" GROUP BY {group_cols}) l
+            ON {' AND '.join(f'l."{g}" = t."{g}"' for g in groups)} AND l.period = t.period
+        WHERE ({fill}) AND ({', '.join(f't."{g}"' for g in groups)}, p.period) NOT IN (SELECT {group_cols}, period FROM "{table_name}")
+        ORDER BY t.rowid, p.period""")
+    conn.execute(f"""
+        DELETE FROM "{table_name}" WHERE rowid IN (
+            SELECT t.rowid FROM {classes}
+            WHERE ({drop}) AND NOT EXISTS (SELECT 1 FROM class_period p WHERE p.period = t.period AND {valid}))""")
+
+def discretize_lifetime(conn, patterns=patterns_to_duplicate, suffixes=new_suffixes, lifetimes=lifetime_map, scaling=scaling_factors,
+                        periods=periods_set, last_existing=last_ex_period, region='ON'):
+    """
+    Splits the techs matching the patterns into lifetime classes (one copy per suffix) within a database: lifetimes of the classes,
+    existing capacity shares and removals, capacity factor and variable cost periods within the class lifetimes and minimum shares of new
+    capacity of every class (in the region)
+    """
+    periods = sorted(periods)
+    class_tables(conn, patterns, suffixes, lifetimes, periods)
+
+    # Duplicate tech entries in every table that has a 'tech' column, one copy per suffix, for the techs of the Technology table starting
+    # with the patterns
+    TechIndex.from_database(conn).temp_table(conn, 'class_tech', [pattern + '*' for pattern in patterns])
+    for (table_name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+        cols = columns(conn, table_name)
+        if 'tech' in cols:
+            conn.execute(f"""
+                INSERT INTO "{table_name}" ({', '.join(f'"{c}"' for c in cols)})
+                SELECT {select_list(cols, tech='t.tech || s.suffix')}
+                FROM "{table_name}" t CROSS JOIN class_suffix s
+                WHERE t.tech IN temp.class_tech
+                ORDER BY s.position, t.rowid""")
+
+    tech_classes(conn, ['LifetimeTech', 'ExistingCapacity', 'MaxAnnualCapacityFactor', 'MinAnnualCapacityFactor', 'CostVariable'])
+
+    # Modify LifetimeTech (blank or non-numeric lifetimes are set to 0)
+    conn.execute("""
+        UPDATE LifetimeTech SET lifetime = (SELECT class_lifetime FROM tech_class c WHERE c.tech = LifetimeTech.tech)
+        WHERE tech IN (SELECT tech FROM tech_class WHERE class_lifetime IS NOT NULL)""")
+    conn.execute("UPDATE LifetimeTech SET lifetime = 0. WHERE lifetime IS NULL OR typeof(lifetime) NOT IN ('integer', 'real')")
+
+    # Build lifetime lookup
+    conn.execute('ALTER TABLE temp.tech_class ADD COLUMN lifetime REAL')
+    conn.execute("""
+        UPDATE tech_class SET lifetime = COALESCE(
+            (SELECT lifetime FROM LifetimeTech l WHERE l.tech = tech_class.tech ORDER BY l.rowid DESC LIMIT 1), 0.)""")
+
+    # Modify ExistingCapacity: suffixed vintages retired before the first period are removed and their share goes to the parent tech
+    conn.execute('DROP TABLE IF EXISTS temp.retired')
+    conn.execute("""
+        CREATE TEMP TABLE retired AS
+        SELECT DISTINCT e.tech, e.vintage, c.parent, c.suffix
+        FROM ExistingCapacity e JOIN tech_class c ON c.tech = e.tech
+        WHERE c.suffix IS NOT NULL AND e.vintage + c.lifetime <= ?""", (periods[0],))
+
+    conn.execute("""
+        UPDATE ExistingCapacity SET capacity = capacity * (
+            SELECT CASE WHEN c.suffix IS NOT NULL THEN :percentiles
+                        WHEN r.classes IS NOT NULL THEN :parents + :percentiles * r.classes
+                        ELSE :parents END
+            FROM tech_class c
+            LEFT JOIN (SELECT parent, vintage, COUNT(DISTINCT suffix) AS classes FROM retired GROUP BY parent, vintage) r
+                ON r.parent = c.tech AND r.vintage = ExistingCapacity.vintage
+            WHERE c.tech = ExistingCapacity.tech)
+        WHERE tech IN (SELECT tech FROM tech_class WHERE pattern IS NOT NULL OR suffix IS NOT NULL)""", scaling)
+    conn.execute('DELETE FROM ExistingCapacity WHERE (tech, vintage) IN (SELECT tech, vintage FROM retired)')
+
+    # Clean Efficiency table
+    conn.execute('DELETE FROM Efficiency WHERE (tech, vintage) IN (SELECT tech, vintage FROM retired)')
+
+    # Modify Min/MaxAnnualCapacityFactor: existing techs of classes above the median keep their last factor over their lifetime, while those
+    # below it lose the periods beyond their lifetime
+    existing = "substr(c.parent, -3) = '_EX'"
+    for table_name in ['MaxAnnualCapacityFactor', 'MinAnnualCapacityFactor']:
+        fill_periods(conn, table_name, ['tech'], f'p.period < {float(last_existing)} + c.lifetime',
+                     f'{existing} AND c.percentile > 50', f'{existing} AND c.percentile < 50')
+
+    # Modify CostVariable: likewise over the lifetime of every vintage of the suffixed techs
+    fill_periods(conn, 'CostVariable', ['tech', 'vintage'], 't.vintage <= p.period AND p.period < t.vintage + c.lifetime',
+                 'c.percentile > 50', 'c.percentile < 50')
+
+    # Insert new constraints in MinNewCapacityShare
+    conn.execute('DROP TABLE IF EXISTS temp.class_share')
+    conn.execute("""
+        CREATE TEMP TABLE class_share AS
+        SELECT c.tech, CASE WHEN instr(c.tech, '_N') > 0 THEN substr(c.tech, 1, instr(c.tech, '_N') - 1) ELSE c.tech END AS group_name,
+               CASE WHEN c.suffix IS NOT NULL THEN :percentiles ELSE :parents END AS min_proportion
+        FROM (SELECT tech, MAX(rowid) AS position FROM LifetimeTech GROUP BY tech) l JOIN tech_class c ON c.tech = l.tech
+        WHERE c.pattern IS NOT NULL AND substr(c.tech, -3) != '_EX' AND instr(c.tech, '_EX_S') = 0
+        ORDER BY l.position""", scaling)
+
+    conn.execute("""
+        INSERT OR IGNORE INTO MinNewCapacityShare (tech, group_name, region, period, min_proportion)
+        SELECT s.tech, s.group_name, ?, p.period, s.min_proportion FROM class_share s CROSS JOIN class_period p
+        ORDER BY s.rowid, p.period""", (region,))
+
+    # Declare TechGroupMember & TechGroup
+    conn.execute('INSERT OR IGNORE INTO TechGroupMember (tech, group_name) SELECT tech, group_name FROM class_share ORDER BY rowid')
+    conn.execute("""
+        INSERT OR IGNORE INTO TechGroup (group_name)
+        SELECT group_name FROM class_share GROUP BY group_name ORDER BY MIN(rowid)""")
+
+    # Final cleanup of blank tech rows
+    for tbl in ['LifetimeTech','ExistingCapacity','CostVariable',
+                'MinNewCapacityShare','TechGroupMember']:
+        conn.execute(f"DELETE FROM {tbl} WHERE tech IS NULL OR trim(tech) = '';")
+
+    for name in ['class_pattern', 'class_suffix', 'class_lifetime', 'class_period', 'class_tech', 'tech_class', 'retired', 'class_share']:
+        conn.execute(f'DROP TABLE temp.{name}')
     conn.commit()
 
-conn.close()
-print(f"Database '{db_output}.sqlite' has created successfully.")
\ No newline at end of file
+"""
+##################################################
+    Batch mode
+##################################################
+"""
+
+def scrappage_distribution():
+    """
+    Scrappage probability by vehicle age of every pattern, normalized over the ages
+    """
+    df = pd.read_excel(scrappage_spreadsheet, sheet_name=scrappage_sheet, index_col=0, **scrappage_cells)
+    df = df.rename(columns=scrappage_classes)[list(scrappage_classes.values())]
+    return df / df.sum()
+
+def band_age(pmf, lower, upper):
+    # Expected age of the vehicles scrapped between two quantiles of the distribution, splitting the ages across the bounds
+    cdf = pmf.cumsum().values
+    weights = np.clip(np.minimum(cdf, upper) - np.maximum(cdf - pmf.values, lower), 0, None)
+    return (weights * pmf.index.values).sum() / weights.sum()
+
+def percentile_classes(percentiles, scrappage):
+    """
+    Suffixes, lifetimes and scaling factors of lifetime classes bounded by percentiles of the scrappage distribution: classes below the median
+    span up to their percentile and those above it from their percentile, while the parent techs keep the band around the median. Class
+    lifetimes are the expected age within each band, rounded down as in the Lifetime sheet
+    """
+    percentiles = sorted(int(p) for p in percentiles)
+    if any(p <= 0 or p >= 100 or p == 50 for p in percentiles):
+        raise ValueError(f"Percentiles of lifetime classes must be between 1 and 99 other than 50, got {percentiles}")
+
+    below, above = [p for p in percentiles if p < 50], [p for p in percentiles if p > 50]
+    bands = dict(zip(below, zip([0] + below[:-1], below)))
+    bands.update(zip(above, zip(above, above[1:] + [100])))
+    widths = {upper - lower for lower, upper in bands.values()}
+    if len(widths) > 1:
+        raise ValueError(f"Lifetime classes {percentiles} must span equal shares of the scrappage distribution")
+
+    percentile_share = widths.pop() / 100 if widths else 0.
+    parent_share = ((above[0] if above else 100) - (below[-1] if below else 0)) / 100
+    return {
+        'suffixes': [f'_S{p:02d}' for p in percentiles],
+        'lifetimes': {f'_S{p:02d}': {pattern: float(np.floor(band_age(scrappage[pattern], lower / 100, upper / 100)))
+                                     for pattern in scrappage} for p, (lower, upper) in bands.items()},
+        'scaling': {'percentiles': percentile_share, 'parents': parent_share, 'residuals': parent_share + percentile_share}
+    }
+
+def write_variant(base, name, spec):
+    """
+    Discretizes the lifetimes of an in-memory copy of the base database and writes it as a variant
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.deserialize(base)
+    discretize_lifetime(conn, **spec)
+
+    # Written into a temporary file first so an interrupted run never leaves a partial database
+    path = output_dir + name + '.sqlite'
+    with open(path + '.tmp', 'wb') as f:
+        f.write(conn.serialize())
+    conn.close()
+    os.replace(path + '.tmp', path)
+
+def write_variants(variants, input_path=input_db_path, workers=max_workers):
+    """
+    Writes lifetime class variants (name: keyword arguments of discretize_lifetime, or their percentiles) of the input database, reading it
+    once and discretizing the variants in parallel
+    """
+    with open(input_path, 'rb') as f:
+        base = f.read()
+
+    scrappage = scrappage_distribution() if any('percentiles' in spec for spec in variants.values()) else None
+    specs = {}
+    for name, spec in variants.items():
+        spec = dict(spec)
+        if 'percentiles' in spec:
+            spec.update(percentile_classes(spec.pop('percentiles'), scrappage[spec.get('patterns', patterns_to_duplicate)]))
+        specs[name] = spec
+
+    # SQLite releases the GIL while it runs the statements, so the variants are discretized concurrently in threads
+    with ThreadPoolExecutor(max_workers=min(len(specs), workers or 1)) as pool:
+        futures = {pool.submit(write_variant, base, name, spec): name for name, spec in specs.items()}
+        for future in as_completed(futures):
+            future.result()
+            print(f"Database '{futures[future]}.sqlite' has created successfully.")
+
+if __name__ == "__main__":
+    write_variants(variants or {db_output: {}})
@@ -1,71 +1,123 @@
 import sqlite3
 import shutil
+import sys
 import os
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + '/../db_processing')
+from tech_rules import TechIndex, expand_rules
 
 db_source = 'canoe_on_12d_vanilla4'
 db_target = 'canoe_on_12d_lowgrowth'
 constraints = 'trn_constraints_lowgrowth'
 
+# Batch mode: every constraints workbook applied to every source database, each scenario written as target_name (<c> is replaced by the
+# workbook name without 'trn_constraints_' and <s> by the source database). None builds db_target only
+constraint_workbooks = None
+# constraint_workbooks = ['trn_constraints_lowgrowth', 'trn_constraints_vanilla_hrates', 'trn_constraints_vanilla_grates',
+#                         'trn_constraints_vanilla_floor', 'trn_constraints_vanilla_carbon', 'trn_constraints_zev']
+source_databases = [db_source]
+target_name = 'canoe_on_12d_<c>'
+max_workers = os.cpu_count()
+
 dir_path = os.path.dirname(os.path.abspath(__file__)) + '/'
-source = dir_path + '../db_processing/update_database/target_database/' + db_source + '.sqlite'
-target = dir_path + '../' + db_target + '.sqlite'
-sheet_path = dir_path + constraints + '.xlsx'
+source_path = lambda name: dir_path + '../db_processing/update_database/target_database/' + name + '.sqlite'
+target_path = lambda name: dir_path + '../' + name + '.sqlite'
+sheet_path = lambda name: dir_path + name + '.xlsx'
 
-shutil.copyfile(source, target)
+# Vintages to replace 'All' (tech selectors of the tech column are replaced by the techs they select, see tech_rules.py)
+vintages = [2021, 2025, 2030, 2035, 2040, 2045, 2050]
+wildcards = {'LoanRate': {'vintage': vintages}}   # Columns of each sheet whose 'All' values are expanded
 
-# Load the Excel file
-excel_data = pd.ExcelFile(sheet_path)
+def read_constraints(workbook):
+    """
+    Sheets of a constraints workbook, named as their tables
+    """
+    # Load data from each sheet into a dictionary of DataFrames
+    excel_data = pd.ExcelFile(sheet_path(workbook))
+    sheet_data = {}
+    for sheet_name in excel_data.sheet_names:
+        data = excel_data.parse(sheet_name)
+        # if sheet_name in ['GrowthRateMin', 'GrowthRateMax']:
+        #     data = data.melt(id_vars=['region', 'tech', 'notes', 'reference'], var_name='period', value_name='rate')
+        sheet_data[sheet_name] = data
+    return sheet_data
 
-# Load data from each sheet into a dictionary of DataFrames
-sheet_data = {sheet: excel_data.parse(sheet) for sheet in excel_data.sheet_names}
+def insert_constraints(conn, sheet_data):
+    """
+    Bulk inserts the rows of every sheet into the table of the same name, expanding their tech selectors over the techs of the database and
+    the wildcards of the sheets listed in wildcards
+    """
+    techs = TechIndex.from_database(conn)
+    for table_name, data in sheet_data.items():
+        data = expand_rules(data, techs, wildcards.get(table_name))
+        # conn.execute(f'DELETE FROM {table_name}')
+        columns = ', '.join(f'"{c}"' for c in data.columns)
+        placeholders = ', '.join(['?'] * len(data.columns))
+        insert_sql = f'INSERT INTO "{table_name}" ({columns}) VALUES ({placeholders})'
+        rows = data.astype(object).where(data.notna(), None).values.tolist()
+        conn.executemany(insert_sql, rows)
 
-# Vintages to replace 'All'
-vintages = [2021, 2025, 2030, 2035, 2040, 2045, 2050]
+def build_database(source, target, sheet_data):
+    """
+    Copies a source database and inserts the constraints into the copy
+    """
+    # Built into a temporary file first so an interrupted run never leaves a partial database
+    try:
+        shutil.copyfile(source, target + '.tmp')
+        conn = sqlite3.connect(target + '.tmp')
+        try:
+            insert_constraints(conn, sheet_data)
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(target + '.tmp', target)
+    except BaseException:
+        if os.path.exists(target + '.tmp'):
+            os.remove(target + '.tmp')
+        raise
 
-# Connect to the SQLite database
-conn = sqlite3.connect(target)
-cursor = conn.cursor()
+def build_workbook(workbook, scenarios):
+    """
+    Builds the scenarios (target: source database) of a constraints workbook, parsing it once
+    """
+    sheet_data = read_constraints(workbook)
+    built = {}
+    for target, source in scenarios.items():
+        try:
+            build_database(source_path(source), target_path(target), sheet_data)
+            built[target] = None
+        except Exception as e:
+            built[target] = f"{type(e).__name__}: {e}"
+    return built
 
-# Function to clear and insert data into the SQLite database
-def replace_data(table_name, data):
-    # Clear existing data
-    # cursor.execute(f'DELETE FROM {table_name}')
-    # Insert new data
-    columns = data.columns.tolist()
-    placeholders = ', '.join(['?'] * len(columns))
-    insert_sql = f'INSERT INTO {table_name} ({", ".join(columns)}) VALUES ({placeholders})'
-    
-    for _, row in data.iterrows():
-        cursor.execute(insert_sql, tuple(row))
+def build_scenarios(workbooks, sources, workers=max_workers):
+    """
+    Builds the scenario database of every constraints workbook and source database, with one process per workbook
+    """
+    scenarios = {workbook: {} for workbook in workbooks}
+    for workbook in workbooks:
+        for source in sources:
+            target = target_name.replace('<c>', workbook.replace('trn_constraints_', '')).replace('<s>', source)
+            if any(target in targets for targets in scenarios.values()):
+                raise ValueError(f"Scenario {target} is built more than once, target_name should include both <c> and <s>")
+            scenarios[workbook][target] = source
 
-# Iterate over the sheets and replace data in the corresponding tables
-for sheet_name, data in sheet_data.items():
-    if sheet_name == 'LoanRate':
-        # cursor.execute('DELETE FROM LoanRate')
-        for _, row in data.iterrows():
-            if row['vintage'] == 'All':
-                for vintage in vintages:
-                    new_row = row.copy()
-                    new_row['vintage'] = vintage
-                    cursor.execute(
-                        'INSERT INTO LoanRate (region, tech, vintage, rate, notes) VALUES (?, ?, ?, ?, ?)',
-                        tuple(new_row)
-                    )
-            else:
-                cursor.execute(
-                    'INSERT INTO LoanRate (region, tech, vintage, rate, notes) VALUES (?, ?, ?, ?, ?)',
-                    tuple(row)
-                )
-    # elif sheet_name == 'GrowthRateMin':
-    #     melted_data = data.melt(id_vars=['region', 'tech', 'notes', 'reference'], var_name='period', value_name='rate')
-    #     replace_data(sheet_name, melted_data)
-    # elif sheet_name == 'GrowthRateMax':
-    #     melted_data = data.melt(id_vars=['region', 'tech', 'notes', 'reference'], var_name='period', value_name='rate')
-    #     replace_data(sheet_name, melted_data)
-    else:
-        replace_data(sheet_name, data)
+    with ProcessPoolExecutor(max_workers=min(len(workbooks), workers or 1)) as pool:
+        futures = {pool.submit(build_workbook, workbook, targets): workbook for workbook, targets in scenarios.items()}
+        for future in as_completed(futures):
+            try:
+                built = future.result()
+            except Exception as e:     # The workbook itself could not be read
+                built = {target: f"{type(e).__name__}: {e}" for target in scenarios[futures[future]]}
+            for target, error in built.items():
+                if error is None:
+                    print(f"Database '{target}.sqlite' built with {futures[future]}")
+                else:
+                    print(f"Failed to build {target} with {futures[future]}: {error}")
 
-# Commit the changes and close the connection
-conn.commit()
-conn.close()
\ No newline at end of file
+if __name__ == "__main__":
+    if constraint_workbooks is None:
+        build_database(source_path(db_source), target_path(db_target), read_constraints(constraints))
+    else:
+        build_scenarios(constraint_workbooks, source_databases)
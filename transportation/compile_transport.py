@@ -7,15 +7,39 @@ import pandas as pd
 import sqlite3
 import numpy as np
 import os
+import sys
 from datetime import datetime
 import re
+import shutil
 import unicodedata
+import hashlib
+import pickle
+import json
+import zipfile
+import time
+import io
+import argparse
+import itertools
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pandas.io.parsers import TextParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + '/../charging_profiles')
+from hourly_profile import hourly_profile
+import charging_simulation
 
 province = 'ON'
+version = 'v4'  # Spreadsheet version
 
-spreadsheet_name = 'CANOE_TRN_<r>_v4'.replace('<r>', province)
-db_name = 'canoe_trn_<r>_vanilla4'.replace('<r>', province.lower())
-ldv_profile_name = 'ON-2016TTS_no-we_2018_v4_2023-batteries'
+# File names of the spreadsheet, database and RAMP-mobility results (<r> is the province and <v> the spreadsheet version)
+spreadsheet_pattern = 'CANOE_TRN_<r>_<v>'
+db_pattern = 'canoe_trn_<r>_vanilla<v>'
+ldv_profile_pattern = '<r>-2016TTS_no-we_2018_v4_2023-batteries'
+
+spreadsheet_name = spreadsheet_pattern.replace('<r>', province).replace('<v>', version)
+db_name = db_pattern.replace('<r>', province.lower()).replace('<v>', version.lstrip('v'))
+ldv_profile_name = ldv_profile_pattern.replace('<r>', province)
 
 # ON-2016TTS_no-we_2018_v4_2023-batteries
 # ON-2022NHTS_2018_v4_2023-batteries
@@ -29,9 +53,33 @@ template = dir_path + 'canoe_trn_template.xlsx'
 # Spreadsheet database to compile
 spreadsheet = dir_path + 'spreadsheet_database/' + spreadsheet_name + '.xlsx'
 
+# Parsed sheets are cached on disk, keyed by the content of each sheet inside the .xlsx file
+sheet_cache = dir_path + 'spreadsheet_database/sheet_cache/'
+sheet_cache_entries = 256   # Least recently used sheets beyond this number are evicted
+
 # RAMP-mobility simulation results to compile
 ldv_profile = dir_path + '../charging_profiles/ramp_mobility/results/' + ldv_profile_name + '.csv'
 weather_year = 2018
+time_zone = 'America/Toronto'   # Local time of the charging profiles
+survey = 'TTS2016'              # Travel survey of the RAMP-mobility results, cited in the CFT table
+
+# Name (as worded in the CFT notes) and reference of each travel survey
+survey_sources = {
+    'TTS2016': ('Tomorrow Transportation Survey 2016', 'Data Management Group. (2018). Transportation Tomorrow Survey (TTS) 2016. Department of Civil Engineering, University of Toronto. https://dmg.utoronto.ca/'),
+    'NHTS2022': ('National Household Travel Survey 2022', 'Federal Highway Administration. (2022). 2022 National Household Travel Survey. U.S. Department of Transportation. https://nhts.ornl.gov/')
+}
+
+# Names of the provinces in the CFT notes
+province_names = {
+    'ON': 'Ontario', 'QC': 'Quebec', 'MB': 'Manitoba', 'SK': 'Saskatchewan', 'AB': 'Alberta', 'BC': 'British Columbia', 'BCT': 'British Columbia',
+    'NB': 'New Brunswick', 'NS': 'Nova Scotia', 'PE': 'Prince Edward Island', 'NL': 'Newfoundland and Labrador'
+}
+
+# Time slices (seasons) of the DSD, CFT, SegFrac and time_season tables: '365D' (every day of the weather year), '12D' (an average day per month),
+# or the path of a .csv mapping each day of the year ('day' column, 1 to 365) to a time slice ('season' column), optionally weighting the day in the
+# slice's profile ('weight' column; e.g., 1 for the representative day and 0 for the rest of the days it represents)
+time_slices = '365D'
+time_slice_variants = []    # Other time slices compiled into copies of the database (e.g., ['12D'] also compiles <db_name>_12d.sqlite)
 charging_dsd = False       # choose whether to represent LD EV charging demand distribution in the DSD (True) or CFT (False) Temoa tables
 
 # Aggregate existing capacities and efficiencies into 5-year vintages
@@ -50,33 +98,256 @@ precision = 9   # For consistent precision across the model
 # Rewrite database from scratch if it already exists
 wipe_database = True
 
+# Recompile only the tables affected by inputs that changed since the last compile, updating the existing database
+incremental = False
+
+# Number of worker processes parsing the spreadsheet sheets concurrently (1 parses them sequentially in each compile step)
+parse_workers = os.cpu_count() or 1
+
 """
 ##################################################
     Initial setup
 ##################################################
 """
 
-def instantiate_database():
+xlsx_ns = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+}
+
+def sheet_keys(path):
+    """
+    Hashes the XML part of every sheet in an .xlsx file along with the shared strings it references,
+    so a sheet keeps its key as long as its content does not change
+    """
+    with zipfile.ZipFile(path) as xlsx:
+        sheets = ET.fromstring(xlsx.read('xl/workbook.xml')).find('main:sheets', xlsx_ns)
+        targets = {rel.get('Id'): rel.get('Target') for rel in ET.fromstring(xlsx.read('xl/_rels/workbook.xml.rels'))}
+        strings = re.findall(rb'<si>.*?</si>', xlsx.read('xl/sharedStrings.xml'), re.S) if 'xl/sharedStrings.xml' in xlsx.namelist() else []
+
+        keys = {}
+        for sheet in sheets:
+            target = targets[sheet.get(f"{{{xlsx_ns['r']}}}id")]
+            xml = xlsx.read(target.lstrip('/') if target.startswith('/') else 'xl/' + target)
+
+            key = hashlib.sha256(f"pandas {pd.__version__}".encode() + xml)
+            for i in sorted(set(int(i) for i in re.findall(rb'<c [^>]*t="s"[^>]*><v>(\d+)</v>', xml))):
+                key.update(strings[i])
+            keys[sheet.get('name')] = key.hexdigest()
+
+    return keys
+
+class Workbook:
+    """
+    Parses an .xlsx workbook once and hands out cached sheet frames, header rows and sheet names
     """
-    Create sqlite database from schema sql file
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.excel = None   # Only opened if a sheet is not in the disk cache
+        self.keys = sheet_keys(path)
+        self.sheet_names = list(self.keys)
+        self.sheets = {}
+
+    def rows(self, sheet):
+        """
+        Returns the raw cell values of a sheet, parsing the sheet XML only if it is not cached in memory or on disk
+        """
+        if sheet not in self.sheets:
+            rows = self.load_cached(sheet)
+            self.sheets[sheet] = rows if rows is not None else self.parse(sheet)
+        return self.sheets[sheet]
+
+    def load_cached(self, sheet):
+        """
+        Loads the raw cell values of a sheet from the disk cache. Returns None if the sheet content was never parsed
+        """
+        cache_file = sheet_cache + self.keys[sheet] + '.pkl'
+        try:
+            with open(cache_file, 'rb') as f: rows = pickle.load(f)
+            os.utime(cache_file)    # Marks the entry as recently used
+        except FileNotFoundError:
+            return None
+        return rows
+
+    def parse(self, sheet):
+        """
+        Parses the raw cell values of a sheet and stores them in the disk cache
+        """
+        if self.excel is None: self.excel = pd.ExcelFile(self.path)
+        raw = self.excel.parse(sheet, header=None, dtype=object)
+        rows = raw.where(pd.notnull(raw), '').values.tolist()
+
+        # Written into a temporary file first since workers and other compiles may store the same sheet concurrently
+        os.makedirs(sheet_cache, exist_ok=True)
+        cache_file = sheet_cache + self.keys[sheet] + '.pkl'
+        with open(f"{cache_file}.{os.getpid()}.tmp", 'wb') as f: pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{cache_file}.{os.getpid()}.tmp", cache_file)
+        return rows
+
+    def header(self, sheet, row=0):
+        """
+        Returns the values of a single row (e.g., the header row) of a sheet
+        """
+        rows = self.rows(sheet)
+        return [np.nan if value == '' else value for value in rows[row]] if row < len(rows) else []
+
+    def read(self, sheet, header=0, skiprows=None, usecols=None, nrows=None):
+        """
+        Equivalent to pd.read_excel(path, sheet_name=sheet, ...) but served from the cached sheet
+        """
+        rows = self.rows(sheet)
+        if not rows: return pd.DataFrame()
+
+        parser = TextParser([list(row) for row in rows], header=header, skiprows=skiprows, usecols=usecols, nrows=nrows, skip_blank_lines=False)
+        return parser.read(nrows=nrows)
+
+    def close(self):
+        if self.excel is not None: self.excel.close()
+
+workbooks = {}
+
+def workbook(path):
     """
-    # Check if database exists or needs to be built
-    build_db = not os.path.exists(database)
+    Returns the cached Workbook of a file; it is parsed again only if the file changed on disk
+    """
+    book = workbooks.get(path)
+    if book is None or book.mtime != os.path.getmtime(path):
+        if book is not None: book.close()
+        book = workbooks[path] = Workbook(path)
+    return book
+
+connection = None  # Connection shared by every compile step while compile_transport() runs
+
+# Build-time pragmas; the database is built in a temporary file that only replaces the compiled database once complete
+build_pragmas = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",  # 256 MiB page cache
+    "PRAGMA temp_store = MEMORY"
+]
+
+@contextmanager
+def connect():
+    """
+    Yields the connection shared by compile_transport(). Compile steps run on their own get
+    a connection to the database that is committed and closed on exit
+    """
+    if connection is not None:
+        yield connection
+        return
 
-    # Connect to the new database file
     conn = sqlite3.connect(database)
-    curs = conn.cursor() # Cursor object interacts with the sqlite db
-
-    # Build the database if it doesn't exist. Otherwise clear all data if forced
-    if build_db: curs.executescript(open(schema, 'r').read())
-    elif wipe_database:
-        curs.executescript(open(schema, 'r').read())
-        tables = [t[0] for t in curs.execute("""SELECT name FROM sqlite_master WHERE type='table';""").fetchall()]
-        for table in tables: curs.execute(f"DELETE FROM '{table}'")
-        print("Database wiped prior to aggregation.\n")
-    
-    conn.commit()
-    conn.close()
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+def write_frame(conn, table, df, if_exists='replace'):
+    """
+    Equivalent to df.to_sql(table, conn, if_exists, index=False) without committing, keeping the write inside the compile transaction
+    """
+    if if_exists == 'replace':
+        conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.execute(pd.io.sql.get_schema(df, table, con=conn))
+
+    columns = ', '.join(f'"{col}"' for col in df.columns)
+    conn.executemany(f'INSERT INTO "{table}"({columns}) VALUES({", ".join(["?"] * len(df.columns))})',
+                     df.astype(object).where(pd.notnull(df), None).values.tolist())
+
+def parse_sheet(path, sheet):
+    """
+    Parses the raw cell values of one sheet; runs in the worker processes of parse_workbooks()
+    """
+    return workbook(path).rows(sheet)
+
+def parse_workbooks(sheets_by_path, workers=None):
+    """
+    Parses the sheets of each workbook concurrently in worker processes and caches them for the compile steps
+    """
+    workers = workers or parse_workers
+
+    # Only sheets that are not in the disk cache need to be parsed
+    tasks = []
+    for path, sheets in sheets_by_path.items():
+        book = workbook(path)
+        for sheet in dict.fromkeys(sheets):
+            if sheet not in book.sheet_names or sheet in book.sheets: continue
+            rows = book.load_cached(sheet)
+            if rows is None: tasks.append((path, sheet))
+            else: book.sheets[sheet] = rows
+
+    if workers <= 1 or len(tasks) <= 1: return
+
+    # Workers open their own workbooks rather than sharing the file handles inherited from this process
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=workbooks.clear) as pool:
+        for (path, sheet), rows in zip(tasks, pool.map(parse_sheet, *zip(*tasks))):
+            workbook(path).sheets[sheet] = rows
+
+def evict_sheet_cache():
+    """
+    Removes the least recently used sheets from the disk cache beyond sheet_cache_entries
+    """
+    if not os.path.isdir(sheet_cache): return
+
+    entries = []
+    for f in os.listdir(sheet_cache):
+        if not f.endswith('.pkl'): continue
+        try: entries.append((os.path.getmtime(sheet_cache + f), sheet_cache + f))
+        except FileNotFoundError: pass     # Evicted by a concurrent compile
+
+    entries.sort(reverse=True)
+    for _mtime, entry in entries[sheet_cache_entries:]:
+        try: os.remove(entry)
+        except FileNotFoundError: pass
+
+def instantiate_database(build_path, wipe=True, source=None):
+    """
+    Create sqlite database from schema sql file (or copies the source database) in the temporary build file and returns its connection
+    """
+    # Start from the existing database unless it needs to be wiped; otherwise build it from the schema
+    if source is None and os.path.exists(database) and not wipe: source = database
+    if source is not None:
+        shutil.copyfile(source, build_path)
+        return sqlite3.connect(build_path)
+
+    conn = sqlite3.connect(build_path)
+    conn.executescript(open(schema, 'r').read())
+    if os.path.exists(database): print("Database wiped prior to aggregation.\n")
+    return conn
+
+@contextmanager
+def build_database(wipe=True, source=None):
+    """
+    Runs the compile steps on a single connection and transaction to a temporary file in compiled_database/,
+    which atomically replaces the database once all steps succeed. A failed compile leaves the database untouched.
+    The build starts from a copy of the source database if one is given
+    """
+    global connection
+
+    os.makedirs(os.path.dirname(database), exist_ok=True)
+    build_path = f"{database}.{os.getpid()}.tmp"
+    if os.path.exists(build_path): os.remove(build_path)
+
+    conn = instantiate_database(build_path, wipe, source)
+    try:
+        for pragma in build_pragmas: conn.execute(pragma)
+        conn.isolation_level = None     # transaction is managed explicitly
+        conn.execute("BEGIN")
+
+        connection = conn
+        yield conn
+
+        conn.execute("COMMIT")
+        conn.close()
+        os.replace(build_path, database)
+    except BaseException:
+        conn.close()
+        os.remove(build_path)
+        raise
+    finally:
+        connection = None
 
 def quinquennial_mapping(vintage):
     """
@@ -99,26 +370,19 @@ def quinquennial_mapping(vintage):
     
 def dq_time(data_year):
     """
-    Calculates time appropriateness DQI based on Data Year.
+    Calculates time appropriateness DQI based on Data Year, for a whole column of data years.
     """
-    if not isinstance(data_year, (int, float)): # Check if data_year is a number
-        return ""
-    
     base_year = datetime.today().year  # Current year
-    diff = abs(base_year - int(data_year))  # Convert to int in case of float and calculate difference
+    years = pd.to_numeric(data_year, errors='coerce')  # Data years that are not numbers get an empty DQI
+    diff = (base_year - np.trunc(years)).abs()  # Truncate in case of float and calculate difference
 
-    data_quality = {
-        3: 1,
-        6: 2,
-        10: 3,
-        15: 4
-    }
+    data_quality = np.select(
+        [diff <= 3, diff <= 6, diff <= 10, diff <= 15],
+        [1, 2, 3, 4],
+        default=5  # 5 for greater than 15 years difference
+    )
 
-    for key in sorted(data_quality.keys()):  # Iterate through sorted keys to ensure correct order
-        if diff <= key:
-            return data_quality[key]
-    
-    return 5  # Return 5 for greater than 15 years difference
+    return pd.Series(data_quality, index=data_year.index).where(years.notna(), '')
 
 def normalize_to_ascii(text):
     """
@@ -142,70 +406,176 @@ def cleanup():
     Removes existing techs of a given vintage with no capacity
     """
     tables = ["ExistingCapacity", "Efficiency", "CostVariable", "CostFixed"] #   Tables to check for tech-vintage pairs with exist_cap = 0
-    
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
-
-    tech_vintage_remove = curs.execute(f"""SELECT DISTINCT tech, vintage FROM ExistingCapacity WHERE exist_cap < {epsilon}""").fetchall()
-    for table in tables:
-            for tech, vintage in tech_vintage_remove:
-                print(f"Deleted {tech} @ {vintage} in {table} because exist_cap < {epsilon}")
-                curs.execute(f"""DELETE FROM {table} WHERE tech = ? AND vintage = ?""", (tech, vintage))
-
-    # Get tech-vintage pairs from Efficiency, CostVariable, and CostFixed that do not exist in ExistingCapacity
-    for table in tables[1:]:  # Skip ExistingCapacity
-        tech_vintage_not_in_excap = curs.execute(
-            f"""SELECT DISTINCT tech, vintage FROM {table} WHERE vintage < 2021 
-                AND (tech, vintage) NOT IN (SELECT tech, vintage FROM ExistingCapacity)"""
-        ).fetchall()
-
-        # Remove these pairs from Efficiency, CostVariable, and CostFixed
-        for tech, vintage in tech_vintage_not_in_excap:
-            print(f"Deleted {tech} @ {vintage} in {table} because not in ExistingCapacity")
-            curs.execute(f"""DELETE FROM {table} WHERE tech = ? AND vintage = ?""", (tech, vintage))
-    
     tables_with_vintage = ["CostVariable", "CostInvest", "CostFixed"]
     tables_with_period = ["MaxAnnualCapacityFactor", "MinAnnualCapacityFactor"]
 
-    # Remove tech-vintage pairs from specified tables that do not exist in Efficiency
-    for table in tables_with_vintage:
-        tech_vintage_not_in_efficiency = curs.execute(
-            r"""SELECT DISTINCT tech, vintage FROM {} 
-                WHERE tech NOT LIKE '%\_EX' ESCAPE '\' AND (tech, vintage) NOT IN (SELECT tech, vintage FROM Efficiency)""".format(table)
-        ).fetchall()
+    # Temporary indexes on the tech-vintage (or tech-period) pairs each cleanup pass matches against
+    indexes = {table: 'vintage' for table in dict.fromkeys(tables + tables_with_vintage)}
+    indexes.update({table: 'periods' for table in tables_with_period})
 
-        for tech, vintage in tech_vintage_not_in_efficiency:
-            print(f"Deleted {tech} @ {vintage} in {table} because not in Efficiency")
-            curs.execute(f"""DELETE FROM {table} WHERE tech = ? AND vintage = ?""", (tech, vintage))
+    with connect() as conn:
+        curs = conn.cursor()
 
-    # Remove tech-period pairs from specified tables that do not exist in Efficiency
-    for table in tables_with_period:
-        tech_period_not_in_efficiency = curs.execute(
-            r"""SELECT DISTINCT tech, periods FROM {} 
-                WHERE tech NOT LIKE '%\_EX' ESCAPE '\' AND (tech, periods) NOT IN (SELECT tech, vintage FROM Efficiency)""".format(table)
-        ).fetchall()
+        for table, year in indexes.items():
+            curs.execute(f"""CREATE INDEX IF NOT EXISTS "cleanup_{table}" ON "{table}"(tech, {year})""")
 
-        for tech, period in tech_period_not_in_efficiency:
-            print(f"Deleted {tech} @ {period} in {table} because not in Efficiency")
-            curs.execute(f"""DELETE FROM {table} WHERE tech = ? AND periods = ?""", (tech, period))
+        deleted = {table: {} for table in indexes} #   Rows deleted per table and reason
 
-    conn.commit()
-    conn.close()
+        # Tech-vintage pairs with no capacity, kept aside since they are also deleted from ExistingCapacity
+        curs.execute("""DROP TABLE IF EXISTS temp.no_capacity""")
+        curs.execute(f"""CREATE TEMP TABLE no_capacity AS SELECT DISTINCT tech, vintage FROM ExistingCapacity WHERE exist_cap < {epsilon}""")
+        for table in tables:
+            curs.execute(f"""DELETE FROM {table} WHERE (tech, vintage) IN (SELECT tech, vintage FROM temp.no_capacity)""")
+            deleted[table][f"exist_cap < {epsilon}"] = curs.rowcount
+        curs.execute("""DROP TABLE temp.no_capacity""")
 
+        # Remove tech-vintage pairs from Efficiency, CostVariable, and CostFixed that do not exist in ExistingCapacity
+        for table in tables[1:]:  # Skip ExistingCapacity
+            curs.execute(f"""DELETE FROM {table} WHERE vintage < 2021 AND (tech, vintage) NOT IN (SELECT tech, vintage FROM ExistingCapacity)""")
+            deleted[table]['not in ExistingCapacity'] = curs.rowcount
+
+        # Remove tech-vintage pairs from specified tables that do not exist in Efficiency
+        for table in tables_with_vintage:
+            curs.execute(r"""DELETE FROM {} WHERE tech NOT LIKE '%\_EX' ESCAPE '\' AND (tech, vintage) NOT IN (SELECT tech, vintage FROM Efficiency)""".format(table))
+            deleted[table]['not in Efficiency'] = curs.rowcount
+
+        # Remove tech-period pairs from specified tables that do not exist in Efficiency
+        for table in tables_with_period:
+            curs.execute(r"""DELETE FROM {} WHERE tech NOT LIKE '%\_EX' ESCAPE '\' AND (tech, periods) NOT IN (SELECT tech, vintage FROM Efficiency)""".format(table))
+            deleted[table]['not in Efficiency'] = curs.rowcount
+
+        for table in indexes:
+            curs.execute(f'DROP INDEX "cleanup_{table}"')
+
+    for table, reasons in deleted.items():
+        for reason, count in reasons.items():
+            if count: print(f"Deleted {count} rows from {table} because {reason}")
     print(f"Cleanup complete.\n")
 
 """
 ##################################################
-    Basic parameters
+    Sheet-to-table mappings
 ##################################################
 """
 
-def insert_template():
-    """ 
-    Imports predefined template tables into the sqlite database
+# Data quality columns shared by every parameter sheet
+dq_columns = {
+    'reference': 'Reference',
+    'data_year': 'Data Year',
+    'dq_rel': 'Reliability',
+    'dq_comp': 'Representativeness',
+    'dq_time': 'DQ Time',            # derived from the Data Year by dq_time()
+    'dq_geog': 'Geographical',
+    'dq_tech': 'Technological'
+}
+
+# Cost columns shared by the CostInvest, CostVariable and CostFixed sheets
+cost_columns = {
+    'data_cost_year': 'Original Currency Year',
+    'data_curr': 'Original Currency'
+}
+
+# Target table columns and the spreadsheet columns (after melting and transforming) they are loaded from.
+# Strings are column names in the sheet dataframe; any other value is inserted as a constant.
+table_columns = {
+    'references': {'reference': 'References'},
+    'technologies': {'tech': 'Technology', 'flag': 'Flag', 'sector': 'Sector', 'tech_desc': 'Description', 'tech_category': 'Category', 'additional_notes': 'Details'},
+    'commodities': {'comm_name': 'Commodity', 'flag': 'Flag', 'comm_desc': 'Description', 'additional_notes': 'Details'},
+    'Demand': {'regions': 'Region', 'periods': 'Period', 'demand_comm': 'Demand Commodity', 'demand': 'Demand', 'demand_units': 'Unit', 'demand_notes': 'Notes', **dq_columns},
+    'LifetimeTech': {'regions': 'Region', 'tech': 'Technology', 'life': 'Lifetime', 'life_notes': 'Notes', **dq_columns},
+    'ExistingCapacity': {'regions': 'Region', 'tech': 'Technology', 'vintage': 'Vintage', 'exist_cap': 'ExistingCapacity', 'exist_cap_units': 'Unit', 'exist_cap_notes': 'Notes', **dq_columns},
+    'CapacityToActivity': {'regions': 'Region', 'tech': 'Technology', 'c2a': 'Capacity to Activity', 'c2a_notes': 'C2A Notes'},
+    'MaxAnnualCapacityFactor': {'regions': 'Region', 'periods': 'Period', 'tech': 'Technology', 'output_comm': 'Output Commodity', 'max_acf': 'MaxAnnualCapFactor', 'max_acf_notes': 'Notes',
+                                **dq_columns, 'dq_rel': 1, 'dq_comp': 1, 'dq_geog': 1, 'dq_tech': 1},
+    'MinAnnualCapacityFactor': {'regions': 'Region', 'periods': 'Period', 'tech': 'Technology', 'output_comm': 'Output Commodity', 'min_acf': 'MinAnnualCapFactor', 'min_acf_notes': 'Min Notes',
+                                **dq_columns, 'dq_rel': 1, 'dq_comp': 1, 'dq_geog': 1, 'dq_tech': 1},
+    'Efficiency': {'regions': 'Region', 'input_comm': 'Input Commodity', 'tech': 'Technology', 'vintage': 'Vintage', 'output_comm': 'Output Commodity', 'efficiency': 'Efficiency', 'eff_notes': 'Efficiency Notes', **dq_columns},
+    'CostInvest': {'regions': 'Region', 'tech': 'Technology', 'vintage': 'Vintage', 'cost_invest': 'CostInvest', 'cost_invest_units': 'Cost Units', 'cost_invest_notes': 'Notes', 'data_cost_invest': 'Data Cost',
+                   **cost_columns, **dq_columns},
+    'CostVariable': {'regions': 'Region', 'periods': 'Period', 'tech': 'Technology', 'vintage': 'Vintage', 'cost_variable': 'CostVariable', 'cost_variable_units': 'Cost Units', 'cost_variable_notes': 'Notes',
+                     'data_cost_variable': 'Data Cost', **cost_columns, **dq_columns},
+    'CostFixed': {'regions': 'Region', 'periods': 'Period', 'tech': 'Technology', 'vintage': 'Vintage', 'cost_fixed': 'CostFixed', 'cost_fixed_units': 'Cost Units', 'cost_fixed_notes': 'Notes',
+                  'data_cost_fixed': 'Data Cost', **cost_columns, **dq_columns},
+    'EmissionActivity': {'regions': 'Region', 'emis_comm': 'Emission Commodity', 'input_comm': 'Input Commodity', 'tech': 'Technology', 'vintage': 'Vintage', 'output_comm': 'Output Commodity',
+                         'emis_act': 'EmissionActivity', 'emis_act_units': 'Unit', 'emis_act_notes': 'Notes', **dq_columns},
+    'EmissionEmbodied': {'regions': 'Region', 'emis_comm': 'Emission Commodity', 'tech': 'Technology', 'vintage': 'Vintage', 'value': 'EmissionEmbodied', 'units': 'Unit', 'notes': 'Notes', **dq_columns},
+    'SegFrac': {'season_name': 'Season', 'time_of_day_name': 'Hour', 'segfrac': 'SegFrac', 'segfrac_notes': 'Notes'},
+    'TechInputSplit': {'regions': 'Region', 'periods': 'Period', 'input_comm': 'Input Commodity', 'tech': 'Technology', 'ti_split': 'TechInputSplit', 'ti_split_notes': 'Notes', **dq_columns}
+}
+
+def read_sheet(sheet, last_col, header_row=1):
+    """
+    Reads a sheet from the .xlsx file up to its last column. Returns None if the sheet does not exist
+    """
+    book = workbook(spreadsheet)
+    if sheet not in book.sheet_names:
+        return None
+
+    # Reads excel sheet columns and limits the number of columns to the last DQI
+    cols = book.header(sheet, row=header_row)
+    ncols = cols.index(last_col) #    Last column to read
+
+    # Imports the table on the excel sheet
+    df = book.read(sheet, skiprows=list(range(header_row)), usecols=range(ncols + 1))
+    df.columns = df.columns.astype(str)
+    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
+    return df
+
+def melt_years(df, var_name, parameter):
+    """
+    Melts the year columns into year (period or vintage) and parameter columns and drops rows with empty parameters
+    """
+    years = [col for col in df.columns if col.isdigit()]
+    params = [col for col in df.columns if not col.isdigit()]
+    df = pd.melt(df, id_vars=params, var_name=var_name, value_name=parameter, value_vars=years)
+    return df.dropna(subset=[parameter])
+
+def finalize(df, parameter):
+    """
+    Rounds values to the nearest precision (decimal place), normalizes references to ASCII and derives the region and time DQI columns
     """
+    df[parameter] = df[parameter].round(precision)
+    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df['Region'] = province
+    df['DQ Time'] = dq_time(df['Data Year'])
+    return df
+
+def cost_units(df, parameter):
+    """
+    Derives the cost units (e.g., 2020 CAD (M$/PJ)) and the cost in the original currency
+    """
+    df['Cost Units'] = df['Currency Year'].astype(int).astype(str) + ' ' + df['Currency'].astype(str) + ' (' + df['Unit'].astype(str) + ')'
+    df['Data Cost'] = (df[parameter] / df['Conversion Factor']).apply(round, args=(precision,))  # Python's exact decimal rounding
+    return df
 
-    tables = [
+def tech_lifetimes(techs):
+    """
+    Looks up each technology's lifetime with a single merge against the Lifetime sheet (first entry per technology, 40 years if not specified)
+    """
+    df_lifetime = workbook(spreadsheet).read('Lifetime', skiprows=[0], usecols=['Technology', 'Lifetime']).drop_duplicates('Technology')
+    df = techs.to_frame('Technology').merge(df_lifetime, on='Technology', how='left', indicator=True)
+
+    # Unlisted technologies take the default lifetime, listed ones keep theirs (even if empty)
+    return df['Lifetime'].where(df['_merge'] == 'both', 40).set_axis(techs.index)
+
+def insert_table(curs, table, df):
+    """
+    Loads a dataframe into a table with a single parameterized executemany, following the table_columns mapping
+    """
+    columns = table_columns[table]
+    values = pd.DataFrame({col: df[src] if isinstance(src, str) else src for col, src in columns.items()}, index=df.index)
+
+    curs.executemany(f"""REPLACE INTO "{table}"({', '.join(columns)}) VALUES({', '.join(['?'] * len(columns))})""",
+                     values.astype(object).values.tolist())
+
+"""
+##################################################
+    Basic parameters
+##################################################
+"""
+
+# Template tables imported into the sqlite database
+template_tables = [
     "commodity_labels", #   CommodityType
     "currencies", # 
     "dq_estimate",
@@ -223,22 +593,24 @@ def insert_template():
     "time_of_day", #        TimeofDay
     "tech_annual", #        Includes those technologies with constant annual demand [deprecated list]
     "StorageDuration" #     Assumes 8760 hours of storage for H2 to simulate unlimited supply year-round
-    ]
+]
+
+def insert_template():
+    """ 
+    Imports predefined template tables into the sqlite database
+    """
 
     # Read the specified sheets into a dictionary of dataframes
-    dfs = pd.read_excel(template, sheet_name=tables)
+    dfs = {table: workbook(template).read(table) for table in template_tables}
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
+    with connect() as conn:
 
-    # For each table, insert the data from the corresponding dataframe
-    for sheet_name, df in dfs.items():
-        # Convert NaNs to None to handle SQL nulls properly
-        df_clean = df.where(pd.notnull(df), None)
-        df_clean.to_sql(sheet_name, conn, if_exists='replace', index=False)
-            
-    conn.commit()
-    conn.close()
+        # For each table, insert the data from the corresponding dataframe
+        for sheet_name, df in dfs.items():
+            # Convert NaNs to None to handle SQL nulls properly
+            df_clean = df.where(pd.notnull(df), None)
+            write_frame(conn, sheet_name, df_clean)
 
     print(f"Template tables inserted into {os.path.basename(database)}\n")
 
@@ -248,22 +620,19 @@ def compile_ref():
     """
     sheet = 'References'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    book = workbook(spreadsheet)
+    if sheet not in book.sheet_names:
         return None
     
     # Imports the table on the excel sheet and normalizes references to ASCII
-    df = pd.read_excel(spreadsheet, sheet_name = sheet)
-    df['References'] = df['References'].apply(normalize_to_ascii)
+    df = book.read(sheet)
+    df['References'] = '[Transport] ' + df['References'].apply(normalize_to_ascii)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+    with connect() as conn:
+        curs = conn.cursor()
 
-    for _idx, row in df.iterrows():
-        curs.execute("""REPLACE INTO "references"(reference) VALUES (?)""", (f"[Transport] {row['References']}",)) # value is treated as a single tuple containing one element by adding a comma inside the tuple
-            
-    conn.commit()
-    conn.close()
+        insert_table(curs, 'references', df)
 
     print(f"References compiled into {os.path.basename(database)}\n")
 
@@ -277,32 +646,18 @@ def compile_techs():
     """
     Reads technologies from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'Techs'
-    last_col = 'Category'
-
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('Techs', last_col='Category', header_row=0)
+    if df is None:
         return None
     
-    # Reads excel sheet columns and limits the number of columns to read
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
-
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
     df = df.fillna('')
+    df['Sector'] = 'Transport'
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+    with connect() as conn:
+        curs = conn.cursor()
 
-    for _idx, row in df.iterrows():
-        curs.execute(f"""REPLACE INTO technologies(tech, flag, sector, tech_desc, tech_category, additional_notes)
-                    VALUES('{row['Technology']}', '{row['Flag']}', 'Transport', '{row['Description']}', '{row['Category']}', '{row['Details']}')""")
-            
-    conn.commit()
-    conn.close()
+        insert_table(curs, 'technologies', df)
 
     print(f"Technology data compiled into {os.path.basename(database)}\n")
 
@@ -310,32 +665,17 @@ def compile_comms():
     """
     Reads commodities from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'Comms'
-    last_col = 'Details'
-
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('Comms', last_col='Details', header_row=0)
+    if df is None:
         return None
     
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
-
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
     df = df.fillna('')
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+    with connect() as conn:
+        curs = conn.cursor()
 
-    for _idx, row in df.iterrows():
-        curs.execute(f"""REPLACE INTO commodities(comm_name, flag, comm_desc, additional_notes)
-                    VALUES('{row['Commodity']}', '{row['Flag']}', '{row['Description']}', '{row['Details']}')""")
-            
-    conn.commit()
-    conn.close()
+        insert_table(curs, 'commodities', df)
 
     print(f"Commodity data compiled into {os.path.basename(database)}\n")
 
@@ -349,49 +689,128 @@ def compile_demand():
     """
     Reads demands from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'Demand'
     parameter = 'Demand'
-    last_col = 'Technological'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('Demand', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
 
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
+    # Melts the period columns into period and parameter colums, drops empty parameter rows and remove NaNs from the table
+    df = melt_years(df, 'Period', parameter)
+    df = df.fillna('')
+    df = finalize(df, parameter)
 
-    # Melts the vintage columns into vintage and parameter colums 
-    periods = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Period', value_name=parameter, value_vars=periods)
+    # Connect with database and replace parameters
+    with connect() as conn:
+        curs = conn.cursor()
 
-    # Drops empty parameter rows, convert years into integers, and remove NaNs from the table
-    df = df.dropna(subset=[parameter])
-    df = df.fillna('')
+        insert_table(curs, 'Demand', df)
 
-    # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    print(f"Demand data compiled into {os.path.basename(database)}\n")
 
-    # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+"""
+##################################################
+    Time slices
+##################################################
+"""
 
-    for _idx, row in df.iterrows():
-        curs.execute("""REPLACE INTO Demand(regions, periods, demand_comm, demand, demand_units, demand_notes, reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (province, row['Period'], row['Demand Commodity'], row[parameter], row['Unit'], row['Notes'], 
-                    row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
+def hour_labels(index):
+    """
+    Hour labels from H01 to H24 of a datetime index
+    """
+    return 'H' + pd.Series(index.hour + 1, index=index).astype(str).str.zfill(2)
 
-    conn.commit()
-    conn.close()
+def slice_days(index):
+    """
+    Maps each timestamp of a datetime index to its time slice (season) and the weight of its day in the slice's profile
+    """
+    if time_slices == '365D':
+        days = pd.DataFrame({'season': index.strftime('D%j'), 'weight': 1.0}, index=index)
+    elif time_slices == '12D':
+        days = pd.DataFrame({'season': index.strftime('D%m'), 'weight': 1.0}, index=index)
+    else:
+        mapping = pd.read_csv(time_slices)
+        if 'weight' not in mapping: mapping['weight'] = 1.0
+        mapping = mapping.drop_duplicates('day').set_index('day')
+        days = mapping[['season', 'weight']].reindex(index.dayofyear).set_axis(index)
+
+    # Days not mapped to any time slice are left out
+    return days.dropna(subset=['season'])
+
+def slice_lengths():
+    """
+    Number of days of the weather year in each time slice, in order of appearance
+    """
+    days = slice_days(pd.date_range(f"{weather_year}-01-01", f"{weather_year}-12-31", freq='D'))
+    return days.groupby('season', sort=False).size()
 
-    print(f"Demand data compiled into {os.path.basename(database)}\n")
+def slice_profile(cp):
+    """
+    Aggregates an hourly profile into the time slices with a weighted mean of every slice and hour of the day. Every slice gets
+    all 24 hours: hours repeated or skipped by daylight saving time are averaged or interpolated
+    """
+    days = slice_days(cp.index)
+    cp = cp.loc[days.index]
+    keys = [days['season'].values, hour_labels(cp.index).values]
+
+    # Weighted mean profile of each time slice and hour
+    weight = days['weight'].astype(float)
+    profile = cp.mul(weight, axis=0).groupby(keys, sort=False).sum().div(weight.groupby(keys, sort=False).sum(), axis=0)
+
+    # Fills missing hours of the time slices
+    grid = pd.MultiIndex.from_product([days['season'].unique(), [f"H{hour:02d}" for hour in range(1, 25)]], names=['Season', 'Hour'])
+    profile = profile.reindex(grid).interpolate(limit_direction='both')
+    return profile
+
+def compile_time_slices():
+    """
+    Compiles the time slices (seasons) and the fraction of the year in each time slice and hour of the day (SegFrac)
+    """
+    lengths = slice_lengths()
+
+    # Fills the time_season table from the template, keeping the references and notes of the template seasons
+    df_seasons = workbook(template).read('time_season').drop_duplicates('t_season').set_index('t_season')
+    df_seasons = df_seasons.reindex(lengths.index).rename_axis('t_season').reset_index()
+
+    df = pd.DataFrame([(season, f"H{hour:02d}") for season in lengths.index for hour in range(1, 25)], columns=['Season', 'Hour'])
+    df['SegFrac'] = (df['Season'].map(lengths) / lengths.sum() / 24).round(precision)
+    df['Notes'] = f"Time slices: {os.path.basename(str(time_slices))}"
+    df.loc[df['Hour'] != 'H01', 'Notes'] = None  # Only shown every 24th hour to reduce database size
+
+    # Connect with database and replace parameters
+    with connect() as conn:
+        write_frame(conn, 'time_season', df_seasons.where(pd.notnull(df_seasons), None))
+        conn.execute('DELETE FROM SegFrac')
+        insert_table(conn.cursor(), 'SegFrac', df)
+
+    print(f"Time slices ({len(lengths)} seasons) compiled into {os.path.basename(database)}\n")
+
+def compile_variant(suffix, sources, **variant_settings):
+    """
+    Compiles a copy of the database (<db_name>_<suffix>.sqlite) under other settings, rerunning only the steps that read the given
+    sources. Returns the path of the variant database
+    """
+    global database
+
+    base_settings = {name: globals()[name] for name in variant_settings}
+    base_database = database
+    globals().update(variant_settings)
+    try:
+        database = os.path.splitext(base_database)[0] + '_' + suffix.lower() + '.sqlite'
+        with build_database(source=base_database):
+            for step, inputs, _tables in active_steps():
+                if set(inputs) & set(sources): step()
+        return database
+    finally:
+        globals().update(base_settings)
+        database = base_database
+
+def compile_variants():
+    """
+    Compiles the other time slices into copies of the database, replacing the tables that depend on the time slices
+    """
+    for variant in time_slice_variants:
+        compile_variant(os.path.splitext(os.path.basename(str(variant)))[0], ['time_slices'], time_slices=variant)
 
 """
 #########################################################
@@ -407,43 +826,32 @@ def compile_dsd():
     last_col = 'Technological'
     n_demands = 3
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    book = workbook(spreadsheet)
+    if sheet not in book.sheet_names:
         return None
     
     # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
+    cols = book.header(sheet, row=1)
     ncols = cols.index(last_col) #    Last column to read
 
     # Imports the metadata on the excel sheet
-    metadata = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1), nrows=n_demands) # Number of demands that are affected by the dsd
+    metadata = book.read(sheet, skiprows=[0], usecols=range(ncols + 1), nrows=n_demands) # Number of demands that are affected by the dsd
 
     # Imports the template format of the DSD table
-    dsd_template = pd.read_excel(template, sheet_name = 'DemandSpecificDistribution', header=None, nrows=1).iloc[0].values.tolist()
+    dsd_template = workbook(template).header('DemandSpecificDistribution')
 
-    # Imports the charging profiles from the RAMP-mobility results
-    cp = pd.read_csv(ldv_profile, index_col=0)
-    cp.index = pd.to_datetime(cp.index, utc=True)
-    
-    # Converts simulation results time series into ET time zone, resamples into hourly resolution, and normalizes distribution
-    cp = cp.set_index(cp.index.tz_convert('America/Toronto'))
-    cp = cp[cp.index.year == weather_year]
-    cp = cp.resample('H').mean()
-    cp = cp/cp.sum()
+    # Imports the hourly charging profiles in local time from the RAMP-mobility results and aggregates them into the time slices
+    cp = slice_profile(hourly_profile(ldv_profile, weather_year, time_zone))
 
-    # Labels time series into the desired format
-    cp['Day'] = cp.index.strftime('D%j')
-    # cp['Hour'] = cp.index.strftime('H%H')
+    # Normalizes the distribution over the year, weighting each time slice by the number of days it represents
+    cp = cp.mul(cp.index.get_level_values('Season').map(slice_lengths()).values, axis=0)
+    cp = cp/cp.sum()
 
-    cp.reset_index(inplace=True)
-    cp.rename(columns={'index': 'Timestamp'}, inplace=True)
-    cp['Hour'] = (cp['Timestamp'].dt.hour + 1).astype(str).str.zfill(2).apply(lambda x: f'H{x}') # Hour labels from H01 to H24
-    cp.set_index('Timestamp', inplace=True)    
-    
     # Creates DSD dataframe from the template and fills in the DSD from the RAMP-mobility results along with the metadata from the spreadsheet database
     df = pd.DataFrame(columns=dsd_template)
     df['dsd'] = cp['Charging Profile'].round(precision).values # DSDs rounded to 10 decimals
-    df['season_name'] = cp['Day'].values
-    df['time_of_day_name'] = cp['Hour'].values
+    df['season_name'] = cp.index.get_level_values('Season')
+    df['time_of_day_name'] = cp.index.get_level_values('Hour')
 
     df['demand_name'] = metadata['Target Demand'].values[0]
     df['regions'] = metadata['Region'].values[0]
@@ -470,13 +878,10 @@ def compile_dsd():
     df_merged = df_merged.where(pd.notnull(df_merged), None)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
+    with connect() as conn:
 
-    # Insert the dataframe into the sqlite database
-    df_merged.to_sql('DemandSpecificDistribution', conn, if_exists='replace', index=False)
-            
-    conn.commit()
-    conn.close()
+        # Insert the dataframe into the sqlite database
+        write_frame(conn, 'DemandSpecificDistribution', df_merged)
 
     print(f"Demand specific distributions compiled into {os.path.basename(database)}\n")
 
@@ -491,43 +896,29 @@ def compile_cft():
     Reads charging demand distribution from RAMP-mobility simulation results and compiles them into the .sqlite format 
     """
     # Imports the template format of the DSD table
-    cft_template = pd.read_excel(template, sheet_name = 'CapacityFactorTech', header=None, nrows=1).iloc[0].values.tolist()
+    cft_template = workbook(template).header('CapacityFactorTech')
 
-    # Imports the charging profiles from the RAMP-mobility results
-    cp = pd.read_csv(ldv_profile, index_col=0)
-    cp.index = pd.to_datetime(cp.index, utc=True)
-    
-    # Converts simulation results time series into ET time zone, resamples into hourly resolution, and normalizes distribution
-    cp = cp.set_index(cp.index.tz_convert('America/Toronto'))
-    cp = cp[cp.index.year == weather_year]
-    cp = cp.resample('H').mean()
+    # Imports the hourly charging profiles in local time from the RAMP-mobility results, aggregates them into the time slices and normalizes distribution
+    cp = slice_profile(hourly_profile(ldv_profile, weather_year, time_zone))
     cp = cp/cp.max()                # normalize by the largest datapoint since the charging distribution will go to capacity factor tech
 
-    # Labels time series into the desired format
-    cp['Day'] = cp.index.strftime('D%j')
-    # cp['Hour'] = cp.index.strftime('H%H')
-
-    cp.reset_index(inplace=True)
-    cp.rename(columns={'index': 'Timestamp'}, inplace=True)
-    cp['Hour'] = (cp['Timestamp'].dt.hour + 1).astype(str).str.zfill(2).apply(lambda x: f'H{x}') # Hour labels from H01 to H24
-    cp.set_index('Timestamp', inplace=True)    
-    
     # Creates the charging dist dataframe from the template and fills in the charging dist from the RAMP-mobility results along with the metadata from the spreadsheet database
     df = pd.DataFrame(columns=cft_template)
     df['cf_tech'] = cp['Charging Profile'].round(precision).values # the charging dists rounded to 10 decimals
-    df['season_name'] = cp['Day'].values
-    df['time_of_day_name'] = cp['Hour'].values
+    df['season_name'] = cp.index.get_level_values('Season')
+    df['time_of_day_name'] = cp.index.get_level_values('Hour')
 
     df['tech'] = 'T_LDV_BEV_CHRG'
-    df['regions'] = 'ON'
+    df['regions'] = province
+    survey_name, survey_reference = survey_sources[survey]
     cft_notes = (
         "This distribution represents the hourly variation of electricity demand from light-duty BEV charging. By using the stochastic aggregation framework RAMP-mobility to characterize "
-        "daily travel needs and battery consumption, and consequently, charging loads from 2,500 vehicles. Using travel survey data from the Tomorrow Transportation Survey 2016, Ontario "
+        f"daily travel needs and battery consumption, and consequently, charging loads from 2,500 vehicles. Using travel survey data from the {survey_name}, {province_names.get(province, province)} "
         "population-weighted temperature profiles from renewables.ninja, and other technical parameters described in the spreadsheet database."
     )
     df.loc[df['time_of_day_name'] == 'H01', 'cf_tech_notes'] = cft_notes #    Only shown every 24th hour to reduce database size
-    df.loc[df['time_of_day_name'] == 'H01', 'reference'] = 'Data Management Group. (2018). Transportation Tomorrow Survey (TTS) 2016. Department of Civil Engineering, University of Toronto. https://dmg.utoronto.ca/' #    Only shown every 24th hour to reduce database size
-    df['data_year'] = 2018
+    df.loc[df['time_of_day_name'] == 'H01', 'reference'] = survey_reference #    Only shown every 24th hour to reduce database size
+    df['data_year'] = weather_year
     df['dq_rel'] = 1
     df['dq_comp'] = 2
     df['dq_time'] = 1
@@ -538,13 +929,10 @@ def compile_cft():
     df = df.where(pd.notnull(df), None)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
+    with connect() as conn:
 
-    # Insert the dataframe into the sqlite database
-    df.to_sql('CapacityFactorTech', conn, if_exists='replace', index=False)
-            
-    conn.commit()
-    conn.close()
+        # Insert the dataframe into the sqlite database
+        write_frame(conn, 'CapacityFactorTech', df)
 
     print(f"Capacity factor distributions compiled into {os.path.basename(database)}\n")
 
@@ -558,35 +946,21 @@ def compile_lifetime():
     """
     Reads lifetimes from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'Lifetime'
-    last_col = 'Technological'
-
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('Lifetime', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
 
-    # Imports the table on the excel sheet and normalize references to ASCII
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
+    # Normalize references to ASCII
     df = df.fillna('')
     df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df['Region'] = province
+    df['DQ Time'] = dq_time(df['Data Year'])
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+    with connect() as conn:
+        curs = conn.cursor()
 
-    for _idx, row in df.iterrows():
-        curs.execute("""REPLACE INTO LifetimeTech(regions, tech, life, life_notes, reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (province, row['Technology'], row['Lifetime'], row['Notes'], 
-                    row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-
-    conn.commit()
-    conn.close()
+        insert_table(curs, 'LifetimeTech', df)
 
     print(f"Lifetime data compiled into {os.path.basename(database)}\n")
 
@@ -600,27 +974,14 @@ def compile_excap():
     """
     Reads existing capacities from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'ExCap'
     parameter = 'ExistingCapacity'
-    last_col = 'Technological'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('ExCap', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
-
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
 
     # Melts the vintage columns into vintage and parameter colums and drops rows with empty parameters
-    vintages = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Vintage', value_name=parameter, value_vars=vintages)
-    df = df.dropna(subset=[parameter])
+    df = melt_years(df, 'Vintage', parameter)
 
     # Fill NaNs as empty values; allowing for consistent grouping of vintages
     df = df.fillna('')
@@ -628,26 +989,18 @@ def compile_excap():
     if aggregate_excap:
         # Aggregates 2000-2020 vintages into 5-year vintages (e.g., 2002 -> 2000 and 2003 -> 2005)
         df.Vintage = df.Vintage.astype(int)
-        df['qVintage'] = df.Vintage.apply(quinquennial_mapping)
+        df['qVintage'] = quinquennial_mapping(df.Vintage)
         df = df.groupby([i for i in df.columns.tolist() if i not in ['Vintage', parameter]]).agg({parameter: 'sum'}).reset_index()
         df = df.rename(columns={'qVintage': 'Vintage'})
 
     # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df = finalize(df, parameter)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+    with connect() as conn:
+        curs = conn.cursor()
 
-    for _idx, row in df.iterrows():
-        curs.execute("""REPLACE INTO ExistingCapacity(regions, tech, vintage, exist_cap, exist_cap_units, exist_cap_notes, reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (province, row['Technology'], row['Vintage'], row[parameter], row['Unit'], row['Notes'], 
-                row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-            
-    conn.commit()
-    conn.close()
+        insert_table(curs, 'ExistingCapacity', df)
 
     print(f"Existing capacity data compiled into {os.path.basename(database)}\n")
 
@@ -661,33 +1014,19 @@ def compile_c2a():
     """
     Reads c2a factors from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'Cap2Act'
-    last_col = 'Notes'
-
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('Cap2Act', last_col='Notes')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
 
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
     df = df.fillna('')
+    df['Region'] = province
+    df['C2A Notes'] = '[' + df['Activity Unit'].astype(str) + '/' + df['Capacity Unit'].astype(str) + '] ' + df['Notes'].astype(str)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
-
-    for _idx, row in df.iterrows():
-        curs.execute("""REPLACE INTO CapacityToActivity(regions, tech, c2a, c2a_notes)
-                        VALUES(?, ?, ?, ?)""",
-                    (province, row['Technology'], row['Capacity to Activity'], f"[{row['Activity Unit']}/{row['Capacity Unit']}] {row['Notes']}"))
+    with connect() as conn:
+        curs = conn.cursor()
 
-    conn.commit()
-    conn.close()
+        insert_table(curs, 'CapacityToActivity', df)
 
     print(f"C2A factors data compiled into {os.path.basename(database)}\n")
 
@@ -701,70 +1040,41 @@ def compile_acf():
     """
     Reads annual cap factors from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'CapFactor'
     parameter = 'MaxAnnualCapFactor'
-    last_col = 'Notes'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('CapFactor', last_col='Notes')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
-
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
 
     # Melts the period columns into period and parameter colums 
-    periods = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Period', value_name=parameter, value_vars=periods)
+    df = melt_years(df, 'Period', parameter)
     df.Period = df.Period.astype(int)
-    df = df.dropna(subset=[parameter])
 
     # Fill NaNs as empty values
     df = df.fillna('')
 
     # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df = finalize(df, parameter)
 
-     # Reads technologies' lifetimes and last period of exsiting technologies
-    df_lifetime = pd.read_excel(spreadsheet, sheet_name = 'Lifetime', skiprows=[0], usecols=['Technology', 'Lifetime'])
-    period_0 = pd.read_excel(template, sheet_name='time_periods')
+    # Reads technologies' lifetimes and last period of exsiting technologies
+    lifetime = tech_lifetimes(df['Technology'])
+    period_0 = workbook(template).read('time_periods')
     period_0 = period_0[period_0['flag'] == 'e'].max().values[0]
 
+    # Checks for capacity factors outside existing technologies' lifetimes (applies only for residual technologies)
+    outside = df['Technology'].str.endswith('_EX') & (period_0 + lifetime <= df['Period'])
+    df = df[~outside].copy()
+
+    # Min capacity factors are 99% of the max capacity factors for computational slack
+    df['MinAnnualCapFactor'] = df[parameter] * 0.99
+    df['Min Notes'] = '99% of MaxAnnualCapacityFactor for computational slack. ' + df['Notes'].astype(str)
+
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
-    
-    for _idx, row in df.iterrows():
-
-        if row['Technology'].endswith('_EX'): #  Applies only for residual technologies
-            
-            # Attempt to find the lifetime for the given technology
-            lifetime_rows = df_lifetime[df_lifetime.Technology == row['Technology']].Lifetime
-            if len(lifetime_rows) > 0:
-                lifetime = lifetime_rows.values[0]
-            else:
-                lifetime = 40  # Default lifetime if not specified
-            
-            if period_0 + lifetime <= row['Period']: continue # Checks for capacity factors outside existing technologies' lifetimes
-
-        curs.execute("""REPLACE INTO MaxAnnualCapacityFactor(regions, periods, tech, output_comm, max_acf, max_acf_notes, reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (province, row['Period'], row['Technology'], row['Output Commodity'], row[parameter], row['Notes'], 
-                row['Reference'], row['Data Year'], 1, 1, dq_time(row['Data Year']), 1, 1))
-        
-        curs.execute("""REPLACE INTO MinAnnualCapacityFactor(regions, periods, tech, output_comm, min_acf, min_acf_notes, reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (province, row['Period'], row['Technology'], row['Output Commodity'], row[parameter]*0.99, f"99% of MaxAnnualCapacityFactor for computational slack. {row['Notes']}", 
-                row['Reference'], row['Data Year'], 1, 1, dq_time(row['Data Year']), 1, 1))
-            
-    conn.commit()
-    conn.close()
+    with connect() as conn:
+        curs = conn.cursor()
+
+        insert_table(curs, 'MaxAnnualCapacityFactor', df)
+        insert_table(curs, 'MinAnnualCapacityFactor', df)
 
     print(f"Max/min annual cap factors data compiled into {os.path.basename(database)}\n")
 
@@ -778,27 +1088,14 @@ def compile_efficiency():
     """
     Reads efficiencies from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'Efficiency'
     parameter = 'Efficiency'
-    last_col = 'Technological'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('Efficiency', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
-
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
 
     # Melts the vintage columns into vintage and parameter colums and drops rows with empty parameters
-    vintages = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Vintage', value_name=parameter, value_vars=vintages)
-    df = df.dropna(subset=[parameter])
+    df = melt_years(df, 'Vintage', parameter)
 
     # Fill NaNs as empty values; allowing for consistent grouping of vintages
     df = df.fillna('')
@@ -806,29 +1103,22 @@ def compile_efficiency():
     if aggregate_excap:
         # Aggregates 2000-2020 vintages into 5-year vintages (e.g., 2002 -> 2000 and 2003 -> 2005)
         df.Vintage = df.Vintage.astype(int)
-        df_ex = df[df.Vintage <= 2020]
+        df_ex = df[df.Vintage <= 2020].copy()
         df_new = df[df.Vintage > 2020]
-        df_ex['qVintage'] = df_ex.Vintage.apply(quinquennial_mapping)
+        df_ex['qVintage'] = quinquennial_mapping(df_ex.Vintage)
         df_ex_agg = df_ex.groupby([i for i in df_ex.columns.tolist() if i not in ['Vintage', parameter]]).agg({parameter: 'min'}).reset_index() # 'min' helps decrease overestimated energy use
         df_ex_agg = df_ex_agg.rename(columns={'qVintage': 'Vintage'})
         df = pd.concat([df_ex_agg, df_new], ignore_index=True).reset_index(drop=True)
 
     # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df = finalize(df, parameter)
+    df['Efficiency Notes'] = '[' + df['Unit'].astype(str) + '] ' + df['Notes'].astype(str)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+    with connect() as conn:
+        curs = conn.cursor()
 
-    for _idx, row in df.iterrows():
-        curs.execute("""REPLACE INTO Efficiency(regions, input_comm, tech, vintage, output_comm, efficiency, eff_notes, reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (province, row['Input Commodity'], row['Technology'], row['Vintage'], row['Output Commodity'], row[parameter], f"[{row['Unit']}] {row['Notes']}", 
-                row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-            
-    conn.commit()
-    conn.close()
+        insert_table(curs, 'Efficiency', df)
 
     print(f"Efficiency data compiled into {os.path.basename(database)}\n")
 
@@ -842,49 +1132,25 @@ def compile_costinvest():
     """
     Reads investment costs from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'CostInvest'
     parameter = 'CostInvest'
-    last_col = 'Technological'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('CostInvest', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
 
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
-
-    # Melts the vintage columns into vintage and parameter colums 
-    vintages = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Vintage', value_name=parameter, value_vars=vintages)
-
-    # Drops empty parameter rows, convert years into integers, and remove NaNs from the table
-    df = df.dropna(subset=[parameter])
+    # Melts the vintage columns into vintage and parameter colums, drops empty parameter rows and remove NaNs from the table
+    df = melt_years(df, 'Vintage', parameter)
     df = df.fillna('')
 
     # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df = finalize(df, parameter)
+    df = cost_units(df, parameter)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
-
-    for _idx, row in df.iterrows():
-        curs.execute("""REPLACE INTO CostInvest(regions, tech, vintage, cost_invest, cost_invest_units, cost_invest_notes, data_cost_invest, data_cost_year, data_curr,
-                     reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (province, row['Technology'], row['Vintage'], row[parameter], f"{int(row['Currency Year'])} {row['Currency']} ({row['Unit']})", row['Notes'], 
-                 round(row[parameter]/row['Conversion Factor'], precision), row['Original Currency Year'], row['Original Currency'],
-                row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-            
-    conn.commit()
-    conn.close()
+    with connect() as conn:
+        curs = conn.cursor()
+
+        insert_table(curs, 'CostInvest', df)
 
     print(f"Investment cost data compiled into {os.path.basename(database)}\n")
 
@@ -898,63 +1164,33 @@ def compile_costvariable():
     """
     Reads variable costs from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'CostVariable'
     parameter = 'CostVariable'
-    last_col = 'Technological'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('CostVariable', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
 
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
-
-    # Melts the vintage columns into vintage and parameter colums 
-    vintages = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Vintage', value_name=parameter, value_vars=vintages)
+    # Melts the vintage columns into vintage and parameter colums, drops empty parameter rows and remove NaNs from the table
+    df = melt_years(df, 'Vintage', parameter)
     df.Vintage = df.Vintage.astype(int)
-
-    # Drops empty parameter rows, convert years into integers, and remove NaNs from the table
-    df = df.dropna(subset=[parameter])
     df = df.fillna('')
 
     # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df = finalize(df, parameter)
+    df = cost_units(df, parameter)
 
     # Reads technologies' lifetimes
-    df_lifetime = pd.read_excel(spreadsheet, sheet_name = 'Lifetime', skiprows=[0], usecols=['Technology', 'Lifetime'])
+    lifetime = tech_lifetimes(df['Technology'])
+
+    # Checks for var costs outside the expected technology's lifetime
+    outside = (df['Period'] < df['Vintage']) | (df['Vintage'] + lifetime <= df['Period'])
+    df = df[~outside].copy()
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
-    
-    for _idx, row in df.iterrows():
-
-        # Attempt to find the lifetime for the given technology
-        lifetime_rows = df_lifetime[df_lifetime.Technology == row['Technology']].Lifetime
-        if len(lifetime_rows) > 0:
-            lifetime = lifetime_rows.values[0]
-        else:
-            lifetime = 40  # Default lifetime if not specified
-
-        if row['Period'] < row['Vintage'] or row['Vintage'] + lifetime <= row['Period']: continue # Checks for var costs outside the expected technology's lifetime
-
-        curs.execute("""REPLACE INTO CostVariable(regions, periods, tech, vintage, cost_variable, cost_variable_units, cost_variable_notes, data_cost_variable, data_cost_year, data_curr,
-                     reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (province, row['Period'], row['Technology'], row['Vintage'], row[parameter], f"{int(row['Currency Year'])} {row['Currency']} ({row['Unit']})", row['Notes'], 
-                 round(row[parameter]/row['Conversion Factor'], precision), row['Original Currency Year'], row['Original Currency'],
-                row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-            
-    conn.commit()
-    conn.close()
+    with connect() as conn:
+        curs = conn.cursor()
+
+        insert_table(curs, 'CostVariable', df)
 
     print(f"Variable cost data compiled into {os.path.basename(database)}\n")
 
@@ -968,63 +1204,33 @@ def compile_costfixed():
     """
     Reads fixed costs from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'CostFixed'
     parameter = 'CostFixed'
-    last_col = 'Technological'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('CostFixed', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
-
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
 
-    # Melts the vintage columns into vintage and parameter colums 
-    vintages = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Vintage', value_name=parameter, value_vars=vintages)
+    # Melts the vintage columns into vintage and parameter colums, drops empty parameter rows and remove NaNs from the table
+    df = melt_years(df, 'Vintage', parameter)
     df.Vintage = df.Vintage.astype(int)
-
-    # Drops empty parameter rows, convert years into integers, and remove NaNs from the table
-    df = df.dropna(subset=[parameter])
     df = df.fillna('')
 
     # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df = finalize(df, parameter)
+    df = cost_units(df, parameter)
 
     # Reads technologies' lifetimes
-    df_lifetime = pd.read_excel(spreadsheet, sheet_name = 'Lifetime', skiprows=[0], usecols=['Technology', 'Lifetime'])
+    lifetime = tech_lifetimes(df['Technology'])
+
+    # Checks for fixed costs outside the expected technology's lifetime
+    outside = (df['Period'] < df['Vintage']) | (df['Vintage'] + lifetime <= df['Period'])
+    df = df[~outside].copy()
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
-    
-    for _idx, row in df.iterrows():
-        
-        # Attempt to find the lifetime for the given technology
-        lifetime_rows = df_lifetime[df_lifetime.Technology == row['Technology']].Lifetime
-        if len(lifetime_rows) > 0:
-            lifetime = lifetime_rows.values[0]
-        else:
-            lifetime = 40  # Default lifetime if not specified
-            
-        if row['Period'] < row['Vintage'] or row['Vintage'] + lifetime <= row['Period']: continue # Checks for fixed costs outside the expected technology's lifetime
-
-        curs.execute("""REPLACE INTO CostFixed(regions, periods, tech, vintage, cost_fixed, cost_fixed_units, cost_fixed_notes, data_cost_fixed, data_cost_year, data_curr,
-                     reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (province, row['Period'], row['Technology'], row['Vintage'], row[parameter], f"{int(row['Currency Year'])} {row['Currency']} ({row['Unit']})", row['Notes'], 
-                 round(row[parameter]/row['Conversion Factor'], precision), row['Original Currency Year'], row['Original Currency'],
-                row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-            
-    conn.commit()
-    conn.close()
+    with connect() as conn:
+        curs = conn.cursor()
+
+        insert_table(curs, 'CostFixed', df)
 
     print(f"Fixed cost data compiled into {os.path.basename(database)}\n")
 
@@ -1038,59 +1244,40 @@ def compile_emissionact():
     """
     Reads emission factors from activities from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'EmissionAct'
     parameter = 'EmissionActivity'
-    last_col = 'Technological'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('EmissionAct', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
-
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
 
     # Melts the vintage columns into vintage and parameter colums and drops rows with empty parameters
-    vintages = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Vintage', value_name=parameter, value_vars=vintages)
-    df = df.dropna(subset=[parameter])
+    df = melt_years(df, 'Vintage', parameter)
 
     # Fill NaNs as empty values; allowing for consistent grouping of vintages
     df = df.fillna('')
 
     # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df = finalize(df, parameter)
+    df = convert_emissions(df, parameter)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
-
-    for _idx, row in df.iterrows():
-        if row['Emission Commodity'] in ['ch4', 'n2o'] and convert_emission_units:
-            curs.execute("""REPLACE INTO EmissionActivity(regions, emis_comm, input_comm, tech, vintage, output_comm, emis_act, emis_act_units, emis_act_notes, 
-                        reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                        (province, row['Emission Commodity'], row['Input Commodity'], row['Technology'], row['Vintage'], row['Output Commodity'], row[parameter]*1000, row['Unit'].replace('kt', 't'), row['Notes'], 
-                        row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-        
-        else:
-            curs.execute("""REPLACE INTO EmissionActivity(regions, emis_comm, input_comm, tech, vintage, output_comm, emis_act, emis_act_units, emis_act_notes, 
-                        reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                        (province, row['Emission Commodity'], row['Input Commodity'], row['Technology'], row['Vintage'], row['Output Commodity'], row[parameter], row['Unit'], row['Notes'], 
-                        row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-            
-    conn.commit()
-    conn.close()
+    with connect() as conn:
+        curs = conn.cursor()
+
+        insert_table(curs, 'EmissionActivity', df)
 
     print(f"Emission factors from activity data compiled into {os.path.basename(database)}\n")
 
+def convert_emissions(df, parameter):
+    """
+    Converts CH4 and N2O units of ktonnes into tonnes if convert_emission_units is set
+    """
+    if convert_emission_units:
+        convert = df['Emission Commodity'].isin(['ch4', 'n2o'])
+        df.loc[convert, parameter] = df.loc[convert, parameter] * 1000
+        df.loc[convert, 'Unit'] = df.loc[convert, 'Unit'].str.replace('kt', 't')
+    return df
+
 """
 ##################################################
     Emission Embodied
@@ -1101,73 +1288,44 @@ def compile_emissionemb():
     """
     Reads emission factors from capacities from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'EmissionEmb'
     parameter = 'EmissionEmbodied'
-    last_col = 'Technological'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('EmissionEmb', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
-
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
 
     # Copies the values from 2021 to re-create vintages for 2025-2050
     df['2025'], df['2030'], df['2035'], df['2040'], df['2045'], df['2050'] = df['2021'], df['2021'], df['2021'], df['2021'], df['2021'], df['2021']
 
     # Melts the vintage columns into vintage and parameter colums and drops rows with empty parameters
-    vintages = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Vintage', value_name=parameter, value_vars=vintages)
-    df = df.dropna(subset=[parameter])
+    df = melt_years(df, 'Vintage', parameter)
 
     # Fill NaNs as empty values; allowing for consistent grouping of vintages
     df = df.fillna('')
 
     # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df = finalize(df, parameter)
+    df = convert_emissions(df, parameter)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
-
-    # Creates the EmissionEmbodied table
-    # curs.execute("""CREATE TABLE EmissionEmbodied(
-    #                 regions      TEXT,
-    #                 emis_comm   TEXT
-    #                     REFERENCES commodities (comm_name),
-    #                 tech        TEXT
-    #                     REFERENCES technologies (tech),
-    #                 vintage     INTEGER
-    #                     REFERENCES time_periods (t_periods),
-    #                 value       REAL,
-    #                 units       TEXT,
-    #                 notes       TEXT, reference, data_year, data_flags, dq_est, dq_rel, dq_comp, dq_time, dq_geog, dq_tech, additional_notes,
-    #                 PRIMARY KEY (regions, emis_comm, tech, vintage))""")
-
-    for _idx, row in df.iterrows():
-        if row['Emission Commodity'] in ['ch4', 'n2o'] and convert_emission_units:
-            curs.execute("""REPLACE INTO EmissionEmbodied(regions, emis_comm, tech, vintage, value, units, notes, 
-                        reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                        (province, row['Emission Commodity'], row['Technology'], row['Vintage'], row[parameter]*1000, row['Unit'].replace('kt', 't'), row['Notes'], 
-                        row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-        
-        else:
-            curs.execute("""REPLACE INTO EmissionEmbodied(regions, emis_comm, tech, vintage, value, units, notes, 
-                        reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                        (province, row['Emission Commodity'], row['Technology'], row['Vintage'], row[parameter], row['Unit'], row['Notes'], 
-                        row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-            
-    conn.commit()
-    conn.close()
+    with connect() as conn:
+        curs = conn.cursor()
+
+        # Creates the EmissionEmbodied table
+        # curs.execute("""CREATE TABLE EmissionEmbodied(
+        #                 regions      TEXT,
+        #                 emis_comm   TEXT
+        #                     REFERENCES commodities (comm_name),
+        #                 tech        TEXT
+        #                     REFERENCES technologies (tech),
+        #                 vintage     INTEGER
+        #                     REFERENCES time_periods (t_periods),
+        #                 value       REAL,
+        #                 units       TEXT,
+        #                 notes       TEXT, reference, data_year, data_flags, dq_est, dq_rel, dq_comp, dq_time, dq_geog, dq_tech, additional_notes,
+        #                 PRIMARY KEY (regions, emis_comm, tech, vintage))""")
+
+        insert_table(curs, 'EmissionEmbodied', df)
 
     print(f"Emission factors from capacity data compiled into {os.path.basename(database)}\n")
 
@@ -1181,47 +1339,26 @@ def compile_techinputsplit():
     """
     Reads tech input commodity splits from the .xlsx file and compiles them into .sqlite format 
     """
-    sheet = 'InputSplit'
     parameter = 'TechInputSplit'
-    last_col = 'Technological'
 
-    if sheet not in pd.ExcelFile(spreadsheet).sheet_names:
+    df = read_sheet('InputSplit', last_col='Technological')
+    if df is None:
         return None
-    
-    # Reads excel sheet columns and limits the number of columns to the last DQI
-    cols = pd.read_excel(spreadsheet, sheet_name = sheet, header=None, skiprows=[0], nrows=1).iloc[0].values.tolist()
-    ncols = cols.index(last_col) #    Last column to read
-
-    # Imports the table on the excel sheet
-    df = pd.read_excel(spreadsheet, sheet_name = sheet, skiprows=[0], usecols=range(ncols + 1))
-    df.columns = df.columns.astype(str)
-    df = df.loc[:, ~df.columns.str.contains('Unnamed')]
 
-    # Melts the vintage columns into vintage and parameter colums and drops rows with empty parameters
-    periods = [col for col in df.columns if col.isdigit()]
-    params = [col for col in df.columns if not col.isdigit()]
-    df = pd.melt(df, id_vars=params, var_name='Period', value_name=parameter, value_vars=periods)
-    df = df.dropna(subset=[parameter])
+    # Melts the period columns into period and parameter colums and drops rows with empty parameters
+    df = melt_years(df, 'Period', parameter)
 
     # Fill NaNs as empty values
     df = df.fillna('')
 
     # Round values to the nearest precision (decimal place) and normalize references to ASCII
-    df[parameter] = df[parameter].round(precision)
-    df['Reference'] = df['Reference'].apply(normalize_to_ascii)
+    df = finalize(df, parameter)
 
     # Connect with database and replace parameters
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+    with connect() as conn:
+        curs = conn.cursor()
 
-    for _idx, row in df.iterrows():
-        curs.execute("""REPLACE INTO TechInputSplit(regions, periods, input_comm, tech, ti_split, ti_split_notes, reference, data_year, dq_rel, dq_comp, dq_time, dq_geog, dq_tech)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (province, row['Period'], row['Input Commodity'], row['Technology'], row[parameter], row['Notes'], 
-                row['Reference'], row['Data Year'], row['Reliability'], row['Representativeness'], dq_time(row['Data Year']), row['Geographical'], row['Technological']))
-            
-    conn.commit()
-    conn.close()
+        insert_table(curs, 'TechInputSplit', df)
 
     print(f"Tech input commodity split data compiled into {os.path.basename(database)}\n")
 
@@ -1232,68 +1369,171 @@ def compile_techinputsplit():
 """
 
 def update_cost_variable_entries():
-    # Connect to the SQLite database
-    conn = sqlite3.connect(database)
+    """
+    Fills variable costs of existing tech-vintage pairs (up to 2020) missing in CostVariable with the entries
+    of the closest vintage greater than or equal to theirs, found with a single as-of join
+    """
+    last_vintage = 2020 #   Latest vintage to backfill
+
+    with connect() as conn:
+
+        # Fetch data from ExistingCapacity and CostVariable tables
+        existing_capacity_df = pd.read_sql_query("SELECT DISTINCT tech, vintage FROM ExistingCapacity WHERE vintage <= ?", conn, params=(last_vintage,))
+        cost_variable_df = pd.read_sql_query("SELECT * FROM CostVariable", conn)
+        vintages = cost_variable_df[['tech', 'vintage']].drop_duplicates()
+
+        # Find all tech-vintage pairs missing in CostVariable
+        missing_pairs = existing_capacity_df.merge(vintages, on=['tech', 'vintage'], how='left', indicator=True)
+        missing_pairs = missing_pairs[missing_pairs['_merge'] == 'left_only'].drop(columns=['_merge'])
+
+        # Match each missing pair with the closest vintage in CostVariable that is greater than or equal to its vintage
+        matched_pairs = pd.merge_asof(missing_pairs.sort_values('vintage'), vintages.rename(columns={'vintage': 'matched_vintage'}).sort_values('matched_vintage'),
+                                      left_on='vintage', right_on='matched_vintage', by='tech', direction='forward').dropna(subset=['matched_vintage'])
+        matched_pairs['matched_vintage'] = matched_pairs['matched_vintage'].astype(vintages['vintage'].dtype)
+
+        # Copy the matched entries over to the missing vintages and insert them at once
+        new_rows_df = matched_pairs.merge(cost_variable_df.rename(columns={'vintage': 'matched_vintage'}), on=['tech', 'matched_vintage'])
+        new_rows_df['cost_variable_notes'] = 'Assumed the same value as the next quinquennium vintage (e.g., 2019 -> 2020)'
+        new_rows_df = new_rows_df[cost_variable_df.columns]
+
+        if not new_rows_df.empty:
+            write_frame(conn, 'CostVariable', new_rows_df, if_exists='append')
+
+    print(f"Inserted {len(new_rows_df)} new entries into the CostVariable table.\n")
+
+
+"""
+##################################################
+    Compile steps and dependencies
+##################################################
+"""
+
+# Compile steps in dependency order, with the inputs they read and the tables they write.
+# Inputs are spreadsheet sheets, template sheets ('template:<sheet>'), the RAMP-mobility results ('ldv_profile') or the time slices ('time_slices')
+compile_steps = [
+    (insert_template,        ['template:' + table for table in template_tables], template_tables),
+    (compile_ref,            ['References'], ['references']),
+    (compile_techs,          ['Techs'], ['technologies']),
+    (compile_comms,          ['Comms'], ['commodities']),
+    (compile_demand,         ['Demand'], ['Demand']),
+    (compile_time_slices,    ['template:time_season', 'time_slices'], ['time_season', 'SegFrac']),
+    (compile_dsd,            ['DemandDist', 'template:DemandSpecificDistribution', 'ldv_profile', 'time_slices'], ['DemandSpecificDistribution']),
+    (compile_cft,            ['template:CapacityFactorTech', 'ldv_profile', 'time_slices'], ['CapacityFactorTech']),
+    (compile_lifetime,       ['Lifetime'], ['LifetimeTech']),
+    (compile_excap,          ['ExCap'], ['ExistingCapacity']),
+    (compile_c2a,            ['Cap2Act'], ['CapacityToActivity']),
+    (compile_acf,            ['CapFactor', 'Lifetime', 'template:time_periods'], ['MaxAnnualCapacityFactor', 'MinAnnualCapacityFactor']),
+    (compile_efficiency,     ['Efficiency'], ['Efficiency']),
+    (compile_costinvest,     ['CostInvest'], ['CostInvest']),
+    (compile_costvariable,   ['CostVariable', 'Lifetime'], ['CostVariable']),
+    (compile_costfixed,      ['CostFixed', 'Lifetime'], ['CostFixed']),
+    (compile_emissionact,    ['EmissionAct'], ['EmissionActivity']),
+    (compile_emissionemb,    ['EmissionEmb'], ['EmissionEmbodied']),
+    (compile_techinputsplit, ['InputSplit'], ['TechInputSplit'])
+]
+
+# Tables that cleanup() and update_cost_variable_entries() prune or fill against other tables;
+# whenever one of the latter is recompiled, the former has to be recompiled too
+cleanup_dependencies = {
+    'Efficiency': ['ExistingCapacity'],
+    'CostVariable': ['ExistingCapacity', 'Efficiency'],
+    'CostFixed': ['ExistingCapacity', 'Efficiency'],
+    'CostInvest': ['Efficiency'],
+    'MaxAnnualCapacityFactor': ['Efficiency'],
+    'MinAnnualCapacityFactor': ['Efficiency']
+}
+
+def active_steps():
+    """
+    Compile steps that apply to the current settings
+    """
+    skip = [compile_cft if charging_dsd else compile_dsd]
+    if not create_emission_embodied: skip.append(compile_emissionemb)
+    return [step for step in compile_steps if step[0] not in skip]
+
+def file_hash(path):
+    """
+    SHA-256 of a file, or None if it does not exist
+    """
+    if not os.path.exists(path): return None
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''): digest.update(chunk)
+    return digest.hexdigest()
+
+def compile_inputs(steps):
+    """
+    Content keys of every input read by the compile steps
+    """
+    keys = {}
+    for _step, inputs, _tables in steps:
+        for source in inputs:
+            if source == 'ldv_profile': keys[source] = file_hash(ldv_profile)
+            elif source == 'time_slices': keys[source] = time_slices if time_slices in ('365D', '12D') else file_hash(time_slices)
+            elif source.startswith('template:'): keys[source] = workbook(template).keys.get(source.split(':', 1)[1])
+            else: keys[source] = workbook(spreadsheet).keys.get(source)
+    return keys
+
+def compile_settings():
+    """
+    Settings that affect every table; a change in any of them requires a full compile
+    """
+    return {
+        'code': file_hash(os.path.abspath(__file__)),
+        'profile_code': file_hash(sys.modules[hourly_profile.__module__].__file__),
+        'year': datetime.today().year,  # dq_time() depends on the current year
+        'province': province,
+        'spreadsheet': spreadsheet,
+        'ldv_profile': ldv_profile,
+        'weather_year': weather_year,
+        'time_zone': time_zone,
+        'time_slice_variants': time_slice_variants,
+        'charging_dsd': charging_dsd,
+        'aggregate_excap': aggregate_excap,
+        'create_emission_embodied': create_emission_embodied,
+        'convert_emission_units': convert_emission_units,
+        'epsilon': epsilon,
+        'precision': precision
+    }
+
+def steps_to_rerun(steps, inputs, settings):
+    """
+    Returns the compile steps affected by the inputs that changed since the last compile, or None if a full compile is needed
+    """
+    manifest = manifest_path()
+    if not os.path.exists(database) or not os.path.exists(manifest): return None
+
+    with open(manifest, 'r') as f: previous = json.load(f)
+    if previous['settings'] != settings or previous['database_mtime'] != os.stat(database).st_mtime_ns: return None
+
+    # Tables written by the steps that read a changed input
+    changed = {source for source, key in inputs.items() if previous['inputs'].get(source) != key}
+    tables = {table for _step, sources, written in steps if changed & set(sources) for table in written}
 
-    # Fetch data from ExistingCapacity and CostVariable tables
-    existing_capacity_df = pd.read_sql_query("SELECT tech, vintage FROM ExistingCapacity", conn)
-    cost_variable_df = pd.read_sql_query("SELECT tech, vintage FROM CostVariable", conn).drop_duplicates()
-
-    # Define thresholds for vintage
-    vintage_thresholds = [2005, 2010, 2015, 2020]
-
-    # Loop over each vintage threshold
-    for threshold in vintage_thresholds:
-        # Find all tech-vintage pairs missing in CostVariable for the current threshold
-        missing_pairs = existing_capacity_df.merge(cost_variable_df, on=['tech', 'vintage'], how='left', indicator=True)
-        missing_pairs = missing_pairs[(missing_pairs['_merge'] == 'left_only') & (missing_pairs['vintage'] <= threshold)].drop(columns=['_merge'])
-
-        # Loop through each missing pair to find and insert corresponding entries
-        for _, missing_row in missing_pairs.iterrows():
-            tech = missing_row['tech']
-            vintage = missing_row['vintage']
-
-            # Find the closest matching vintage in CostVariable that is greater than or equal to the current vintage
-            matched_rows = pd.read_sql_query(f"""
-                SELECT * FROM CostVariable
-                WHERE tech = '{tech}' AND vintage >= {vintage}
-                ORDER BY vintage ASC LIMIT 1
-            """, conn)
-            
-            if not matched_rows.empty:
-                matched_vintage = matched_rows['vintage'].iloc[0]
-                matched_cost_variable_entries = pd.read_sql_query(f"""
-                    SELECT * FROM CostVariable
-                    WHERE tech = '{tech}' AND vintage = {matched_vintage}
-                """, conn)
-
-                # Prepare new rows for the missing pair using the matched entries
-                new_rows = []
-                for _, entry_row in matched_cost_variable_entries.iterrows():
-                    # Check if the entry already exists
-                    existing_entry = pd.read_sql_query(f"""
-                        SELECT COUNT(*) as count FROM CostVariable
-                        WHERE tech = '{tech}' AND vintage = {vintage} AND periods = {entry_row['periods']}
-                    """, conn)
-                    
-                    if existing_entry['count'].iloc[0] == 0:
-                        new_row = entry_row.copy()
-                        new_row['vintage'] = vintage
-                        new_row['cost_variable_notes'] = 'Assumed the same value as the next quinquennium vintage (e.g., 2019 -> 2020)'
-                        new_rows.append(new_row)
-                
-                # Convert new rows to DataFrame and insert them
-                if new_rows:
-                    new_rows_df = pd.DataFrame(new_rows)
-                    new_rows_df.to_sql('CostVariable', conn, if_exists='append', index=False)
-
-    # Verify the insertion
-    new_entries_count = pd.read_sql_query("SELECT COUNT(*) FROM CostVariable WHERE cost_variable_notes='Inserted by script based on threshold match'", conn)
-    print(f"Inserted {new_entries_count['COUNT(*)'].iloc[0]} new entries into the CostVariable table.")
-
-    # Close the connection
-    conn.close()
+    # Propagate to the tables pruned against them by cleanup(), and to the other tables written by the same steps
+    while True:
+        pruned = {table for table, against in cleanup_dependencies.items() if tables & set(against)}
+        rewritten = {table for _step, _sources, written in steps if (tables | pruned) & set(written) for table in written}
+        if rewritten <= tables: break
+        tables |= rewritten
+
+    return [step for step in steps if tables & set(step[2])]
+
+def manifest_path():
+    """
+    Inputs and settings of the last compile are recorded next to the database
+    """
+    return os.path.splitext(database)[0] + '_manifest.json'
 
+def write_manifest(inputs, settings):
+    """
+    Records the inputs and settings of the compile next to the database
+    """
+    manifest = manifest_path()
+    with open(manifest + '.tmp', 'w') as f:
+        json.dump({'settings': settings, 'inputs': inputs, 'database_mtime': os.stat(database).st_mtime_ns}, f, indent=4)
+    os.replace(manifest + '.tmp', manifest)
 
 """
 ##################################################
@@ -1303,38 +1543,241 @@ def update_cost_variable_entries():
 
 def compile_transport():
     """
-    Runs all compiling functions
+    Runs all compiling functions. In incremental mode, only reruns the steps affected by the inputs that changed since the last compile
     """
-    instantiate_database()
+    steps = active_steps()
 
-    insert_template()
-    compile_ref()
-    compile_techs()
-    compile_comms()
-    compile_demand()
+    # Sheets are parsed concurrently up front (largest first) and loaded by the compile steps below in dependency order
+    parse_workbooks({
+        spreadsheet: ['CostVariable', 'Efficiency', 'ExCap', 'CostInvest', 'CostFixed', 'Lifetime', 'CapFactor', 'Demand', 'DemandDist',
+                      'EmissionAct', 'EmissionEmb', 'Techs', 'Comms', 'Cap2Act', 'InputSplit', 'References'],
+        template: template_tables + ['DemandSpecificDistribution', 'CapacityFactorTech']
+    })
 
-    if charging_dsd: compile_dsd()
-    else: compile_cft()
+    inputs, settings = compile_inputs(steps), compile_settings()
+    rerun = steps_to_rerun(steps, inputs, settings) if incremental else None
 
-    compile_lifetime()
-    compile_excap()
-    compile_c2a()
-    compile_acf()
-    compile_efficiency()
-    compile_costinvest()
-    compile_costvariable()
-    compile_costfixed()
-    compile_emissionact()
+    if rerun == []:
+        print(f"{os.path.basename(database)} is up to date with {os.path.basename(spreadsheet)}\n")
+        return
 
-    if create_emission_embodied: compile_emissionemb()
+    with build_database(wipe=wipe_database and rerun is None) as conn:
+        for step, _inputs, tables in steps if rerun is None else rerun:
+            if rerun is not None:
+                # Recompiled tables are cleared first so that removed rows do not persist
+                for table in tables: conn.execute(f'DELETE FROM "{table}"')
+                print(f"Recompiling {', '.join(tables)}")
+            step()
 
-    compile_techinputsplit()
+        if not aggregate_excap and (rerun is None or any('CostVariable' in tables for _step, _inputs, tables in rerun)):
+            update_cost_variable_entries()
 
-    if not aggregate_excap: update_cost_variable_entries()
+        cleanup()
 
-    cleanup()
+    write_manifest(inputs, settings)
+    compile_variants()
+    evict_sheet_cache()
 
     print(f"All parameter data from {os.path.basename(spreadsheet)} compiled into {os.path.basename(database)}\n")
 
+"""
+##################################################
+    Charging profile sweep
+##################################################
+"""
+
+# Charging profile scenarios compiled by sweep_charging(): RAMP-mobility travel surveys, weather years and battery assumptions
+# (charging_simulation.battery_scenarios). Profiles not in the RAMP-mobility results are simulated with charging_simulation.py
+sweep_surveys = ['TTS2016', 'NHTS2022']
+sweep_weather_years = [2018]
+sweep_batteries = ['2023-batteries']
+sweep_output = 'databases'  # 'databases' (<db_name>_<scenario>.sqlite for each scenario) or 'table' (long-format tables keyed by scenario in <db_name>_sweep.sqlite)
+
+# RAMP-mobility result names of the scenarios, following ldv_profile_pattern (<s> is the survey's name in the results, <y> the weather year and
+# <b> the battery assumption)
+sweep_profile_pattern = '<r>-<s>_<y>_v4_<b>'
+sweep_survey_names = {'TTS2016': '2016TTS_no-we', 'NHTS2022': '2022NHTS'}
+
+def sweep_profile(survey, year, battery):
+    """
+    Charging profile of a scenario: the RAMP-mobility results if they exist, otherwise the profile simulated with charging_simulation.py
+    (simulated if it does not exist yet)
+    """
+    scenario = f"{survey} {year} {battery}"
+    name = sweep_profile_pattern.replace('<r>', province).replace('<s>', sweep_survey_names.get(survey, survey)).replace('<y>', str(year)).replace('<b>', battery)
+    profile = charging_simulation.results + name + '.csv'
+    if os.path.exists(profile):
+        print(f"Charging profile of {scenario} read from the RAMP-mobility results {os.path.basename(profile)}")
+        return profile
+
+    profile = charging_simulation.results + f"{province}-{survey}_{year}_{battery}_native.csv"
+    if os.path.exists(profile):
+        print(f"Charging profile of {scenario} read from the simulated profile {os.path.basename(profile)}")
+    else:
+        cp = charging_simulation.simulate_charging(survey, year, charging_simulation.battery_scenarios[battery])
+        charging_simulation.write_profile(cp, profile)
+        print(f"Charging profile of {scenario} simulated into {os.path.basename(profile)}")
+    return profile
+
+def sweep_job(survey, year, battery, settings=None):
+    """
+    Compiles the charging profile tables of one scenario in a worker process of sweep_charging(), returning its variant database, log,
+    timing and error (if any)
+    """
+    globals().update(settings or {})
+
+    log, error, variant = io.StringIO(), None, None
+    start = time.perf_counter()
+    with redirect_stdout(log):
+        try:
+            profile = sweep_profile(survey, year, battery)
+            variant = compile_variant(f"{survey}_{year}_{battery}", ['ldv_profile', 'time_slices'], ldv_profile=profile, weather_year=year, survey=survey)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return variant, log.getvalue(), time.perf_counter() - start, error
+
+def sweep_charging(scenarios=None, workers=None):
+    """
+    Compiles the charging profile tables (DSD or CFT, along with the time slices) of every (survey, weather year, battery) scenario
+    in parallel processes, starting from the compiled database. Returns the compile time in seconds of each scenario (None if it failed)
+    """
+    scenarios = [tuple(scenario) for scenario in scenarios or itertools.product(sweep_surveys, sweep_weather_years, sweep_batteries)]
+    workers = min(workers or os.cpu_count() or 1, len(scenarios))
+    settings = {name: globals()[name] for name in batch_settings + ['province', 'version', 'database', 'spreadsheet']}
+
+    timings, variants = {}, {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=workbooks.clear) as pool:
+        futures = {pool.submit(sweep_job, *scenario, settings=settings): scenario for scenario in scenarios}
+        for future in as_completed(futures):
+            scenario = futures[future]
+            variant, log, elapsed, error = future.result()
+            print(log, end='')
+            if error is not None:
+                print(f"Failed to compile {' '.join(map(str, scenario))}: {error}\n")
+            timings[scenario] = None if error is not None else elapsed
+            if variant is not None: variants[scenario] = variant
+
+    # Gathers the scenario tables into long-format tables keyed by scenario
+    if sweep_output == 'table' and not variants:
+        print("No charging profile scenario compiled, nothing to gather\n")
+    elif sweep_output == 'table':
+        tables = [tables for step, _inputs, tables in active_steps() if step in (compile_dsd, compile_cft, compile_time_slices)]
+        sweep_database = os.path.splitext(database)[0] + '_sweep.sqlite'
+        with sqlite3.connect(sweep_database) as sweep_conn:
+            for table in [table for step_tables in tables for table in step_tables]:
+                frames = []
+                for (survey, year, battery), variant in variants.items():
+                    with sqlite3.connect(variant) as conn:
+                        df = pd.read_sql_query(f'SELECT * FROM "{table}"', conn)
+                    frames.append(df.assign(scenario=f"{survey}_{year}_{battery}", survey=survey, weather_year=year, battery=battery))
+                write_frame(sweep_conn, table, pd.concat(frames, ignore_index=True))
+        sweep_conn.close()
+
+        for variant in variants.values(): os.remove(variant)
+        print(f"Charging profile scenarios compiled into {os.path.basename(sweep_database)}\n")
+
+    print("Compile times:")
+    for scenario in scenarios:
+        print(f"    {' '.join(map(str, scenario))}: " + (f"{timings[scenario]:.1f} s" if timings[scenario] is not None else "failed"))
+    return timings
+
+"""
+##################################################
+    Batch compile
+##################################################
+"""
+
+# Settings handed to the worker processes of compile_provinces(), which may not inherit the ones changed in this process
+batch_settings = ['dir_path', 'schema', 'template', 'sheet_cache', 'sheet_cache_entries', 'spreadsheet_pattern', 'db_pattern', 'ldv_profile_pattern',
+                  'weather_year', 'time_zone', 'survey', 'time_slices', 'time_slice_variants', 'charging_dsd', 'aggregate_excap', 'create_emission_embodied',
+                  'convert_emission_units', 'epsilon', 'precision', 'wipe_database', 'incremental']
+
+def configure(prov, ver=None, profile_name=None):
+    """
+    Points the settings to the spreadsheet, database and RAMP-mobility results of a province and spreadsheet version
+    """
+    global province, version, spreadsheet_name, db_name, ldv_profile_name, database, spreadsheet, ldv_profile
+
+    province, version = prov, ver or version
+    spreadsheet_name = spreadsheet_pattern.replace('<r>', province).replace('<v>', version)
+    db_name = db_pattern.replace('<r>', province.lower()).replace('<v>', version.lstrip('v'))
+    ldv_profile_name = profile_name or ldv_profile_pattern.replace('<r>', province)
+
+    database = dir_path + 'compiled_database/' + db_name + '.sqlite'
+    spreadsheet = dir_path + 'spreadsheet_database/' + spreadsheet_name + '.xlsx'
+    ldv_profile = dir_path + '../charging_profiles/ramp_mobility/results/' + ldv_profile_name + '.csv'
+
+def compile_job(prov, ver=None, profile_name=None, settings=None, workers=None):
+    """
+    Compiles the database of one province in a worker process of compile_provinces(), returning its log, timing and error (if any)
+    """
+    global parse_workers
+
+    globals().update(settings or {})
+    configure(prov, ver, profile_name)
+    parse_workers = workers or parse_workers
+
+    log, error = io.StringIO(), None
+    start = time.perf_counter()
+    with redirect_stdout(log):
+        try:
+            compile_transport()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return log.getvalue(), time.perf_counter() - start, error
+
+def compile_provinces(jobs, workers=None):
+    """
+    Compiles the databases of several provinces in parallel processes. Jobs are (province, version) or (province, version, ldv_profile_name)
+    tuples; returns the compile time in seconds of each job (None if it failed)
+    """
+    jobs = [(job[0], job[1] or version) + tuple(job[2:]) for job in jobs]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    parse_share = max(1, parse_workers // workers)  # Each compile parses its sheets with its share of the processors
+    settings = {name: globals()[name] for name in batch_settings}
+
+    timings = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=workbooks.clear) as pool:
+        futures = {pool.submit(compile_job, *job[:3], settings=settings, workers=parse_share): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            log, elapsed, error = future.result()
+            print(log, end='')
+            if error is not None:
+                print(f"Failed to compile {job[0]} {job[1]}: {error}\n")
+            timings[job] = None if error is not None else elapsed
+
+    print("Compile times:")
+    for job in jobs:
+        print(f"    {job[0]} {job[1]}: " + (f"{timings[job]:.1f} s" if timings[job] is not None else "failed"))
+    return timings
+
+def parse_job(text):
+    """
+    Parses a PROVINCE[:VERSION[:LDV_PROFILE]] command-line job
+    """
+    prov, ver, profile_name = (text.split(':', 2) + [None, None])[:3]
+    return prov.upper(), ver or None, profile_name or None
+
 if __name__ == "__main__":
-    compile_transport()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Compiles CANOE-TRN spreadsheets into Temoa sqlite databases")
+    parser.add_argument('provinces', nargs='*', type=parse_job, metavar='PROVINCE[:VERSION[:LDV_PROFILE]]',
+                        help=f"provinces to compile, each into its own database (default: {province})")
+    parser.add_argument('-v', '--version', default=version, help=f"spreadsheet version of provinces given without one (default: {version})")
+    parser.add_argument('-j', '--jobs', type=int, help="number of provinces compiled in parallel (default: number of processors)")
+    parser.add_argument('-i', '--incremental', action='store_true', help="only recompile tables whose inputs changed since the last compile")
+    parser.add_argument('-s', '--sweep', action='store_true', help="also compile the charging profile scenarios (sweep_surveys, sweep_weather_years, sweep_batteries)")
+    args = parser.parse_args()
+
+    incremental = incremental or args.incremental
+    jobs = [(prov, ver or args.version, profile_name) for prov, ver, profile_name in args.provinces or [(province, None, None)]]
+
+    if args.sweep and len(jobs) > 1:
+        parser.error("--sweep needs a single province")
+
+    if len(jobs) == 1:
+        configure(*jobs[0])
+        compile_transport()
+        if args.sweep: sweep_charging(workers=args.jobs)
+    else:
+        compile_provinces(jobs, args.jobs)
@@ -1,7 +1,20 @@
 import os
-import shutil
+import io
+import re
+import json
+import html
+import hashlib
+import zipfile
+import threading
+import urllib.request
+import urllib.error
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import pandas as pd
-import openpyxl
+import numpy as np
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.formula.translate import Translator
+from recalculate_spreadsheet import workbook_part, shared_strings, row_pattern, cell_pattern, recalculate
 
 spreadsheet_name = 'CANOE_TRN_<r>_v3'    # Copies will be made of the master_spreadsheet (ON) after updating with NRCan EUD tables from other provinces
 province_list = [
@@ -39,19 +52,116 @@ this_dir = os.path.realpath(os.path.dirname(__file__)) + "/"
 spreadsheet = dir_path + 'spreadsheet_database/' + spreadsheet_name + '.xlsx'
 dir_tables = this_dir + 'nrcan_eud_tables/'
 
+# Downloaded files are kept in dir_tables/raw/ along with their ETag/Last-Modified (manifest.json) to revalidate them with conditional
+# requests. The .csv caches are used when the server cannot be reached and there is no downloaded file
+revalidate = True       # False uses the local caches without contacting the server
+fetch_workers = 8       # Concurrent downloads
+fetch_timeout = 60      # Seconds
+
+dir_raw = dir_tables + 'raw/'
+manifest_file = dir_tables + 'manifest.json'
+manifest = None                     # Loaded on first use
+manifest_lock = threading.Lock()
+fetched = set()                     # Urls whose caches were brought up to date by fetch_tables()
+
+# Cleaned tables are cached in dir_tables/processed/ as typed arrays, keyed by the content of their .csv cache and processing_version
+processing_version = 1              # Bump when the cleanup of get_nrcan_data() changes
+dir_processed = dir_tables + 'processed/'
+
 def get_nrcan_url(region, table_number):
     return str(nrcan_url).replace('<r>', region.lower()).replace('<t>', str(table_number))
 
-def string_cleaner(string):
-    return ''.join(letter for letter in string if letter in '- /()–|%' or letter.isalnum())
+def load_manifest():
+    global manifest
+    if manifest is None:
+        try:
+            with open(manifest_file) as f: manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError): manifest = {}
+    return manifest
 
-def string_letters(string):
-    return ''.join(letter for letter in string_cleaner(string) if letter not in 'Â²¹')
+def save_manifest():
+    # Written into a temporary file first so an interrupted run does not leave a truncated manifest
+    os.makedirs(dir_tables, exist_ok=True)
+    with open(manifest_file + '.tmp', 'w') as f: json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
 
-def clean_index(df):
-    df.index = [string_letters(idx) for idx in df.index]
+def read_bytes(path):
+    with open(path, 'rb') as f: return f.read()
 
-def get_data(url, file_type=None, cache_file_type=None, name=None, **kwargs) -> pd.DataFrame | None:
+def fetch(url, name=None):
+    """
+    Downloads a file unless the downloaded copy is still current, revalidating it with a conditional request. Returns its content and
+    whether it changed since the last download; falls back to the downloaded copy if the server cannot be reached
+    """
+    if name == None: name = url.split("/")[-1].split("\\")[-1]
+    raw_file = dir_raw + name
+    with manifest_lock: entry = dict(load_manifest().get(name, {}))
+
+    cached = os.path.isfile(raw_file) and entry.get('url') == url
+    if cached and not revalidate: return read_bytes(raw_file), False
+
+    headers = {}
+    if cached and entry.get('etag'): headers['If-None-Match'] = entry['etag']
+    if cached and entry.get('last_modified'): headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=fetch_timeout) as response:
+            content = response.read()
+            etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached: return read_bytes(raw_file), False    # Not modified
+        if not cached: raise
+        print(f"Failed to revalidate {name} ({e}), using the downloaded copy.")
+        return read_bytes(raw_file), False
+    except (urllib.error.URLError, OSError) as e:
+        if not cached: raise
+        print(f"Failed to revalidate {name} ({e}), using the downloaded copy.")
+        return read_bytes(raw_file), False
+
+    digest = hashlib.sha256(content).hexdigest()
+    os.makedirs(dir_raw, exist_ok=True)
+    with open(f"{raw_file}.{threading.get_ident()}.tmp", 'wb') as f: f.write(content)
+    os.replace(f"{raw_file}.{threading.get_ident()}.tmp", raw_file)
+
+    with manifest_lock:
+        load_manifest()[name] = {'url': url, 'etag': etag, 'last_modified': last_modified, 'sha256': digest,
+                                 'fetched': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+        save_manifest()
+    return content, entry.get('sha256') != digest
+
+def fetch_tables(regions, nrcan_tables, workers=None):
+    """
+    Fetches the NRCan tables of every region concurrently ahead of processing them and brings their caches up to date
+    """
+    urls = [get_nrcan_url(region, table_number) for region in regions for table_number in nrcan_tables]
+    downloads = {}
+    with ThreadPoolExecutor(max_workers=workers or fetch_workers) as pool:
+        futures = {pool.submit(fetch, url): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                downloads[url] = future.result()
+            except Exception as e:
+                print(f"Failed to download {url}")
+                print(e)
+                downloads[url] = (None, False)
+
+    modified = sum(changed for _content, changed in downloads.values())
+    print(f"Fetched {len(urls)} NRCan tables ({modified} new or modified).")
+
+    # Cached in this process, so the worker processes of compile_provinces() read the caches without fetching the tables again
+    for url in urls:
+        if cache_data(url, download=downloads[url], skiprows=10) is not None: fetched.add(url)
+
+def share_fetched(urls):
+    # Initializer of the worker processes of compile_provinces(), which do not inherit fetched under the spawn start method
+    fetched.update(urls)
+
+def cache_data(url, file_type=None, cache_file_type=None, name=None, download=None, **kwargs) -> str | None:
+    """
+    Brings the local cache of a file up to date, parsing the file only if it changed, and returns the path of the cache. download is the
+    content of the file and whether it changed, if already fetched
+    """
     # Get the original file name
     if name == None: name = url.split("/")[-1].split("\\")[-1]
     if file_type == None: file_type = url.split(".")[-1]
@@ -65,86 +175,116 @@ def get_data(url, file_type=None, cache_file_type=None, name=None, **kwargs) ->
     if name.split(".")[-1] != cache_file_type: name = os.path.splitext(name)[0] + "."+cache_file_type
     cache_file = dir_tables + name
     
-    data = None
-    if os.path.isfile(cache_file):
-        # Get from existing local cache
-        if cache_file_type == "csv": data = pd.read_csv(cache_file, index_col=0, dtype='unicode')
-        print(f"Got {name} from local cache.")   
+    # Brought up to date by fetch_tables(), already fetched or fetched now
+    if os.path.isfile(cache_file) and download is None and (not revalidate or url in fetched):
+        print(f"Got {name} from local cache.")
+        return cache_file
+    if download is not None: content, changed = download
     else:
         print(f"Downloading {name} ...")
-        try:
-            # Download from url
-            if file_type == "csv": data = pd.read_csv(url, **kwargs)
-            elif "xl" in file_type: data = pd.read_excel(url, **kwargs)
-            data.columns = [str(col).strip() for col in data.columns]
+        try: content, changed = fetch(url)
         except Exception as e:
             print(f"Failed to download {url}")
             print(e)
+            content, changed = None, False
 
-        # Try to cache downloaded file
-        try:
-            if not os.path.exists(dir_tables): os.mkdir(dir_tables)
-            if cache_file_type == "csv": data.to_csv(cache_file)
-            print(f"Cached {name}.")
-        except Exception as e:
-            print(f"Failed to cache {cache_file}.")
-            print(e)
-    return data
+    data = None
+    if os.path.isfile(cache_file) and (content is None or not changed):
+        # Get from existing local cache
+        print(f"Got {name} from local cache.")
+        return cache_file
+    elif content is None:
+        return None
 
-def get_nrcan_data(region, table_number, table_label, first_row=0, last_row=None) -> pd.DataFrame:
-    # Get the requested table and discard excess rows, clean up table
-    df = get_data(get_nrcan_url(region, table_number), skiprows=10)
+    try:
+        # Parse the downloaded file
+        if file_type == "csv": data = pd.read_csv(io.BytesIO(content), **kwargs)
+        elif "xl" in file_type: data = pd.read_excel(io.BytesIO(content), **kwargs)
+        data.columns = [str(col).strip() for col in data.columns]
+    except Exception as e:
+        print(f"Failed to read {url}")
+        print(e)
+        return None
+
+    # Try to cache downloaded file
+    try:
+        if not os.path.exists(dir_tables): os.mkdir(dir_tables)
+        if cache_file_type == "csv": data.to_csv(cache_file)
+        print(f"Cached {name}.")
+        return cache_file
+    except Exception as e:
+        print(f"Failed to cache {cache_file}.")
+        print(e)
+        return None
+
+def get_data(url, file_type=None, cache_file_type=None, name=None, **kwargs) -> pd.DataFrame | None:
+    cache_file = cache_data(url, file_type, cache_file_type, name, **kwargs)
+    if cache_file is not None and cache_file.endswith(".csv"):
+        return pd.read_csv(cache_file, index_col=0, dtype='unicode')
+    return None
+
+def clean_table(df, table_label, first_row=0, last_row=None) -> pd.DataFrame:
+    # Discard excess rows, clean up table
     df = df.loc[first_row::] if last_row is None else df.loc[first_row:last_row]
     df = df.drop("Unnamed: 0", axis=1).set_index('Unnamed: 1')
     df.index.name = None
-    
-    # Process index to append variable names and drop empty rows
-    header = None
-    labels = []
-    for idx, row in df.iterrows():
-        if pd.isna(idx):
-            header = None
-            labels.append(idx)
-        elif header is None:
-            if pd.isna(row['2000']):    # First year column of every series
-                header = idx
-                labels.append(idx)
-            else: labels.append(idx)
-        else:
-            labels.append(f"{header}|{idx}")
-    df.index = labels
-    df.dropna(inplace=True)
-    clean_index(df)
+
+    # Rows following a header (the first row of each block of rows with no value in the first year column) are appended its name
+    idx = pd.Series(df.index, dtype=object)
+    block = idx.isna().cumsum()
+    is_header = idx.notna() & df['2000'].isna().values
+    header = is_header.groupby(block).transform('idxmax').where(is_header.groupby(block).transform('any'))
+    under = pd.Series(np.arange(len(idx))) > header
+    idx[under] = idx.values[header[under].astype(int)] + '|' + idx[under]
+    df.index = idx.values
+    df = df.dropna()
+    df.index = df.index.str.replace(r'[^\w\- /()–|%]|[_Â²¹]', '', regex=True)
 
     # Drop rows containing "Shares" and "GHG"
     df = df[~df.index.str.contains("Shares|GHG", na=False)]
 
-    # Process index for entries with "Activity" and "Energy Intensity"
-    new_index = []
-    activity_count = 0
-    intensity_count = 0
-    for idx in df.index:
-        # for tables with more than one vehicle class, e.g., table 36
-        if isinstance(table_label, list) and ("Activity" in idx or "Energy Intensity" in idx or "Energy Use by Energy Source" in idx):
-            if "Activity" in idx:
-                label_to_use = table_label[activity_count % len(table_label)]
-                activity_count += 1
-            elif "Energy Intensity" in idx:
-                label_to_use = table_label[intensity_count % len(table_label)]
-                intensity_count += 1
-            elif "Energy Use by Energy Source" in idx:
-                label_to_use = table_label[0]   # only first label is assigned
-            new_index.append(f"{label_to_use}|{idx}")
-        elif isinstance(table_label, str) and ("Activity" in idx or "Energy Intensity" in idx or "Energy Use by Energy Source" in idx):
-            new_index.append(f"{table_label}|{idx}")
-        else:
-            new_index.append(idx)
-    df.index = new_index
+    # Entries with "Activity", "Energy Intensity" and "Energy Use by Energy Source" are prefixed with their vehicle class. Tables with
+    # more than one vehicle class, e.g., table 36, alternate the classes of their activity and intensity entries and assign energy use
+    # to the first class
+    labels = table_label if isinstance(table_label, list) else [table_label]
+    activity = df.index.str.contains("Activity")
+    intensity = df.index.str.contains("Energy Intensity") & ~activity
+    energy_use = df.index.str.contains("Energy Use by Energy Source") & ~activity & ~intensity
+
+    prefix = pd.Series(None, index=range(len(df)), dtype=object)
+    prefix[energy_use] = labels[0]
+    prefix[intensity] = np.take(labels, np.cumsum(intensity)[intensity] - 1, mode='wrap')
+    prefix[activity] = np.take(labels, np.cumsum(activity)[activity] - 1, mode='wrap')
+    idx = pd.Series(df.index, dtype=object)
+    df.index = idx.where(prefix.isna(), prefix + '|' + idx).values
     df.columns = [int(col) for col in df.columns]
-    
+
     # Convert all data from strings to floats or nan
-    df.replace('n.a.', pd.NA, inplace=True)
-    df = df.astype(float, errors='ignore')
+    return df.replace('n.a.', np.nan).astype(float)
+
+def get_nrcan_data(region, table_number, table_label, first_row=0, last_row=None) -> pd.DataFrame:
+    # Get the requested table, from the processed cache if its source and processing did not change since it was cleaned
+    cache_file = cache_data(get_nrcan_url(region, table_number), skiprows=10)
+    if cache_file is None: raise FileNotFoundError(f"Table {table_number} of {region.upper()} is not available")
+
+    key = hashlib.sha256(read_bytes(cache_file))
+    key.update(f"{processing_version} {table_label} {first_row} {last_row} {pd.__version__}".encode())
+    key = key.hexdigest()
+
+    processed_file = dir_processed + os.path.splitext(os.path.basename(cache_file))[0] + '.npz'
+    try:
+        with np.load(processed_file) as processed:
+            if str(processed['key']) == key:
+                return pd.DataFrame(processed['values'], index=processed['index'].astype(object), columns=processed['columns'])
+    except Exception: pass     # Not cached yet or unreadable
+
+    df = clean_table(pd.read_csv(cache_file, index_col=0, dtype='unicode'), table_label, first_row, last_row)
+
+    # Written into a temporary file first since other processes may store the same table concurrently
+    os.makedirs(dir_processed, exist_ok=True)
+    with open(f"{processed_file}.{os.getpid()}.tmp", 'wb') as f:
+        np.savez(f, key=key, index=df.index.values.astype(str), columns=np.array(df.columns), values=df.values)
+    os.replace(f"{processed_file}.{os.getpid()}.tmp", processed_file)
     return df
 
 def concatenate_all_tables(region, nrcan_tables):
@@ -160,34 +300,149 @@ def concatenate_all_tables(region, nrcan_tables):
     df = pd.concat(all_tables, axis=0)
     return df
 
-def compile_spreadsheets(region, spreadsheet, nrcan_tables, start_row=3, end_row=118, insert_col=3):
+"""
+Provincial spreadsheets are written by editing the Background Data sheet part of the ON spreadsheet (xlsx zip) in place: only the rows
+matched with NRCan series are rewritten and every other part of the workbook is copied unchanged. The cached values of the formulas
+depending on them are then recalculated (recalculate_spreadsheet.py) since compile_transport.py reads the cached values
+"""
+
+sheet_name = 'Background Data'
+spreadsheet_workers = None      # Provinces written concurrently (None uses every CPU)
+recalculate_formulas = True     # Recalculates the formulas depending on the Background Data so the spreadsheets need no Excel round-trip
+
+def cell_value(attributes, content, strings):
+    # Value of a cell as read by openpyxl (formulas as their text)
+    if content is None: return None
+    formula = re.search(r'<f(?:\s[^>]*)?>(.*?)</f>', content, re.S)
+    if formula: return '=' + html.unescape(formula.group(1))
+    value = re.search(r'<v>(.*?)</v>', content, re.S)
+    cell_type = re.search(r'\bt="([^"]+)"', attributes)
+    cell_type = cell_type.group(1) if cell_type else 'n'
+    if cell_type == 'inlineStr': return html.unescape(''.join(re.findall(r'<t(?:\s[^>]*)?>(.*?)</t>', content, re.S)))
+    if value is None: return None
+    if cell_type == 's': return strings[int(value.group(1))]
+    return html.unescape(value.group(1))
+
+def spreadsheet_rows(spreadsheet, start_row=3, end_row=118):
+    """
+    Maps the index (column A) of the Background Data rows to update to their row numbers
+    """
+    with zipfile.ZipFile(spreadsheet) as zf:
+        strings = shared_strings(zf)
+        xml = zf.read(workbook_part(zf, sheet_name)).decode('utf-8')
+
+    rows = {}
+    for row in row_pattern.finditer(xml):
+        r = int(row.group(1))
+        if not start_row < r <= end_row: continue
+        for cell in cell_pattern.finditer(row.group(0)):
+            if cell.group(1) == 'A':
+                rows.setdefault(cell_value(cell.group(3), cell.group(4), strings), []).append(r)
+    return rows
+
+def write_row(row_xml, r, values, insert_col):
+    """
+    Rewrites the cells of a row from insert_col with values, keeping their styles. None values (n.a. in NRCan) leave their cell as it was.
+    Returns the row and the shared formulas (si) whose master cell was overwritten
+    """
+    head = re.match(r'<row [^>]*?(?=/?>)', row_xml).group(0)
+    cells = {column_index_from_string(c.group(1)): c for c in cell_pattern.finditer(row_xml)}
+    xml = {col: c.group(0) for col, c in cells.items()}
+
+    masters = []
+    for col_offset, value in enumerate(values):
+        if value is None: continue
+        col = insert_col + col_offset
+        old = cells.get(col)
+        style = re.search(r'\bs="(\d+)"', old.group(3)) if old else None
+        style = f' s="{style.group(1)}"' if style else ''
+        if old and old.group(4) and '<f' in old.group(4):
+            master = re.search(r'<f [^>]*t="shared"[^>]*ref="[^"]+"[^>]*si="(\d+)"|<f [^>]*si="(\d+)"[^>]*ref="[^"]+"', old.group(4))
+            if master: masters.append((master.group(1) or master.group(2), get_column_letter(col) + str(r), old.group(4)))
+
+        ref = get_column_letter(col) + str(r)
+        xml[col] = f'<c r="{ref}"{style}><v>{value!r}</v></c>'
+    return head + '>' + ''.join(xml[col] for col in sorted(xml)) + '</row>', masters
+
+def expand_shared_formulas(xml, masters):
+    # Cells sharing the formula of an overwritten master cell are given their own copy of the formula
+    for si, master_ref, master_content in masters:
+        formula = html.unescape(re.search(r'<f[^>]*>(.*?)</f>', master_content, re.S).group(1))
+        def expand(cell):
+            translated = Translator('=' + formula, origin=master_ref).translate_formula(cell.group(1) + cell.group(2))
+            return cell.group(0)[:cell.group(0).index('<f')] + f'<f>{html.escape(translated[1:], quote=False)}</f>' + cell.group(4)
+        xml = re.sub(r'<c r="([A-Z]+)(\d+)"[^>]*>(<f [^>]*si="' + si + r'"[^>]*?(?:/>|>\s*</f>))(.*?</c>)', expand, xml, flags=re.S)
+    return xml
+
+def compile_spreadsheets(region, spreadsheet, nrcan_tables, start_row=3, end_row=118, insert_col=3, rows=None):
     """
     New spreadsheets are built on top of the ON spreadsheet model and copied into new spreadsheets
     """
     nrcan_df = concatenate_all_tables(region.lower(), nrcan_tables)
     master_spreadsheet = spreadsheet.replace('<r>', 'ON')
-
     target_spreadsheet = spreadsheet.replace('<r>', region)
-    shutil.copyfile(master_spreadsheet, target_spreadsheet)
+    if rows is None: rows = spreadsheet_rows(master_spreadsheet, start_row, end_row)
+
+    # Time-series data of the rows whose index matches nrcan_df
+    updates = {}
+    for spreadsheet_index in nrcan_df.index.intersection(list(rows)):
+        time_series = nrcan_df.loc[spreadsheet_index].values
+        time_series = [float(value) if pd.notnull(value) else None for value in time_series]
+        for r in rows[spreadsheet_index]: updates[r] = time_series
 
-    workbook = openpyxl.load_workbook(target_spreadsheet)
-    sheet = workbook['Background Data']
+    with zipfile.ZipFile(master_spreadsheet) as zin:
+        part = workbook_part(zin, sheet_name)
+        parts = {part: zin.read(part).decode('utf-8')}
 
-    # Iterate through the rows and update time-series data
-    for i, row in enumerate(sheet.iter_rows(min_row=start_row + 1, max_row=end_row, max_col=1)):
-        spreadsheet_index = row[0].value
+        # Rewrites only the matched rows, starting from column C
+        masters, formulas = [], 0
+        def update(row):
+            nonlocal formulas
+            r = int(row.group(1))
+            if r not in updates: return row.group(0)
+            values = dict(enumerate(updates[r]))
+            formulas += sum(1 for c in cell_pattern.finditer(row.group(0))
+                            if c.group(4) and '<f' in c.group(4) and values.get(column_index_from_string(c.group(1)) - insert_col) is not None)
+            new_row, row_masters = write_row(row.group(0), r, updates[r], insert_col)
+            masters.extend(row_masters)
+            return new_row
+        parts[part] = expand_shared_formulas(row_pattern.sub(update, parts[part]), masters)
 
-        if spreadsheet_index in nrcan_df.index:  # Match the index with nrcan_df
-            time_series = nrcan_df.loc[spreadsheet_index].values
-            time_series = [float(value) if pd.notnull(value) else None for value in time_series]
-            # print(f"{spreadsheet_index}: {time_series}\n")
+        # Formulas replaced by values are dropped from the calculation chain (rebuilt by Excel), and the workbook is recalculated on load
+        drop = set()
+        if formulas and 'xl/calcChain.xml' in zin.namelist():
+            drop.add('xl/calcChain.xml')
+            parts['[Content_Types].xml'] = re.sub(r'<Override [^>]*PartName="/xl/calcChain.xml"[^>]*/>', '', zin.read('[Content_Types].xml').decode('utf-8'))
+            parts['xl/_rels/workbook.xml.rels'] = re.sub(r'<Relationship [^>]*Target="/?(?:xl/)?calcChain.xml"[^>]*/>', '',
+                                                         zin.read('xl/_rels/workbook.xml.rels').decode('utf-8'))
+        workbook = zin.read('xl/workbook.xml').decode('utf-8')
+        if 'fullCalcOnLoad' not in workbook: workbook = re.sub(r'<calcPr\b', '<calcPr fullCalcOnLoad="1"', workbook, count=1)
+        parts['xl/workbook.xml'] = workbook
 
-            # Determine the range of columns to update, starting from column C
-            for col_offset, value in enumerate(time_series):
-                sheet.cell(row=start_row + i + 1, column=insert_col + col_offset, value=value)
+        # Written into a temporary file first so an interrupted run does not leave a corrupted spreadsheet
+        with zipfile.ZipFile(f"{target_spreadsheet}.{os.getpid()}.tmp", 'w', zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                if info.filename in drop: continue
+                zout.writestr(info, parts[info.filename].encode('utf-8') if info.filename in parts else zin.read(info))
+    os.replace(f"{target_spreadsheet}.{os.getpid()}.tmp", target_spreadsheet)
+    print(f'Sucessfully re-created {target_spreadsheet} ({len(updates)} rows updated).')
+
+    if recalculate_formulas: recalculate(target_spreadsheet, [sheet_name])
+
+def compile_provinces(regions, spreadsheet, nrcan_tables, start_row=3, end_row=118, insert_col=3, workers=None):
+    """
+    Compiles the spreadsheets of several provinces in parallel processes, matching the rows of the ON spreadsheet only once
+    """
+    rows = spreadsheet_rows(spreadsheet.replace('<r>', 'ON'), start_row, end_row)
+    workers = min(workers or spreadsheet_workers or os.cpu_count() or 1, len(regions))
 
-    workbook.save(target_spreadsheet)
-    print(f'Sucessfully re-created {target_spreadsheet}.')
+    with ProcessPoolExecutor(max_workers=workers, initializer=share_fetched, initargs=(fetched,)) as pool:
+        futures = {pool.submit(compile_spreadsheets, region, spreadsheet, nrcan_tables, start_row, end_row, insert_col, rows): region
+                   for region in regions}
+        for future in as_completed(futures):
+            try: future.result()
+            except Exception as e: print(f"Failed to compile the {futures[future]} spreadsheet: {e}")
 
-for province in province_list:
-    compile_spreadsheets(province, spreadsheet, nrcan_tables)
\ No newline at end of file
+if __name__ == "__main__":
+    fetch_tables(province_list, nrcan_tables)
+    compile_provinces(province_list, spreadsheet, nrcan_tables)
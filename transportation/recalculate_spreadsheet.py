@@ -0,0 +1,994 @@
+"""
+Recalculates the formulas of an .xlsx spreadsheet without Excel, so spreadsheets written by scripts (e.g., the provincial spreadsheets of
+get_nrcan_data.py) carry up-to-date cached values for compile_transport.py. Formulas are parsed once per shared formula, ordered by their
+dependencies and evaluated over cached ranges; only those depending on the updated sheets are recalculated. Results are written into the
+cached values (<v>) of the sheet parts, leaving every other part of the workbook unchanged
+@author: Rashid Zetter
+"""
+
+import os
+import re
+import html
+import math
+import zipfile
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP, ROUND_DOWN, ROUND_UP
+from functools import lru_cache
+import numpy as np
+from openpyxl.formula.tokenizer import Tokenizer, Token
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+"""
+##################################################
+    Workbook parts
+##################################################
+"""
+
+row_pattern = re.compile(r'<row r="(\d+)"[^>]*?(?:/>|>.*?</row>)', re.S)
+cell_pattern = re.compile(r'<c r="([A-Z]+)(\d+)"([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+formula_pattern = re.compile(r'<f\b([^>]*?)(?:/>|>(.*?)</f>)', re.S)
+
+def sheet_parts(zf):
+    # Paths of the sheets within the xlsx zip, from the workbook and its relationships
+    workbook = zf.read('xl/workbook.xml').decode('utf-8')
+    rels = zf.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+    targets = {re.search(r'\bId="([^"]+)"', rel).group(1): re.search(r'\bTarget="([^"]+)"', rel).group(1)
+               for rel in re.findall(r'<Relationship [^>]*>', rels)}
+
+    parts = {}
+    for sheet in re.findall(r'<sheet [^>]*>', workbook):
+        target = targets[re.search(r'r:id="([^"]+)"', sheet).group(1)]
+        name = html.unescape(re.search(r'\bname="([^"]+)"', sheet).group(1))
+        parts[name] = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    return parts
+
+def workbook_part(zf, sheet_name):
+    return sheet_parts(zf)[sheet_name]
+
+def shared_strings(zf):
+    try: xml = zf.read('xl/sharedStrings.xml').decode('utf-8')
+    except KeyError: return []
+    strings = []
+    for si in re.findall(r'<si>(.*?)</si>', xml, re.S):
+        si = re.sub(r'<rPh\b.*?</rPh>', '', si, flags=re.S)    # Phonetic runs are not part of the text
+        strings.append(html.unescape(''.join(re.findall(r'<t(?:\s[^>]*)?>(.*?)</t>', si, re.S))))
+    return strings
+
+def defined_names(zf, sheets):
+    # Formulas of the defined names, keyed by their scope (None for the workbook or a sheet name) and their name in upper case
+    workbook = zf.read('xl/workbook.xml').decode('utf-8')
+    names = {}
+    for attributes, text in re.findall(r'<definedName ([^>]*)>(.*?)</definedName>', workbook, re.S):
+        name = html.unescape(re.search(r'\bname="([^"]+)"', attributes).group(1))
+        if name.startswith('_xlnm.'): continue     # Print areas, filters and such
+        scope = re.search(r'\blocalSheetId="(\d+)"', attributes)
+        names[(sheets[int(scope.group(1))] if scope else None, name.upper())] = html.unescape(text)
+    return names
+
+"""
+##################################################
+    Values
+##################################################
+"""
+
+class ExcelError(Exception):
+    """
+    Excel error value (#N/A, #VALUE!, ...); raised to propagate it out of a function
+    """
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, ExcelError) and other.code == self.code
+
+    def __hash__(self):
+        return hash(self.code)
+
+    def __repr__(self):
+        return self.code
+
+NA, VALUE, REF, DIV0, NUM, NAME, NULL, CALC = (ExcelError(code) for code in
+                                               ['#N/A', '#VALUE!', '#REF!', '#DIV/0!', '#NUM!', '#NAME?', '#NULL!', '#CALC!'])
+errors = {e.code: e for e in [NA, VALUE, REF, DIV0, NUM, NAME, NULL, CALC]}
+
+number_text = re.compile(r'^\s*[+-]?(\d+\.?\d*|\.\d+)(e[+-]?\d+)?\s*$', re.I)
+
+def cached_value(attributes, content, strings):
+    # Value of a cell as last calculated by Excel
+    if content is None: return None
+    cell_type = re.search(r'\bt="([^"]+)"', attributes)
+    cell_type = cell_type.group(1) if cell_type else 'n'
+    if cell_type == 'inlineStr': return html.unescape(''.join(re.findall(r'<t(?:\s[^>]*)?>(.*?)</t>', content, re.S)))
+    value = re.search(r'<v(?:\s[^>]*)?(?:/>|>(.*?)</v>)', content, re.S)
+    if value is None: return None
+    value = value.group(1) or ''
+    if cell_type == 's': return strings[int(value)]
+    if cell_type == 'str': return html.unescape(value)
+    if cell_type == 'b': return value == '1'
+    if cell_type == 'e': return errors.get(value, ExcelError(value))
+    return float(value)
+
+def is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+def to_number(v):
+    if isinstance(v, ExcelError): raise v
+    if v is None: return 0.0
+    if isinstance(v, (int, float)): return float(v)
+    if number_text.match(v): return float(v)
+    raise VALUE
+
+def to_text(v):
+    if isinstance(v, ExcelError): raise v
+    if v is None: return ''
+    if isinstance(v, bool): return 'TRUE' if v else 'FALSE'
+    if isinstance(v, (int, float)):
+        return str(int(v)) if v == int(v) and abs(v) < 1e15 else ('%.15g' % v).upper()
+    return v
+
+def truth(v):
+    if isinstance(v, ExcelError): raise v
+    if v is None: return False
+    if isinstance(v, (int, float)): return v != 0
+    if v.upper() in ('TRUE', 'FALSE'): return v.upper() == 'TRUE'
+    raise VALUE
+
+def rank(v):
+    # Excel orders numbers before text and text before logical values
+    return 2 if isinstance(v, bool) else 1 if isinstance(v, str) else 0
+
+def order(a, b):
+    # -1, 0 or 1 for values of the same rank (text compared case-insensitively)
+    if isinstance(a, str): a, b = a.casefold(), b.casefold()
+    return (a > b) - (a < b)
+
+def compare(a, b, op):
+    if isinstance(a, ExcelError): raise a
+    if isinstance(b, ExcelError): raise b
+    if a is None: a = '' if isinstance(b, str) else False if isinstance(b, bool) else 0.0
+    if b is None: b = '' if isinstance(a, str) else False if isinstance(a, bool) else 0.0
+    c = order(a, b) if rank(a) == rank(b) else (rank(a) > rank(b)) - (rank(a) < rank(b))
+    return {'=': c == 0, '<>': c != 0, '<': c < 0, '>': c > 0, '<=': c <= 0, '>=': c >= 0}[op]
+
+def arithmetic(op, a, b):
+    x, y = to_number(a), to_number(b)
+    try:
+        if op == '+': result = x + y
+        elif op == '-': result = x - y
+        elif op == '*': result = x * y
+        elif op == '/':
+            if y == 0: raise DIV0
+            result = x / y
+        else:
+            if x == 0 and y <= 0: raise DIV0 if y < 0 else NUM
+            result = x ** y
+    except OverflowError:
+        raise NUM
+    if isinstance(result, complex) or math.isinf(result) or math.isnan(result): raise NUM
+    return result
+
+operators = {
+    '+': lambda a, b: arithmetic('+', a, b), '-': lambda a, b: arithmetic('-', a, b), '*': lambda a, b: arithmetic('*', a, b),
+    '/': lambda a, b: arithmetic('/', a, b), '^': lambda a, b: arithmetic('^', a, b), '&': lambda a, b: to_text(a) + to_text(b),
+    '=': lambda a, b: compare(a, b, '='), '<>': lambda a, b: compare(a, b, '<>'), '<': lambda a, b: compare(a, b, '<'),
+    '>': lambda a, b: compare(a, b, '>'), '<=': lambda a, b: compare(a, b, '<='), '>=': lambda a, b: compare(a, b, '>=')
+}
+
+def as_array(v):
+    return v if isinstance(v, np.ndarray) else np.array([[v]], dtype=object)
+
+def scalar(v):
+    # Single values of 1x1 arrays (e.g., a reference to a single cell)
+    return v[0, 0] if isinstance(v, np.ndarray) and v.size == 1 else v
+
+def conform(args):
+    """
+    Expands the arguments of an element-wise operation to a common shape: single rows and columns are repeated and smaller arrays are
+    padded with #N/A, as Excel does
+    """
+    shapes = [a.shape for a in args if isinstance(a, np.ndarray)]
+    rows, cols = max(s[0] for s in shapes), max(s[1] for s in shapes)
+
+    conformed = []
+    for a in args:
+        if not isinstance(a, np.ndarray):
+            a = np.array(a, dtype=object) if not isinstance(a, ExcelError) else np.array([[a]], dtype=object)
+        elif (a.shape[0] not in (1, rows)) or (a.shape[1] not in (1, cols)):
+            padded = np.full((rows if a.shape[0] != 1 else 1, cols if a.shape[1] != 1 else 1), NA, dtype=object)
+            padded[:a.shape[0], :a.shape[1]] = a
+            a = padded
+        conformed.append(np.broadcast_to(a, (rows, cols)))
+    return conformed
+
+def elementwise(f, *args):
+    """
+    Applies a function of single values to arrays element by element; errors raised by the function become the value of their element
+    """
+    def safe(*values):
+        try: return f(*values)
+        except ExcelError as e: return e
+    if not any(isinstance(a, np.ndarray) for a in args): return safe(*args)
+    return np.frompyfunc(safe, len(args), 1)(*conform(args))
+
+@lru_cache(maxsize=None)
+def wildcard(text):
+    # Case-insensitive pattern of a text with Excel wildcards (* and ?, escaped with ~)
+    pattern = re.sub(r'~([*?~])|([*?])|([^*?~]+|~)',
+                     lambda m: re.escape(m.group(1)) if m.group(1) else ('.*' if m.group(2) == '*' else '.') if m.group(2) else re.escape(m.group(3)),
+                     text)
+    return re.compile(pattern, re.S | re.I)
+
+def equal(v, x):
+    # Exact match of a lookup value (with wildcards for text)
+    if isinstance(v, str): return isinstance(x, str) and wildcard(v).fullmatch(x) is not None
+    return rank(x) == rank(v) and not isinstance(x, (str, ExcelError)) and x is not None and x == v
+
+"""
+##################################################
+    Functions
+##################################################
+"""
+
+def numbers(args):
+    """
+    Numbers of the arguments of an aggregate: text, logical values and blanks within arrays are ignored while those given directly as
+    arguments are converted
+    """
+    values = []
+    for a in args:
+        if isinstance(a, np.ndarray):
+            for v in a.flat:
+                if isinstance(v, ExcelError): raise v
+                if is_number(v): values.append(float(v))
+        elif a is not None:
+            values.append(to_number(a))
+    return values
+
+def logicals(args):
+    values = []
+    for a in args:
+        if isinstance(a, np.ndarray):
+            for v in a.flat:
+                if isinstance(v, ExcelError): raise v
+                if isinstance(v, (int, float)): values.append(bool(v))
+        elif a is not None:
+            values.append(truth(a))
+    if not values: raise VALUE
+    return values
+
+def fn_sum(*args):
+    return sum(numbers(args), 0.0)
+
+def fn_average(*args):
+    values = numbers(args)
+    if not values: raise DIV0
+    return sum(values, 0.0) / len(values)
+
+def fn_max(*args):
+    return max(numbers(args), default=0.0)
+
+def fn_min(*args):
+    return min(numbers(args), default=0.0)
+
+def fn_count(*args):
+    return float(sum(1 for a in args for v in as_array(a).flat if is_number(v)) +
+                 sum(1 for a in args if not isinstance(a, np.ndarray) and isinstance(a, str) and number_text.match(a)))
+
+def fn_sumproduct(*args):
+    arrays = [as_array(a) for a in args]
+    if any(a.shape != arrays[0].shape for a in arrays): raise VALUE
+    product = np.ones(arrays[0].shape)
+    for a in arrays:
+        for v in a.flat:
+            if isinstance(v, ExcelError): raise v
+        product *= np.frompyfunc(lambda v: float(v) if is_number(v) else 0.0, 1, 1)(a).astype(float)
+    return float(product.sum())
+
+def round_decimal(x, digits, rounding):
+    try: return float(Decimal(repr(to_number(x))).quantize(Decimal(1).scaleb(-int(to_number(digits))), rounding=rounding))
+    except InvalidOperation: return to_number(x)     # More digits than the precision of Decimal
+
+def fn_floor(x, significance=1.0):
+    x, significance = to_number(x), to_number(significance)
+    if significance == 0:
+        if x == 0: return 0.0
+        raise DIV0
+    if x > 0 and significance < 0: raise NUM
+    return float('%.15g' % (math.floor(round(x / significance, 9)) * significance))
+
+def search(find, within, start=1.0):
+    find, within, start = to_text(find), to_text(within), int(to_number(start))
+    if start < 1 or start > len(within) + 1: raise VALUE
+    found = wildcard(find).search(within, start - 1)
+    if not found: raise VALUE
+    return float(found.start() + 1)
+
+def find(find, within, start=1.0):
+    find, within, start = to_text(find), to_text(within), int(to_number(start))
+    if start < 1 or start > len(within) + 1: raise VALUE
+    found = within.find(find, start - 1)
+    if found < 0: raise VALUE
+    return float(found + 1)
+
+def mid(text, start, n):
+    text, start, n = to_text(text), int(to_number(start)), int(to_number(n))
+    if start < 1 or n < 0: raise VALUE
+    return text[start - 1:start - 1 + n]
+
+def match(v, values, match_type):
+    """
+    Position (from 1) of a lookup value in a list of values: exact (match_type 0) or the last value not above (1) or not below (-1)
+    the lookup value in a sorted list
+    """
+    if isinstance(v, ExcelError): raise v
+    if v is None: raise NA
+    if match_type == 0:
+        for i, x in enumerate(values):
+            if equal(v, x): return float(i + 1)
+        raise NA
+
+    found = None
+    for i, x in enumerate(values):
+        if x is None or isinstance(x, ExcelError) or rank(x) != rank(v): continue
+        if order(x, v) * (1 if match_type > 0 else -1) <= 0: found = i
+        else: break
+    if found is None: raise NA
+    return float(found + 1)
+
+def fn_match(value, lookup, match_type=1.0):
+    lookup = as_array(lookup)
+    if lookup.shape[0] != 1 and lookup.shape[1] != 1: raise NA
+    values, match_type = list(lookup.flat), to_number(scalar(match_type))
+    return elementwise(lambda v: match(v, values, match_type), scalar(value))
+
+def fn_vlookup(value, table, col, approximate=True):
+    table, col = as_array(table), int(to_number(scalar(col)))
+    if col < 1: raise VALUE
+    if col > table.shape[1]: raise REF
+    first, match_type = list(table[:, 0]), 1 if truth(scalar(approximate)) else 0
+    return elementwise(lambda v: table[int(match(v, first, match_type)) - 1, col - 1], scalar(value))
+
+def fn_hlookup(value, table, row, approximate=True):
+    return fn_vlookup(value, as_array(table).T, row, approximate)
+
+def fn_index(array, row=None, col=None):
+    array = as_array(array)
+    if col is None and array.shape[0] == 1 and array.shape[1] > 1: row, col = 1.0, row     # INDEX of a single row by column
+
+    def index(r, c):
+        r, c = int(to_number(r)) if r is not None else 0, int(to_number(c)) if c is not None else 0
+        if r < 0 or c < 0: raise VALUE
+        if r > array.shape[0] or c > array.shape[1]: raise REF
+        return array[r - 1:r if r else None, c - 1:c if c else None]
+
+    row, col = scalar(row), scalar(col)
+    if isinstance(row, np.ndarray) or isinstance(col, np.ndarray):
+        return elementwise(lambda r, c: scalar(index(r, c)), row, col)
+    return index(row, col)
+
+def criterion(c):
+    """
+    Predicate of a criteria argument of SUMIF, AVERAGEIF, ... (3, 'BEV*', '>=5', '<>', ...)
+    """
+    if isinstance(c, ExcelError): raise c
+    if c is None: c = 0.0
+    if not isinstance(c, str): return lambda x: equal(c, x)
+
+    op, operand = re.match(r'(<=|>=|<>|<|>|=)?(.*)', c, re.S).groups()
+    op = op or '='
+    target = float(operand) if number_text.match(operand) else operand.upper() == 'TRUE' if operand.upper() in ('TRUE', 'FALSE') else operand
+
+    if op in ('=', '<>'):
+        if target == '': matches = lambda x: x is None or x == ''
+        else: matches = lambda x: equal(target, x)
+        return matches if op == '=' else lambda x: not matches(x)
+    return lambda x: x is not None and not isinstance(x, ExcelError) and rank(x) == rank(target) and compare(x, target, op)
+
+def resize(a, shape):
+    # Sum ranges of SUMIF take the size of the criteria range
+    a = as_array(a)
+    if a.shape == shape: return a
+    resized = np.full(shape, None, dtype=object)
+    rows, cols = min(shape[0], a.shape[0]), min(shape[1], a.shape[1])
+    resized[:rows, :cols] = a[:rows, :cols]
+    return resized
+
+def matching(values, ranges, criteria):
+    # Values whose cells in every criteria range match their criterion
+    values = as_array(values)
+    ranges = [as_array(r) for r in ranges]
+    if any(r.shape != values.shape for r in ranges): raise VALUE
+    predicates = [criterion(c) for c in criteria]
+
+    matched = []
+    for i, v in enumerate(values.flat):
+        if all(p(r.flat[i]) for p, r in zip(predicates, ranges)):
+            if isinstance(v, ExcelError): raise v
+            matched.append(v)
+    return matched
+
+def fn_sumif(criteria_range, criteria, sum_range=None):
+    criteria_range = as_array(criteria_range)
+    values = criteria_range if sum_range is None else resize(sum_range, criteria_range.shape)
+    return elementwise(lambda c: sum((v for v in matching(values, [criteria_range], [c]) if is_number(v)), 0.0), scalar(criteria))
+
+def average(values):
+    values = [v for v in values if is_number(v)]
+    if not values: raise DIV0
+    return sum(values, 0.0) / len(values)
+
+def fn_averageif(criteria_range, criteria, average_range=None):
+    criteria_range = as_array(criteria_range)
+    values = criteria_range if average_range is None else resize(average_range, criteria_range.shape)
+    return elementwise(lambda c: average(matching(values, [criteria_range], [c])), scalar(criteria))
+
+def fn_countif(criteria_range, criteria):
+    return elementwise(lambda c: float(len(matching(criteria_range, [criteria_range], [c]))), scalar(criteria))
+
+def fn_sumifs(sum_range, *pairs):
+    return elementwise(lambda *c: sum((v for v in matching(sum_range, pairs[0::2], c) if is_number(v)), 0.0),
+                       *[scalar(c) for c in pairs[1::2]])
+
+def fn_averageifs(average_range, *pairs):
+    return elementwise(lambda *c: average(matching(average_range, pairs[0::2], c)), *[scalar(c) for c in pairs[1::2]])
+
+def fn_countifs(*pairs):
+    return elementwise(lambda *c: float(len(matching(pairs[0], pairs[0::2], c))), *[scalar(c) for c in pairs[1::2]])
+
+omitted = object()
+
+def fn_filter(array, include, if_empty=omitted):
+    array, include = as_array(array), as_array(include)
+    if include.shape == (array.shape[0], 1): axis = 0
+    elif include.shape == (1, array.shape[1]): axis = 1
+    else: raise VALUE
+
+    keep = np.flatnonzero([truth(v) for v in include.flat])
+    if not len(keep):
+        if if_empty is omitted: raise CALC
+        return if_empty
+    return array[keep] if axis == 0 else array[:, keep]
+
+def fn_unique(array, by_col=False, exactly_once=False):
+    array = as_array(array)
+    if truth(scalar(by_col)): return fn_unique(array.T, False, exactly_once).T
+
+    key = lambda row: tuple(v.casefold() if isinstance(v, str) else (rank(v), v) if v is not None else '' for v in row)
+    counts, first = {}, {}
+    for i, row in enumerate(array):
+        counts[key(row)] = counts.get(key(row), 0) + 1
+        first.setdefault(key(row), i)
+    rows = [i for k, i in first.items() if not truth(scalar(exactly_once)) or counts[k] == 1]
+    if not rows: raise CALC
+    return array[rows]
+
+def fn_na():
+    raise NA
+
+
+# Functions by name: implementation and the arguments taking arrays as is (True for all); the other arguments of formulas that are not
+# array formulas are implicitly intersected with the row or column of the formula
+functions = {
+    'SUM': (fn_sum, True), 'AVERAGE': (fn_average, True), 'MAX': (fn_max, True), 'MIN': (fn_min, True), 'COUNT': (fn_count, True),
+    'SUMPRODUCT': (fn_sumproduct, True),
+    'AND': (lambda *args: all(logicals(args)), True), 'OR': (lambda *args: any(logicals(args)), True),
+    'IF': (lambda cond, a, b=False: elementwise(lambda c, x, y: x if truth(c) else y, cond, a, b), ()),
+    'IFERROR': (lambda v, alt: elementwise(lambda x, y: y if isinstance(x, ExcelError) else x, v, alt), ()),
+    'IFNA': (lambda v, alt: elementwise(lambda x, y: y if x == NA else x, v, alt), ()),
+    'ISERROR': (lambda v: elementwise(lambda x: isinstance(x, ExcelError), v), ()),
+    'ISNA': (lambda v: elementwise(lambda x: x == NA, v), ()),
+    'ISNUMBER': (lambda v: elementwise(is_number, v), ()),
+    'ISBLANK': (lambda v: elementwise(lambda x: x is None, v), ()),
+    'NOT': (lambda v: elementwise(lambda x: not truth(x), v), ()),
+    'NA': (fn_na, ()),
+    'ABS': (lambda v: elementwise(lambda x: abs(to_number(x)), v), ()),
+    'ROUND': (lambda v, d: elementwise(lambda x, n: round_decimal(x, n, ROUND_HALF_UP), v, d), ()),
+    'ROUNDDOWN': (lambda v, d: elementwise(lambda x, n: round_decimal(x, n, ROUND_DOWN), v, d), ()),
+    'ROUNDUP': (lambda v, d: elementwise(lambda x, n: round_decimal(x, n, ROUND_UP), v, d), ()),
+    'FLOOR': (lambda v, s=1.0: elementwise(fn_floor, v, s), ()),
+    'SEARCH': (lambda *args: elementwise(search, *args), ()),
+    'FIND': (lambda *args: elementwise(find, *args), ()),
+    'LEFT': (lambda v, n=1.0: elementwise(lambda x, k: mid(x, 1, k), v, n), ()),
+    'RIGHT': (lambda v, n=1.0: elementwise(lambda x, k: mid(x, max(len(to_text(x)) - int(to_number(k)), 0) + 1, k), v, n), ()),
+    'MID': (lambda v, start, n: elementwise(mid, v, start, n), ()),
+    'LEN': (lambda v: elementwise(lambda x: float(len(to_text(x))), v), ()),
+    'MATCH': (fn_match, (1,)), 'VLOOKUP': (fn_vlookup, (1,)), 'HLOOKUP': (fn_hlookup, (1,)), 'INDEX': (fn_index, (0,)),
+    'SUMIF': (fn_sumif, (0, 2)), 'AVERAGEIF': (fn_averageif, (0, 2)), 'COUNTIF': (fn_countif, (0,)),
+    'SUMIFS': (fn_sumifs, (0,) + tuple(range(1, 255, 2))), 'AVERAGEIFS': (fn_averageifs, (0,) + tuple(range(1, 255, 2))),
+    'COUNTIFS': (fn_countifs, tuple(range(0, 255, 2))),
+    'FILTER': (fn_filter, True), 'UNIQUE': (fn_unique, True)
+}
+
+"""
+##################################################
+    Formulas
+##################################################
+"""
+
+# Formulas are parsed into nested tuples: ('num', 1.0), ('str', 'a'), ('bool', True), ('err', NA), ('blank',), ('array', values),
+# ('ref', sheet, r0, c0, r1, c1, absolute), ('name', NAME), ('op', '+', a, b), ('neg', a), ('pct', a) and ('fn', NAME, args).
+# References keep None for the rows of whole columns (and the columns of whole rows) and the sheet is None within the formula's sheet
+
+cell_ref = re.compile(r'(\$?)([A-Z]{1,3})(\$?)(\d+)$')
+col_ref = re.compile(r'(\$?)([A-Z]{1,3})$')
+row_ref = re.compile(r'(\$?)(\d+)$')
+
+def parse_ref(text):
+    """
+    Parses a reference (A1, $A$1:B2, A:A, 1:1, 'Sheet'!A1, ...); returns None for defined names
+    """
+    sheet, _, ref = text.rpartition('!')
+    sheet = sheet[1:-1].replace("''", "'") if sheet.startswith("'") else sheet
+    first, _, last = ref.upper().partition(':')
+    last = last or first
+
+    cells = cell_ref.match(first), cell_ref.match(last)
+    if all(cells):
+        (a0, c0, ar0, r0), (a1, c1, ar1, r1) = (m.groups() for m in cells)
+        bounds = (int(r0), column_index_from_string(c0), int(r1), column_index_from_string(c1))
+        absolute = (bool(ar0), bool(a0), bool(ar1), bool(a1))
+    elif ':' in ref and col_ref.match(first) and col_ref.match(last):
+        (a0, c0), (a1, c1) = col_ref.match(first).groups(), col_ref.match(last).groups()
+        bounds, absolute = (None, column_index_from_string(c0), None, column_index_from_string(c1)), (True, bool(a0), True, bool(a1))
+    elif ':' in ref and row_ref.match(first) and row_ref.match(last):
+        (a0, r0), (a1, r1) = row_ref.match(first).groups(), row_ref.match(last).groups()
+        bounds, absolute = (int(r0), None, int(r1), None), (bool(a0), True, bool(a1), True)
+    else:
+        return None
+    return ('ref', sheet.casefold() or None) + bounds + (absolute,)
+
+def shift(node, rows, cols):
+    """
+    Moves the relative references of a parsed formula (e.g., the master formula of a shared formula) by a number of rows and columns
+    """
+    kind = node[0]
+    if kind == 'ref':
+        bounds = list(node[2:6])
+        for i, (absolute, offset) in enumerate(zip(node[6], (rows, cols, rows, cols))):
+            if bounds[i] is not None and not absolute: bounds[i] += offset
+        if any(b is not None and b < 1 for b in bounds): return ('err', REF)
+        return node[:2] + tuple(bounds) + node[6:]
+    if kind == 'op': return ('op', node[1], shift(node[2], rows, cols), shift(node[3], rows, cols))
+    if kind in ('neg', 'pct'): return (kind, shift(node[1], rows, cols))
+    if kind == 'fn': return ('fn', node[1], tuple(shift(arg, rows, cols) for arg in node[2]))
+    return node
+
+class Parser:
+    """
+    Recursive descent parser of the tokens of a formula, following the precedence of Excel operators
+    """
+    levels = [('=', '<>', '<', '>', '<=', '>='), ('&',), ('+', '-'), ('*', '/'), ('^',)]
+
+    def __init__(self, formula):
+        # Line breaks within formulas (stored as \r\n) are whitespace
+        self.tokens = [t for t in Tokenizer('=' + formula.replace('\r', '\n')).items if t.type != Token.WSPACE]
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def next(self):
+        self.i += 1
+        return self.tokens[self.i - 1]
+
+    def parse(self):
+        node = self.expression()
+        if self.peek() is not None: raise SyntaxError(f"Unexpected {self.peek().value}")
+        return node
+
+    def expression(self, level=0):
+        if level == len(self.levels): return self.unary()
+        node = self.expression(level + 1)
+        while (t := self.peek()) is not None and t.type == Token.OP_IN and t.value in self.levels[level]:
+            self.next()
+            node = ('op', t.value, node, self.expression(level + 1))
+        return node
+
+    def unary(self):
+        # Negation binds tighter than exponentiation (-2^2 = 4)
+        t = self.peek()
+        if t is not None and t.type == Token.OP_PRE:
+            self.next()
+            return ('neg', self.unary()) if t.value == '-' else self.unary()
+        node = self.primary()
+        while (t := self.peek()) is not None and t.type == Token.OP_POST:
+            self.next()
+            node = ('pct', node)
+        return node
+
+    def primary(self):
+        t = self.next()
+        if t.type == Token.OPERAND:
+            if t.subtype == Token.NUMBER: return ('num', float(t.value))
+            if t.subtype == Token.TEXT: return ('str', t.value[1:-1].replace('""', '"'))
+            if t.subtype == Token.LOGICAL: return ('bool', t.value.upper() == 'TRUE')
+            if t.subtype == Token.ERROR: return ('err', errors.get(t.value, ExcelError(t.value)))
+            return parse_ref(t.value) or ('name', t.value.upper())
+        if t.type == Token.FUNC and t.subtype == Token.OPEN:
+            name = re.sub(r'^(_XLFN\.)?(_XLWS\.)?', '', t.value[:-1].upper())
+            args = []
+            if self.peek().type == Token.FUNC and self.peek().subtype == Token.CLOSE:
+                self.next()
+                return ('fn', name, ())
+            while True:
+                t = self.peek()
+                args.append(('blank',) if t.type == Token.SEP or (t.type == Token.FUNC and t.subtype == Token.CLOSE) else self.expression())
+                t = self.next()
+                if t.type == Token.FUNC and t.subtype == Token.CLOSE: return ('fn', name, tuple(args))
+                if t.type != Token.SEP: raise SyntaxError(f"Unexpected {t.value} in {name}")
+        if t.type == Token.PAREN and t.subtype == Token.OPEN:
+            node = self.expression()
+            if self.next().type != Token.PAREN: raise SyntaxError("Unbalanced parentheses")
+            return node
+        if t.type == Token.ARRAY and t.subtype == Token.OPEN:
+            rows, row = [], []
+            while True:
+                sign = -1 if self.peek().type == Token.OP_PRE and self.next().value == '-' else 1
+                value = self.primary()
+                row.append(sign * value[1] if value[0] == 'num' else value[1])
+                t = self.next()
+                if t.type == Token.SEP and t.subtype == Token.ROW: rows.append(row); row = []
+                elif t.type == Token.ARRAY: rows.append(row); return ('array', np.array(rows, dtype=object))
+        raise SyntaxError(f"Unexpected {t.value}")
+
+@lru_cache(maxsize=None)
+def parse_formula(formula):
+    return Parser(formula).parse()
+
+def walk(node):
+    # Every node of a parsed formula
+    yield node
+    if node[0] == 'op': yield from walk(node[2]); yield from walk(node[3])
+    elif node[0] in ('neg', 'pct'): yield from walk(node[1])
+    elif node[0] == 'fn':
+        for arg in node[2]: yield from walk(arg)
+
+class Formula:
+    __slots__ = ('sheet', 'row', 'col', 'node', 'ref', 'array', 'dynamic', 'error')
+
+    def __init__(self, sheet, row, col, node, ref=None, dynamic=False, error=None):
+        self.sheet, self.row, self.col, self.node = sheet, row, col, node
+        self.ref = ref              # Cells (r0, c0, r1, c1) of array formulas
+        self.array = ref is not None
+        self.dynamic = dynamic      # Dynamic array formulas spill their result over ref
+        self.error = error          # Why the formula cannot be evaluated (its cached values are kept)
+
+"""
+##################################################
+    Workbook
+##################################################
+"""
+
+EMPTY = object()    # Spilled cells left without value
+
+class Book:
+    """
+    Cached values and parsed formulas of every sheet of an .xlsx workbook
+    """
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path) as zf:
+            self.parts = sheet_parts(zf)
+            strings = shared_strings(zf)
+            self.xml = {sheet: zf.read(part).decode('utf-8') for sheet, part in self.parts.items()}
+            names = defined_names(zf, list(self.parts))
+
+        self.sheets = {sheet.casefold(): sheet for sheet in self.parts}
+        self.grids, self.formulas = {}, []
+        for sheet, xml in self.xml.items():
+            self.read_sheet(sheet, xml, strings)
+
+        # Whole columns (rows) span the rows (columns) used by any sheet, so they have the same size in every sheet
+        self.max_row = max(grid.shape[0] for grid in self.grids.values())
+        self.max_col = max(grid.shape[1] for grid in self.grids.values())
+
+        self.names = {}
+        for (scope, name), text in names.items():
+            try: self.names[(scope.casefold() if scope else None, name)] = parse_formula(text)
+            except Exception: self.names[(scope.casefold() if scope else None, name)] = ('err', NAME)
+
+        self.ranges = {}    # Values of the ranges read by the formulas, valid for as long as their cells are not recalculated
+
+    def read_sheet(self, sheet, xml, strings):
+        """
+        Cached values and formulas of a sheet part; formulas sharing the formula of a master cell are parsed only once
+        """
+        values, formulas, shared, masters = {}, [], [], {}
+        for cell in cell_pattern.finditer(xml):
+            r, c = int(cell.group(2)), column_index_from_string(cell.group(1))
+            attributes, content = cell.group(3), cell.group(4)
+            values[(r, c)] = cached_value(attributes, content, strings)
+            if not content or '<f' not in content: continue
+
+            f = formula_pattern.search(content)
+            f_attributes, text = f.group(1), html.unescape(f.group(2) or '')
+            f_type = re.search(r'\bt="([^"]+)"', f_attributes)
+            f_type = f_type.group(1) if f_type else 'normal'
+            si = re.search(r'\bsi="(\d+)"', f_attributes)
+            ref = re.search(r'\bref="([^"]+)"', f_attributes)
+
+            if f_type == 'shared' and not text.strip():
+                shared.append((r, c, si.group(1)))
+                continue
+            if f_type == 'shared': masters[si.group(1)] = (r, c)
+
+            try:
+                node, error = parse_formula(text), None
+            except Exception as e:
+                node, error = None, f"that cannot be parsed ({e})"
+            bounds = None
+            if f_type == 'array':
+                bounds = parse_ref(ref.group(1) if ref else get_column_letter(c) + str(r))[2:6]
+            elif f_type not in ('normal', 'shared'):
+                error = f"of type {f_type}"
+            formulas.append(Formula(sheet.casefold(), r, c, node, bounds, f_type == 'array' and 'cm=' in attributes, error))
+
+        # Cells of shared formulas take the formula of their master cell, moved by their distance from it
+        by_cell = {(f.row, f.col): f for f in formulas}
+        for r, c, si in shared:
+            master = by_cell.get(masters.get(si))
+            if master is None: continue
+            node = shift(master.node, r - master.row, c - master.col) if master.node is not None else None
+            formulas.append(Formula(sheet.casefold(), r, c, node, error=master.error))
+
+        rows = max((r for r, c in values), default=0)
+        cols = max((c for r, c in values), default=0)
+        grid = np.full((rows, cols), None, dtype=object)
+        for (r, c), value in values.items(): grid[r - 1, c - 1] = value
+
+        self.grids[sheet.casefold()] = grid
+        self.formulas.extend(formulas)
+
+    def resolve(self, node, sheet):
+        """
+        Sheet and bounds (r0, c0, r1, c1) of a reference, with whole columns and rows bound to the used cells of the workbook
+        """
+        _, ref_sheet, r0, c0, r1, c1, _ = node
+        ref_sheet = ref_sheet or sheet
+        if ref_sheet not in self.grids: raise REF
+        if r0 is None: r0, r1 = 1, self.max_row
+        if c0 is None: c0, c1 = 1, self.max_col
+        return ref_sheet, min(r0, r1), min(c0, c1), max(r0, r1), max(c0, c1)
+
+    def name(self, name, sheet):
+        node = self.names.get((sheet, name), self.names.get((None, name)))
+        return node if node is not None else ('err', NAME)
+
+    def values(self, sheet, r0, c0, r1, c1):
+        """
+        Values of a range as a 2D array (cells beyond the used range of the sheet are blank)
+        """
+        key = (sheet, r0, c0, r1, c1)
+        if key not in self.ranges:
+            grid = self.grids[sheet]
+            values = np.full((r1 - r0 + 1, c1 - c0 + 1), None, dtype=object)
+            rows, cols = min(r1, grid.shape[0]) - r0 + 1, min(c1, grid.shape[1]) - c0 + 1
+            if rows > 0 and cols > 0: values[:rows, :cols] = grid[r0 - 1:r0 - 1 + rows, c0 - 1:c0 - 1 + cols]
+            self.ranges[key] = values
+        return self.ranges[key]
+
+    def spill(self, node, sheet):
+        """
+        Range spilled by the dynamic array formula of a cell (ANCHORARRAY)
+        """
+        if node[0] != 'ref': raise VALUE
+        ref_sheet, r, c, _, _ = self.resolve(node, sheet)
+        f = self.anchors.get((ref_sheet, r, c))
+        if f is None or not f.array: return self.values(ref_sheet, r, c, r, c)
+        return self.values(ref_sheet, *f.ref)
+
+    def precedents(self, f):
+        """
+        Ranges (sheet, r0, c0, r1, c1) read by a formula, including those of the defined names it uses
+        """
+        ranges, nodes, seen = [], [f.node], set()
+        while nodes:
+            for node in walk(nodes.pop()):
+                if node[0] == 'ref':
+                    try: ranges.append(self.resolve(node, f.sheet))
+                    except ExcelError: pass
+                elif node[0] == 'name' and node[1] not in seen:
+                    seen.add(node[1])
+                    nodes.append(self.name(node[1], f.sheet))
+        return ranges
+
+    """
+    Evaluation
+    """
+
+    def evaluate(self, node):
+        kind = node[0]
+        if kind == 'ref': return self.values(*self.resolve(node, self.sheet))
+        if kind == 'name': return self.evaluate(self.name(node[1], self.sheet))
+        if kind in ('num', 'str', 'bool', 'err', 'array'): return node[1]
+        if kind == 'blank': return None
+        if kind == 'op': return elementwise(operators[node[1]], self.operand(node[2]), self.operand(node[3]))
+        if kind == 'neg': return elementwise(lambda x: -to_number(x), self.operand(node[1]))
+        if kind == 'pct': return elementwise(lambda x: to_number(x) / 100, self.operand(node[1]))
+        return self.call(node[1], node[2])
+
+    def operand(self, node):
+        value = self.evaluate(node)
+        return value if self.array_mode else self.intersect(node, value)
+
+    def intersect(self, node, value):
+        """
+        Implicit intersection of a multi-cell reference with the row or column of the formula, as in formulas that are not array formulas
+        """
+        while node[0] == 'name': node = self.name(node[1], self.sheet)
+        if node[0] != 'ref' or not isinstance(value, np.ndarray) or value.size == 1: return value
+        _, r0, c0, r1, c1 = self.resolve(node, self.sheet)
+        i = 0 if r0 == r1 else self.row - r0
+        j = 0 if c0 == c1 else self.col - c0
+        if 0 <= i < value.shape[0] and 0 <= j < value.shape[1]: return value[i, j]
+        return VALUE
+
+    def call(self, name, args):
+        if name == 'ANCHORARRAY': return self.spill(args[0], self.sheet)
+        f, array_args = functions[name]
+
+        values, array_mode = [], self.array_mode
+        for i, arg in enumerate(args):
+            self.array_mode = array_mode or name == 'SUMPRODUCT'   # SUMPRODUCT evaluates its arguments as arrays
+            value = self.evaluate(arg)
+            if not self.array_mode and array_args is not True and i not in array_args: value = self.intersect(arg, value)
+            values.append(value)
+        self.array_mode = array_mode
+
+        try: return f(*values)
+        except ExcelError as e: return e
+        except (TypeError, ValueError, IndexError): return VALUE
+
+    def calculate(self, f):
+        """
+        Evaluates a formula; returns its cells and their new values
+        """
+        self.sheet, self.row, self.col, self.array_mode = f.sheet, f.row, f.col, f.array
+        value = self.evaluate(f.node)
+
+        if not f.array:
+            if isinstance(value, np.ndarray):
+                value = self.intersect(f.node, value) if value.size != 1 else value[0, 0]
+                if isinstance(value, np.ndarray): value = value[0, 0] if value.size else CALC
+            return {(f.row, f.col): value}
+
+        r0, c0, r1, c1 = f.ref
+        value = as_array(value)
+        if not f.dynamic:
+            # Array formulas repeat single rows and columns over their cells and pad the rest with #N/A
+            value = conform([value, np.empty((r1 - r0 + 1, c1 - c0 + 1), dtype=object)])[0]
+        cells = {}
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                i, j = r - r0, c - c0
+                cells[(r, c)] = value[i, j] if i < value.shape[0] and j < value.shape[1] else EMPTY
+        if f.dynamic and (value.shape[0] > r1 - r0 + 1 or value.shape[1] > c1 - c0 + 1): self.truncated += 1
+        return cells
+
+    def recalculate(self, sheets=None):
+        """
+        Recalculates the formulas depending on the cells of the given sheets (every formula if None) in dependency order. Returns the
+        changed cells of each sheet
+        """
+        self.anchors = {(f.sheet, f.row, f.col): f for f in self.formulas}
+        ids = {sheet: np.full(grid.shape, -1) for sheet, grid in self.grids.items()}
+        for i, f in enumerate(self.formulas):
+            r0, c0, r1, c1 = f.ref if f.array else (f.row, f.col, f.row, f.col)
+            ids[f.sheet][r0 - 1:r1, c0 - 1:c1] = i
+
+        # Formulas read by every formula, from the formula cells within the ranges it reads
+        roots = None if sheets is None else {sheet.casefold() for sheet in sheets}
+        preceding, dirty, found = [], [], {}
+        for i, f in enumerate(self.formulas):
+            ranges = self.precedents(f) if f.node is not None else []
+            formulas = set()
+            for key in ranges:
+                if key not in found:
+                    sheet, r0, c0, r1, c1 = key
+                    found[key] = set(np.unique(ids[sheet][r0 - 1:r1, c0 - 1:c1]).tolist()) - {-1}
+                formulas |= found[key]
+            preceding.append(formulas - {i})
+            dirty.append(roots is None or f.sheet in roots or any(key[0] in roots for key in ranges))
+
+        # Topological order (Kahn); formulas within circular references are left as they are
+        following = [[] for _ in self.formulas]
+        pending = [len(p) for p in preceding]
+        for i, p in enumerate(preceding):
+            for j in p: following[j].append(i)
+        order = [i for i, n in enumerate(pending) if n == 0]
+        for i in order:
+            for j in following[i]:
+                pending[j] -= 1
+                if pending[j] == 0: order.append(j)
+        circular = len(self.formulas) - len(order)
+
+        changes, calculated, self.truncated = {}, 0, 0
+        unsupported = {}
+        for i in order:
+            f = self.formulas[i]
+            dirty[i] = dirty[i] or any(dirty[j] for j in preceding[i])
+            if not dirty[i]: continue
+            error = f.error or next((f"using {node[1]}" for node in walk(f.node) if node[0] == 'fn' and node[1] not in functions
+                                     and node[1] != 'ANCHORARRAY'), None)
+            if error:
+                unsupported[error] = unsupported.get(error, 0) + 1
+                continue
+
+            for (r, c), value in self.calculate(f).items():
+                value = cell_result(value)
+                old = self.grids[f.sheet][r - 1, c - 1] if r <= self.grids[f.sheet].shape[0] and c <= self.grids[f.sheet].shape[1] else None
+                if same_value(old, value): continue
+                self.grids[f.sheet][r - 1, c - 1] = None if value is EMPTY else value
+                changes.setdefault(f.sheet, {})[(r, c)] = value
+            calculated += 1
+
+        for error, n in unsupported.items(): print(f"Kept the cached values of {n} formulas that {error}")
+        if circular: print(f"Kept the cached values of {circular} formulas within circular references")
+        if self.truncated: print(f"{self.truncated} dynamic arrays spill beyond their previous range; the extra values are not written")
+        print(f"Recalculated {calculated} formulas of {os.path.basename(self.path)} "
+              f"({sum(len(cells) for cells in changes.values())} cells changed)")
+        return changes
+
+    def save(self, changes, path=None):
+        """
+        Writes the changed values into the sheet parts of the workbook, copying every other part unchanged
+        """
+        path = path or self.path
+        parts = {}
+        for sheet, cells in changes.items():
+            name = self.sheets[sheet]
+            def update(cell):
+                key = (int(cell.group(2)), column_index_from_string(cell.group(1)))
+                return cell_xml(cell, cells[key]) if key in cells else cell.group(0)
+            parts[self.parts[name]] = cell_pattern.sub(update, self.xml[name])
+
+        # Written into a temporary file first so an interrupted run does not leave a corrupted spreadsheet
+        with zipfile.ZipFile(self.path) as zin, zipfile.ZipFile(f"{path}.{os.getpid()}.tmp", 'w', zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                zout.writestr(info, parts[info.filename].encode('utf-8') if info.filename in parts else zin.read(info))
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+def cell_result(value):
+    # Values as stored by Excel: blanks returned by formulas are 0 and numbers are floats
+    if value is None: return 0.0
+    if value is EMPTY or isinstance(value, (ExcelError, str)): return value if not isinstance(value, str) else str(value)
+    if isinstance(value, (bool, np.bool_)): return bool(value)
+    value = float(value)
+    return NUM if math.isinf(value) or math.isnan(value) else value
+
+def same_value(old, new):
+    if new is EMPTY: return old is None
+    if is_number(old) and is_number(new): return math.isclose(old, new, rel_tol=1e-12) or old == new
+    return type(old) is type(new) and old == new
+
+def cell_xml(cell, value):
+    """
+    Cell with a new cached value, keeping its style and formula
+    """
+    ref = cell.group(1) + cell.group(2)
+    attributes = re.sub(r'\s+t="[^"]*"', '', cell.group(3))
+    formula = formula_pattern.search(cell.group(4) or '')
+    formula = formula.group(0) if formula else ''
+
+    if value is EMPTY: return f'<c r="{ref}"{attributes}>{formula}</c>' if formula else f'<c r="{ref}"{attributes}/>'
+    if isinstance(value, bool): cell_type, value = ' t="b"', int(value)
+    elif isinstance(value, ExcelError): cell_type, value = ' t="e"', html.escape(value.code, quote=False)
+    elif isinstance(value, str):
+        space = ' xml:space="preserve"' if value != value.strip() else ''
+        return f'<c r="{ref}"{attributes} t="str">{formula}<v{space}>{html.escape(value, quote=False)}</v></c>'
+    else: cell_type, value = '', repr(value)
+    return f'<c r="{ref}"{attributes}{cell_type}>{formula}<v>{value}</v></c>'
+
+def recalculate(spreadsheet, sheets=None, target=None):
+    """
+    Recalculates the formulas of a spreadsheet that depend on the given sheets (every formula if None) and writes their values into
+    the target spreadsheet (the spreadsheet itself by default)
+    """
+    book = Book(spreadsheet)
+    changes = book.recalculate(sheets)
+    if changes or (target and target != spreadsheet): book.save(changes, target)
+    return changes
+
+if __name__ == "__main__":
+    import sys
+    recalculate(sys.argv[1], sys.argv[2:] or None)